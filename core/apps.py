@@ -6,4 +6,5 @@ class CoreConfig(AppConfig):
     name = 'core'
 
     def ready(self) -> None:
+        import core.checks
         import core.signals.handlers
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+This module contains the system checks of the core app.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+from . import profiling
+
+# Cache backends whose entries are only seen by the process that wrote them.
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def check_shared_cache(setting, alias, check_id, consequence):
+    """
+    Returns a warning when the CACHE alias of a setting is a cache that
+    other processes do not see, and an empty list otherwise.
+
+    Args:
+        setting (str): The name of the setting holding the alias.
+        alias (str): The cache alias.
+        check_id (str): The ID of the warning.
+        consequence (str): What goes wrong when the cache is not shared.
+    """
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f"{setting}['CACHE'] is '{alias}', a {backend.rsplit('.', 1)[-1]} "
+        f"that other processes do not see. {consequence}",
+        hint=f"Point {setting}['CACHE'] to a cache shared by all processes, "
+             "such as Redis or Memcached, when running several processes.",
+        id=check_id)]
+
+
+@register()
+def check_profiling_cache(app_configs, **kwargs):
+    return check_shared_cache(
+        'PROFILING', profiling.get_config()['CACHE'], 'core.W001',
+        'The admin profile pages only list the profiles of the process serving them.')
@@ -0,0 +1,107 @@
+"""
+This module coalesces concurrent identical requests.
+
+When several threads of a process handle the same request at the same
+time, only the first one runs the view; the others wait for it and
+answer with a copy of its response, so a burst of identical requests
+costs one set of queries and one serializer run.
+"""
+import threading
+
+from django.http import HttpResponse
+from rest_framework.response import Response
+from .metrics import registry
+
+
+class Flight:
+    """ A call in progress, and its outcome once done. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Calls made with the key of a
+    call in progress wait for it and share its outcome.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, function, timeout=None):
+        """
+        Returns the result of function() and whether it was shared with a
+        call in progress. After waiting timeout seconds for a call in
+        progress, the function is run independently.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result, True
+            return function(), False
+
+        try:
+            flight.result = function()
+            return flight.result, False
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+flights = SingleFlight()
+
+
+def copy_response(response):
+    copy = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        copy[header] = value
+    return copy
+
+
+class CoalescingListMixin:
+    """
+    Coalesces concurrent identical anonymous requests to the list action
+    of a viewset. Authenticated requests are never shared, since their
+    responses may depend on the user.
+    """
+    coalesce_timeout = 10
+
+    def list(self, request, *args, **kwargs):
+        if request.user and request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+
+        key = (
+            type(self).__qualname__,
+            request.get_full_path(),
+            request.accepted_media_type,
+            request.headers.get('If-None-Match'),
+            request.headers.get('If-Modified-Since'),
+        )
+        response, shared = flights.do(
+            key, lambda: self.render_list(request, *args, **kwargs), self.coalesce_timeout)
+        if shared:
+            registry.increment('coalesced_requests_total', route=request.resolver_match.url_name)
+        return copy_response(response)
+
+    def render_list(self, request, *args, **kwargs):
+        """ Runs the list action and renders its response, so that it can be shared. """
+        response = super().list(request, *args, **kwargs)
+        if isinstance(response, Response):
+            response = self.finalize_response(request, response, *args, **kwargs)
+            response.render()
+        return response
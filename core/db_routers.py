@@ -0,0 +1,109 @@
+"""
+This module contains the database router that sends catalog reads to
+read replicas.
+
+The router only routes reads to a replica while
+core.middleware.ReplicaRoutingMiddleware has marked the current request as
+replica-safe. Everything else, including every write, stays on default.
+"""
+import logging
+import random
+import threading
+from contextvars import ContextVar
+from time import monotonic
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Whether the reads of the current request may go to a replica.
+use_replica = ContextVar('use_replica', default=False)
+
+
+def get_config():
+    config = {
+        'REPLICAS': [],
+        'VIEWS': [],
+        'PIN_SECONDS': 5,
+        'MAX_LAG_SECONDS': 10,
+        'LAG_CHECK_INTERVAL': 5,
+    }
+    config.update(getattr(settings, 'READ_REPLICAS', {}))
+    return config
+
+
+class ReplicaLagMonitor:
+    """
+    This class measures the replication lag of the replicas and caches
+    it for LAG_CHECK_INTERVAL seconds, so that at most one lag query per
+    replica and interval is run by each process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = {}
+        self.lag = {}
+
+    def is_healthy(self, alias, config):
+        now = monotonic()
+        with self.lock:
+            fresh = now - self.checked_at.get(alias, float('-inf')) < config['LAG_CHECK_INTERVAL']
+            if fresh:
+                return self.lag[alias] <= config['MAX_LAG_SECONDS']
+            # Other threads keep using the previous value while this one checks.
+            self.checked_at[alias] = now
+            self.lag.setdefault(alias, 0)
+
+        lag = self.measure(alias)
+        with self.lock:
+            self.lag[alias] = lag
+        if lag > config['MAX_LAG_SECONDS']:
+            logger.warning('Replica %s is %.1f s behind, reading from default.', alias, lag)
+        return lag <= config['MAX_LAG_SECONDS']
+
+    def measure(self, alias):
+        """ Returns the replication lag of a replica in seconds, or infinity if it is unreachable. """
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END')
+                return float(cursor.fetchone()[0])
+        except DatabaseError:
+            logger.exception('Could not measure the lag of replica %s.', alias)
+            return float('inf')
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+class PrimaryReplicaRouter:
+    """
+    Routes reads of replica-safe requests to a random healthy replica
+    listed in settings.READ_REPLICAS['REPLICAS'], and everything else to
+    the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not use_replica.get():
+            return None
+        config = get_config()
+        replicas = [alias for alias in config['REPLICAS']
+                    if lag_monitor.is_healthy(alias, config)]
+        if not replicas:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as default.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_config()['REPLICAS']
@@ -0,0 +1,62 @@
+"""
+This module defines the benchmark_connections management command.
+
+The command measures what a request pays to get a database connection
+and to run the catalog's hottest queries, so that the pooled backend can
+be compared with the stock PostgreSQL backend.
+"""
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from store.benchmarks import percentile
+from store.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Simulates --requests requests that each connect, run --queries product
+    lookups and close the connection, as requests do when CONN_MAX_AGE is 0.
+
+    Run it once with the stock backend and once with core.postgresql_pool
+    to compare the connection and query latencies.
+    """
+    help = 'Measures the connection setup and query latency of a database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default',
+                            help='Database alias to benchmark.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of simulated requests.')
+        parser.add_argument('--queries', type=int, default=5,
+                            help='Product lookups per simulated request.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Connection benchmarks need a PostgreSQL database.')
+        product_ids = list(Product.objects.using(options['database'])
+                           .values_list('id', flat=True)[:100])
+        if not product_ids:
+            raise CommandError('There are no products; run seed_store first.')
+        connection.close()
+
+        connect_times, query_times = [], []
+        for number in range(options['requests']):
+            started = perf_counter()
+            connection.ensure_connection()
+            connected = perf_counter()
+            for offset in range(options['queries']):
+                product_id = product_ids[(number + offset) % len(product_ids)]
+                Product.objects.using(options['database']) \
+                    .select_related('collection').get(pk=product_id)
+            query_times.append((perf_counter() - connected) / options['queries'])
+            connect_times.append(connected - started)
+            connection.close()
+
+        self.stdout.write(f"Engine: {connection.settings_dict['ENGINE']}")
+        for label, times in (('connect', connect_times), ('query', query_times)):
+            times.sort()
+            self.stdout.write(
+                f'{label:8} p50 {percentile(times, 0.5) * 1000:7.2f} ms  '
+                f'p95 {percentile(times, 0.95) * 1000:7.2f} ms')
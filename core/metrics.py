@@ -0,0 +1,124 @@
+"""
+This module contains the in-process metrics registry.
+
+Metrics are kept per process in memory and rendered in the Prometheus
+text exposition format by the metrics view, so they can be scraped
+without any external dependency.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """
+    This class represents a cumulative histogram with fixed buckets.
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets.
+        counts (list): The number of observations per bucket, plus +Inf.
+        sum (float): The sum of all observations.
+        count (int): The number of observations.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    This class holds the histograms and counters of the process.
+
+    Every metric is labelled by a single set of label values, usually
+    the route name of the request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self.help = {}
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text exposition format. """
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                self.render_header(lines, name, 'counter')
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+
+            for name in sorted({name for name, _ in self.histograms}):
+                self.render_header(lines, name, 'histogram')
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric == name:
+                        self.render_histogram(lines, name, labels, histogram)
+        return '\n'.join(lines) + '\n'
+
+    def render_header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f'# HELP {name} {self.help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def render_histogram(self, lines, name, labels, histogram):
+        cumulative = 0
+        bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            bucket_labels = labels + (('le', bound),)
+            lines.append(f'{name}_bucket{format_labels(bucket_labels)} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{key}="{escape_label(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+registry.describe('http_request_duration_seconds', 'Wall time spent handling the request.')
+registry.describe('http_response_size_bytes', 'Size of the response body.')
+registry.describe('db_queries_per_request', 'Number of SQL queries run by the request.')
+registry.describe('db_duration_seconds', 'Time spent waiting on SQL queries.')
+registry.describe('app_duration_seconds', 'Time spent in the view outside SQL queries, mostly serialization.')
+registry.describe('render_duration_seconds', 'Time spent rendering the response body.')
+registry.describe('n_plus_one_total', 'Requests that repeated the same SQL shape too often.')
+registry.describe('throttled_requests_total', 'Requests rejected by a token bucket throttle.')
+registry.describe('coalesced_requests_total', 'Requests answered with the response of an identical concurrent request.')
@@ -0,0 +1,302 @@
+"""
+This module contains the middleware of the core app.
+"""
+import gzip
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from .db_routers import get_config as get_replica_config, use_replica
+from .metrics import COUNT_BUCKETS, SIZE_BUCKETS, registry
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class QueryProfile:
+    """
+    This class is installed as a database execute wrapper and records
+    the number, duration and shape of the SQL queries of a request.
+
+    Attributes:
+        count (int): The number of queries run.
+        duration (float): The time spent in the database, in seconds.
+        shapes (Counter): The number of times each SQL statement was run.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - start
+            self.count += 1
+            # Django keeps the parameters out of the SQL text, so the same
+            # text with different parameters is the same query shape.
+            self.shapes[sql] += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the wall time, database time, query count, view time, render
+    time and response size of every request in the metrics registry,
+    labelled by route name, and logs requests that look like an N+1.
+
+    The middleware supports both sync and async handlers, so it does not
+    force async views onto a thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'REQUEST_METRICS', {})
+        self.n_plus_one_threshold = config.get('N_PLUS_ONE_THRESHOLD', 10)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, start = self.start(request)
+        with self.wrap_connections(profile):
+            response = self.get_response(request)
+        self.finish(request, response, profile, start)
+        return response
+
+    async def __acall__(self, request):
+        profile, start = self.start(request)
+        with self.wrap_connections(profile):
+            response = await self.get_response(request)
+        self.finish(request, response, profile, start)
+        return response
+
+    def start(self, request):
+        start = perf_counter()
+        request._metrics_timings = {'view_start': start}
+        return QueryProfile(), start
+
+    def wrap_connections(self, profile):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        return stack
+
+    def finish(self, request, response, profile, start):
+        duration = perf_counter() - start
+        route = self.get_route(request)
+        registry.observe('http_request_duration_seconds', duration, route=route)
+        registry.observe('db_queries_per_request', profile.count,
+                         buckets=COUNT_BUCKETS, route=route)
+        registry.observe('db_duration_seconds', profile.duration, route=route)
+        if not response.streaming:
+            registry.observe('http_response_size_bytes', len(response.content),
+                             buckets=SIZE_BUCKETS, route=route)
+
+        timings = request._metrics_timings
+        if 'view' in timings:
+            view_duration = timings['view'] - profile.duration
+            registry.observe('app_duration_seconds', max(view_duration, 0), route=route)
+        if 'render' in timings:
+            registry.observe('render_duration_seconds', timings['render'], route=route)
+
+        self.check_n_plus_one(route, profile)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns: the time up
+        # to here is the view, the time until the post render callback is
+        # the renderer.
+        timings = request._metrics_timings
+        render_start = perf_counter()
+        timings['view'] = render_start - timings['view_start']
+
+        def record_render(rendered):
+            timings['render'] = perf_counter() - render_start
+        response.add_post_render_callback(record_render)
+        return response
+
+    def get_route(self, request):
+        match = request.resolver_match
+        if match is None or not match.url_name:
+            return 'unmatched'
+        return match.url_name
+
+    def check_n_plus_one(self, route, profile):
+        if not profile.shapes:
+            return
+        sql, repeats = profile.shapes.most_common(1)[0]
+        if repeats >= self.n_plus_one_threshold:
+            registry.increment('n_plus_one_total', route=route)
+            logger.warning(
+                'Possible N+1 on %s: the same query ran %d times: %s',
+                route, repeats, sql)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks safe requests to the views listed in settings.READ_REPLICAS['VIEWS']
+    as replica-safe for core.db_routers.PrimaryReplicaRouter.
+
+    After a successful write, the client is pinned to the default database
+    for PIN_SECONDS so that it reads its own writes: the pin expiry is sent
+    both as a cookie and as the X-Pin-Primary response header, which
+    clients without cookies can send back as a request header.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'pin_primary'
+    header_name = 'X-Pin-Primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_replica_config()
+        self.views = set(config['VIEWS']) if config['REPLICAS'] else set()
+        self.pin_seconds = config['PIN_SECONDS']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = use_replica.set(self.is_replica_safe(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin_after_write(request, response)
+
+    async def __acall__(self, request):
+        token = use_replica.set(self.is_replica_safe(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.pin_after_write(request, response)
+
+    def is_replica_safe(self, request):
+        if not self.views or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return False
+        if self.is_pinned(request):
+            return False
+        try:
+            view = resolve(request.path_info).func
+        except Resolver404:
+            return False
+        view_class = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+        if view_class is None:
+            return False
+        return f'{view_class.__module__}.{view_class.__name__}' in self.views
+
+    def is_pinned(self, request):
+        value = request.COOKIES.get(self.cookie_name) or request.headers.get(self.header_name)
+        try:
+            return float(value) > time.time()
+        except (TypeError, ValueError):
+            return False
+
+    def pin_after_write(self, request, response):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') or response.status_code >= 400:
+            return response
+        expires = time.time() + self.pin_seconds
+        response.set_cookie(self.cookie_name, f'{expires:.3f}',
+                            max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        response[self.header_name] = f'{expires:.3f}'
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip, whichever the client prefers
+    in Accept-Encoding, with brotli winning ties when it is installed.
+
+    Only responses of at least MIN_SIZE bytes whose content type is listed
+    in settings.COMPRESSION['CONTENT_TYPES'] are compressed. HTML is left
+    out by default: pages that reflect user input next to a secret such as
+    the CSRF token would be open to BREACH.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'COMPRESSION', {})
+        self.min_size = config.get('MIN_SIZE', 1024)
+        self.content_types = set(config.get('CONTENT_TYPES', ['application/json']))
+        self.gzip_level = config.get('GZIP_LEVEL', 6)
+        self.brotli_quality = config.get('BROTLI_QUALITY', 4)
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def get_encoding(self, request):
+        """ Returns the supported content coding with the highest q-value, if any. """
+        accepted = {}
+        for part in request.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = part.partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0
+            accepted[coding.strip().lower()] = quality
+
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, accepted.get('*', 0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in self.content_types or len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.get_encoding(request)
+        if encoding == 'br':
+            content = brotli.compress(response.content, quality=self.brotli_quality)
+        elif encoding == 'gzip':
+            content = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response.headers['Content-Length'] = str(len(content))
+        response.headers['Content-Encoding'] = encoding
+        # The compressed body is no longer byte-for-byte the entity the
+        # strong validator was computed for.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
@@ -7,4 +7,10 @@ class User(AbstractUser):
   Custom user model.
   This class extends the default user model provided by Django.
   """
-  email = models.EmailField(unique=True)
\ No newline at end of file
+  email = models.EmailField(unique=True)
+
+  class Meta(AbstractUser.Meta):
+    # Customers are ordered by name in the API and the admin.
+    indexes = [
+      models.Index(fields=['first_name', 'last_name'], name='core_user_name_idx'),
+    ]
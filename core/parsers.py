@@ -0,0 +1,28 @@
+"""
+This module contains the parsers of the API.
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from .renderers import FastJSONRenderer, orjson
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parses JSON with orjson when it is installed, and with DRF's
+    JSONParser otherwise.
+
+    orjson only reads UTF-8 and rejects NaN and Infinity, so other
+    encodings and STRICT_JSON = False use the fallback.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
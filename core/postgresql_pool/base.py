@@ -0,0 +1,182 @@
+"""
+PostgreSQL database backend with a per-process connection pool and
+automatic server-side prepared statements.
+
+It is a drop-in replacement for django.db.backends.postgresql:
+
+    'ENGINE': 'core.postgresql_pool',
+    'OPTIONS': {
+        'POOL': {'MAX_SIZE': 10, 'IDLE_TIMEOUT': 300, 'HEALTH_CHECK_AFTER': 30, 'TIMEOUT': 10},
+        'PREPARE_THRESHOLD': 5,
+        'MAX_PREPARED': 100,
+    },
+
+Closing a Django connection, which happens at the end of every request
+when CONN_MAX_AGE is 0, returns the open connection to the pool instead
+of closing it, so requests skip the TCP/TLS handshake and authentication.
+A SELECT run PREPARE_THRESHOLD times on a connection is prepared on the
+server and executed with EXECUTE from then on, so PostgreSQL skips
+parsing and planning it.
+"""
+import re
+from collections import Counter, OrderedDict
+
+import psycopg2
+from psycopg2 import extensions
+from django.db.backends.postgresql import base
+from .pool import get_pool
+
+PLACEHOLDER = re.compile(r'%(s|%)')
+# Statements executed fewer times than the threshold are forgotten past this many.
+MAX_TRACKED = 1000
+
+
+class PreparingConnection(extensions.connection):
+    """
+    A psycopg2 connection that remembers the statements prepared on it.
+
+    Attributes:
+        prepare_threshold (int): Executions of a SELECT before it is prepared, or None.
+        max_prepared (int): The number of prepared statements kept per connection.
+        prepared (OrderedDict): The statement names keyed by SQL, least recently used first.
+        executions (Counter): The number of executions of each SQL not prepared yet.
+        unpreparable (set): The SQL that PostgreSQL refused to prepare.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepare_threshold = None
+        self.max_prepared = 100
+        self.prepared = OrderedDict()
+        self.executions = Counter()
+        self.unpreparable = set()
+        self.statement_number = 0
+
+
+class PreparingCursor(extensions.cursor):
+    """
+    A psycopg2 cursor that executes hot SELECT statements through
+    server-side prepared statements.
+    """
+
+    def execute(self, sql, params=None):
+        name = self.get_statement(sql, params)
+        if name is None:
+            return super().execute(sql, params)
+        placeholders = ', '.join(['%s'] * len(params))
+        return super().execute(f'EXECUTE {name} ({placeholders})', params)
+
+    def get_statement(self, sql, params):
+        """ Returns the name of the prepared statement to run sql with, if any. """
+        connection = self.connection
+        if (connection.prepare_threshold is None or self.name
+                or not isinstance(params, (list, tuple)) or not params
+                or not sql.lstrip()[:6].upper() == 'SELECT'):
+            return None
+
+        name = connection.prepared.get(sql)
+        if name is not None:
+            connection.prepared.move_to_end(sql)
+            return name
+        if sql in connection.unpreparable:
+            return None
+
+        if sql not in connection.executions and len(connection.executions) >= MAX_TRACKED:
+            connection.executions.clear()
+        connection.executions[sql] += 1
+        if connection.executions[sql] < connection.prepare_threshold:
+            return None
+        # A failed PREPARE would abort the surrounding transaction, so
+        # statements are only prepared outside of transactions.
+        if (not connection.autocommit
+                or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE):
+            return None
+        return self.prepare(sql, params)
+
+    def prepare(self, sql, params):
+        connection = self.connection
+        del connection.executions[sql]
+        positional, count = self.to_positional(sql)
+        if count != len(params):
+            connection.unpreparable.add(sql)
+            return None
+
+        connection.statement_number += 1
+        name = f'django_{connection.statement_number}'
+        try:
+            super().execute(f'PREPARE {name} AS {positional}')
+        except psycopg2.Error:
+            # e.g. a parameter whose type PostgreSQL cannot infer.
+            connection.unpreparable.add(sql)
+            return None
+
+        connection.prepared[sql] = name
+        if len(connection.prepared) > connection.max_prepared:
+            _, evicted = connection.prepared.popitem(last=False)
+            super().execute(f'DEALLOCATE {evicted}')
+        return name
+
+    @staticmethod
+    def to_positional(sql):
+        """ Turns the %s placeholders of Django's SQL into $1, $2, ... """
+        count = 0
+
+        def replace(match):
+            nonlocal count
+            if match.group(1) == '%':
+                return '%'
+            count += 1
+            return f'${count}'
+        return PLACEHOLDER.sub(replace, sql), count
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Hands out connections from a per-process pool and returns them to it
+    when Django closes the connection.
+    """
+    pool_options = ('POOL', 'PREPARE_THRESHOLD', 'MAX_PREPARED')
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for option in self.pool_options:
+            params.pop(option, None)
+        params['connection_factory'] = PreparingConnection
+        return params
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict['OPTIONS'].get('POOL', {})
+        key = tuple(sorted(
+            (name, str(value)) for name, value in conn_params.items()
+            if name != 'connection_factory'))
+        return get_pool(
+            key,
+            lambda: self.open_connection(conn_params),
+            max_size=options.get('MAX_SIZE', 10),
+            idle_timeout=options.get('IDLE_TIMEOUT', 300),
+            health_check_after=options.get('HEALTH_CHECK_AFTER', 30),
+            timeout=options.get('TIMEOUT', 10))
+
+    def open_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        options = self.settings_dict['OPTIONS']
+        connection.cursor_factory = PreparingCursor
+        connection.prepare_threshold = options.get('PREPARE_THRESHOLD')
+        connection.max_prepared = options.get('MAX_PREPARED', 100)
+        return connection
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        connection = self.pool.acquire()
+        # The parent's get_new_connection sets these, but reused connections skip it.
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = base.IsolationLevel(
+            options.get('isolation_level', base.IsolationLevel.READ_COMMITTED))
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
@@ -0,0 +1,139 @@
+"""
+This module contains the per-process connection pool used by the
+core.postgresql_pool database backend.
+"""
+import os
+import threading
+from time import monotonic
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """ Raised when no connection became available within the pool timeout. """
+
+
+class ConnectionPool:
+    """
+    This class represents a bounded pool of open database connections.
+
+    Attributes:
+        connect (callable): Opens a new connection.
+        max_size (int): The maximum number of open connections, idle or in use.
+        idle_timeout (float): Idle connections older than this are closed, in seconds.
+        health_check_after (float): Connections idle for longer than this are
+            checked with a round trip before being handed out, in seconds.
+        timeout (float): How long acquire waits for a free connection, in seconds.
+    """
+
+    def __init__(self, connect, max_size=10, idle_timeout=300,
+                 health_check_after=30, timeout=10):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # Most recently released last, so that the warmest connection is
+        # reused first and the coldest ones can idle out.
+        self.idle = []
+        self.size = 0
+
+    def acquire(self):
+        """ Returns an open connection, reusing an idle one when possible. """
+        deadline = monotonic() + self.timeout
+        while True:
+            with self.condition:
+                self.close_expired()
+                if self.idle:
+                    connection, released_at = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    connection = None
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        raise PoolTimeout(
+                            f'No database connection became available within {self.timeout} s.')
+                    continue
+
+            if connection is None:
+                try:
+                    return self.connect()
+                except BaseException:
+                    self.discard(None)
+                    raise
+            if monotonic() - released_at < self.health_check_after or self.is_healthy(connection):
+                return connection
+            self.discard(connection)
+
+    def release(self, connection):
+        """ Returns a connection to the pool, or closes it if it cannot be reused. """
+        if connection.closed:
+            self.discard(None)
+            return
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        """ Closes a connection and frees its slot in the pool. """
+        if connection is not None and not connection.closed:
+            connection.close()
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close_expired(self):
+        """ Closes the idle connections older than idle_timeout. Holds the pool lock. """
+        now = monotonic()
+        keep = []
+        for connection, released_at in self.idle:
+            if now - released_at > self.idle_timeout:
+                connection.close()
+                self.size -= 1
+            else:
+                keep.append((connection, released_at))
+        self.idle = keep
+
+    def is_healthy(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def close_all(self):
+        with self.condition:
+            for connection, _ in self.idle:
+                connection.close()
+                self.size -= 1
+            self.idle = []
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, **options):
+    """
+    Returns the pool of the current process for the given connection
+    parameters, creating it on first use. Pools are not shared with
+    forked children, which open their own connections.
+    """
+    key = (os.getpid(), key)
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = ConnectionPool(connect, **options)
+        return pool
@@ -0,0 +1,262 @@
+"""
+This module contains the opt-in sampling profiler of requests.
+
+A request is profiled when a staff user sends the X-Profile header, or at
+random for a PROFILING['SAMPLE_RATE'] fraction of requests. While it runs,
+a sampler thread records the stack of the request's thread every INTERVAL
+seconds, and a database execute wrapper records the SQL timeline. Other
+requests only pay for a header lookup.
+
+Profiles are kept in a ring buffer of RING_SIZE slots in the CACHE alias,
+so that the admin page at /admin/profiles/ shows the profiles of every
+process when the cache is shared. Stacks are kept in the collapsed format
+of flamegraph.pl and speedscope, one "root;...;leaf" line per stack with
+its number of samples.
+"""
+import random
+import sys
+import threading
+import zlib
+from collections import Counter
+from contextlib import ExitStack
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from .metrics import registry
+
+HEADER = 'X-Profile'
+INDEX_KEY = 'profile:index'
+# Frames deeper than this are left out of the stacks.
+MAX_DEPTH = 128
+# Only the stacks with the most samples are kept in a profile.
+MAX_STACKS = 500
+# The height of a frame of the icicle graph, in pixels.
+RECT_HEIGHT = 18
+
+registry.describe('profiled_requests_total', 'Requests run under the sampling profiler.')
+
+
+def get_config():
+    config = {
+        'SAMPLE_RATE': 0,
+        'INTERVAL': 0.005,
+        'RING_SIZE': 50,
+        'MAX_QUERIES': 500,
+        'CACHE': 'default',
+        'TIMEOUT': 24 * 3600,
+    }
+    config.update(getattr(settings, 'PROFILING', {}))
+    return config
+
+
+def collapse(frame):
+    """ Returns the stack of a frame as "module:function" names from the root, joined by ';'. """
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """
+    This class samples the stack of another thread at a fixed interval.
+
+    Attributes:
+        stacks (Counter): The number of samples per collapsed stack.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class QueryTimeline:
+    """
+    This class is installed as a database execute wrapper and records the
+    start offset, duration and SQL of the queries of a profiled request.
+
+    Attributes:
+        queries (list): [offset_ms, duration_ms, sql] per query, up to max_queries.
+        dropped (int): The number of queries past max_queries.
+    """
+
+    def __init__(self, start, max_queries):
+        self.start = start
+        self.max_queries = max_queries
+        self.queries = []
+        self.dropped = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < self.max_queries:
+                self.queries.append([
+                    round((start - self.start) * 1000, 3),
+                    round((perf_counter() - start) * 1000, 3),
+                    sql])
+            else:
+                self.dropped += 1
+
+
+def save_profile(profile):
+    """ Stores a profile in the next slot of the ring buffer and returns its ID. """
+    config = get_config()
+    cache = caches[config['CACHE']]
+    cache.add(INDEX_KEY, 0, None)
+    try:
+        profile_id = cache.incr(INDEX_KEY)
+    except ValueError:
+        # The index was evicted between add and incr.
+        profile_id = 1
+        cache.set(INDEX_KEY, profile_id, None)
+    profile['id'] = profile_id
+    cache.set(f'profile:{profile_id % config["RING_SIZE"]}', profile, config['TIMEOUT'])
+    return profile_id
+
+
+def get_profiles():
+    """ Returns the profiles in the ring buffer, newest first. """
+    config = get_config()
+    keys = [f'profile:{slot}' for slot in range(config['RING_SIZE'])]
+    profiles = caches[config['CACHE']].get_many(keys).values()
+    return sorted(profiles, key=lambda profile: profile['id'], reverse=True)
+
+
+def get_profile(profile_id):
+    """ Returns a profile, or None when it was overwritten or expired. """
+    config = get_config()
+    profile = caches[config['CACHE']].get(f'profile:{profile_id % config["RING_SIZE"]}')
+    if profile is None or profile['id'] != profile_id:
+        return None
+    return profile
+
+
+def get_flame_rects(stacks, min_width=0.2):
+    """
+    Returns the rectangles of the icicle graph of collapsed stacks, as
+    dicts of name, samples, depth, top in pixels, and left and width
+    percentages.
+    Frames narrower than min_width percent are left out.
+    """
+    root = {'children': {}, 'samples': 0}
+    for stack, samples in stacks.items():
+        root['samples'] += samples
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'samples': 0})
+            node['samples'] += samples
+
+    rects = []
+    total = root['samples'] or 1
+
+    def visit(node, depth, left):
+        for name, child in sorted(node['children'].items()):
+            width = child['samples'] * 100 / total
+            if width >= min_width:
+                rects.append({'name': name, 'samples': child['samples'],
+                              'depth': depth, 'top': depth * RECT_HEIGHT,
+                              'left': round(left, 3), 'width': round(width, 3),
+                              'hue': zlib.crc32(name.split(':')[0].encode()) % 60})
+                visit(child, depth + 1, left)
+            left += width
+    visit(root, 0, 0)
+    return rects
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests of staff users that send the X-Profile header,
+    and a PROFILING['SAMPLE_RATE'] fraction of all requests. The ID of the
+    stored profile is returned in the X-Profile-Id response header.
+
+    Place it after AuthenticationMiddleware, so that staff users logged in
+    to the admin are recognized; API clients are recognized by their JWT.
+    Only sync requests are profiled: under ASGI, async views share their
+    thread with other requests, so their samples would be mixed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_config()
+        self.sample_rate = config['SAMPLE_RATE']
+        self.interval = config['INTERVAL']
+        self.max_queries = config['MAX_QUERIES']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+        return self.profile(request)
+
+    def should_profile(self, request):
+        if HEADER in request.headers:
+            return self.is_staff(request)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except (AuthenticationFailed, InvalidToken, TokenError):
+            return False
+        return result is not None and result[0].is_staff
+
+    def profile(self, request):
+        started_at = timezone.now()
+        start = perf_counter()
+        timeline = QueryTimeline(start, self.max_queries)
+        sampler = Sampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timeline))
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+
+        registry.increment('profiled_requests_total')
+        response['X-Profile-Id'] = str(save_profile({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'started_at': started_at,
+            'duration': round((perf_counter() - start) * 1000, 3),
+            'interval': self.interval,
+            'samples': sum(sampler.stacks.values()),
+            'stacks': dict(sampler.stacks.most_common(MAX_STACKS)),
+            'queries': timeline.queries,
+            'dropped_queries': timeline.dropped,
+        }))
+        return response
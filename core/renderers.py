@@ -0,0 +1,39 @@
+"""
+This module contains the renderers of the API.
+"""
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders JSON with orjson when it is installed, and with DRF's
+    JSONRenderer otherwise.
+
+    Output is the same as DRF's: Decimal, datetime and lazy strings go
+    through DRF's JSONEncoder, UUIDs are rendered natively, and U+2028
+    and U+2029 are escaped. Indented output, as requested by the
+    browsable API or '; indent=' media types, uses the fallback.
+    """
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=self.options)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits.
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
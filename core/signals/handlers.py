@@ -1,6 +1,14 @@
+import logging
 from django.dispatch import receiver
-from store.signals import order_created
+from store.signals import inventory_low, order_created
+
+logger = logging.getLogger(__name__)
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-  print(kwargs['order'])
\ No newline at end of file
+  print(kwargs['order'])
+
+
+@receiver(inventory_low)
+def on_inventory_low(sender, **kwargs):
+  logger.warning('Products %s are low on stock.', kwargs['product_ids'])
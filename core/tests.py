@@ -1,3 +1,565 @@
-from django.test import TestCase
+"""
+Tests of the core app.
+"""
+import gzip
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from time import monotonic
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from uuid import UUID
 
-# Create your tests here.
+import psycopg2
+from psycopg2 import extensions
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
+from store.models import Product
+from . import db_routers, middleware, profiling, throttling, views
+from .checks import check_profiling_cache
+from .coalescing import SingleFlight
+from .metrics import MetricsRegistry
+from .middleware import ReplicaRoutingMiddleware, RequestMetricsMiddleware, brotli
+from .models import User
+from .postgresql_pool import pool
+from .postgresql_pool.base import PreparingCursor
+from .renderers import FastJSONRenderer
+
+REPLICAS = ['replica', 'other_replica']
+
+
+@override_settings(THROTTLING={'SCOPES': {'cart_create': {'RATE': 0.001, 'BURST': 1}}})
+class ThrottlingTests(TestCase):
+    """ This class checks the token bucket throttles of anonymous clients. """
+
+    def setUp(self):
+        throttling.stores.clear()
+
+    def test_forwarded_for_does_not_pick_a_bucket(self):
+        response = self.client.post('/store/carts/', HTTP_X_FORWARDED_FOR='192.0.2.1')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/store/carts/', HTTP_X_FORWARDED_FOR='192.0.2.2')
+        self.assertEqual(response.status_code, 429)
+
+    def test_addresses_have_their_own_bucket(self):
+        for address in ['192.0.2.1', '192.0.2.2']:
+            response = self.client.post('/store/carts/', REMOTE_ADDR=address)
+            self.assertEqual(response.status_code, 201, address)
+        response = self.client.post('/store/carts/', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 429)
+
+
+    @override_settings(THROTTLING={'SCOPES': {'catalog': {'RATE': 0.001, 'BURST': 2}}})
+    def test_async_product_views_share_the_catalog_buckets(self):
+        registry = MetricsRegistry()
+        with mock.patch.object(throttling, 'registry', registry):
+            statuses = [self.client.get(path, REMOTE_ADDR='192.0.2.1').status_code
+                        for path in ['/store/products/', '/store/async/products/']]
+            throttled = self.client.get('/store/async/products/', REMOTE_ADDR='192.0.2.1')
+            self.assertEqual(statuses, [200, 200])
+            self.assertEqual(throttled.status_code, 429)
+            self.assertGreater(int(throttled['Retry-After']), 0)
+            self.assertIn('detail', throttled.json())
+
+            statuses = [self.client.get(path, REMOTE_ADDR='192.0.2.2').status_code
+                        for path in ['/store/async/products/', '/store/async/products/0/',
+                                     '/store/async/products/0/', '/store/products/']]
+            self.assertEqual(statuses, [200, 404, 429, 429])
+        self.assertEqual(registry.counters[('throttled_requests_total', (('scope', 'catalog'),))], 3)
+
+class ProfilingCacheCheckTests(SimpleTestCase):
+    """ This class checks the system check of the profile ring buffer alias. """
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_dummy_cache_is_reported(self):
+        self.assertEqual([message.id for message in check_profiling_cache(None)], ['core.W001'])
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'profiles': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                     'LOCATION': '/tmp/intrade-profiles'},
+    }, PROFILING={'CACHE': 'profiles'})
+    def test_shared_cache_is_accepted(self):
+        self.assertEqual(check_profiling_cache(None), [])
+
+
+@override_settings(READ_REPLICAS={
+    'REPLICAS': REPLICAS,
+    'VIEWS': ['store.views.ProductViewSet'],
+    'PIN_SECONDS': 5,
+    'MAX_LAG_SECONDS': 10,
+    'LAG_CHECK_INTERVAL': 5,
+})
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    This class checks which database ReplicaRoutingMiddleware and
+    PrimaryReplicaRouter pick for the reads of a request, with two SQLite
+    replica aliases.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for alias in REPLICAS:
+            connections.settings[alias] = {
+                **connections.settings['default'],
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in REPLICAS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        super().tearDownClass()
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.monitor = db_routers.ReplicaLagMonitor()
+        patcher = mock.patch.object(db_routers, 'lag_monitor', self.monitor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_read_database(self, request):
+        """ Returns the database the reads of a request go to, and its response. """
+        databases = []
+
+        def get_response(request):
+            databases.append(router.db_for_read(Product))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return databases[0], response
+
+    def test_safe_reads_of_listed_views_use_a_replica(self):
+        database, _ = self.get_read_database(self.factory.get('/store/products/'))
+        self.assertIn(database, REPLICAS)
+        database, _ = self.get_read_database(self.factory.get('/store/collections/'))
+        self.assertEqual(database, 'default')
+        database, _ = self.get_read_database(self.factory.post('/store/products/'))
+        self.assertEqual(database, 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_writes_pin_the_client_to_default(self):
+        _, response = self.get_read_database(self.factory.post('/store/products/'))
+        pin = response.cookies['pin_primary'].value
+        self.assertEqual(response['X-Pin-Primary'], pin)
+
+        request = self.factory.get('/store/products/')
+        request.COOKIES['pin_primary'] = pin
+        self.assertEqual(self.get_read_database(request)[0], 'default')
+        request = self.factory.get('/store/products/', HTTP_X_PIN_PRIMARY=pin)
+        self.assertEqual(self.get_read_database(request)[0], 'default')
+
+        expired = self.factory.get('/store/products/', HTTP_X_PIN_PRIMARY=str(time.time() - 1))
+        self.assertIn(self.get_read_database(expired)[0], REPLICAS)
+
+    def test_lagging_replicas_are_skipped(self):
+        self.monitor.checked_at['replica'] = monotonic()
+        self.monitor.lag['replica'] = 30
+        for _ in range(10):
+            database, _ = self.get_read_database(self.factory.get('/store/products/'))
+            self.assertEqual(database, 'other_replica')
+
+        self.monitor.checked_at['other_replica'] = monotonic()
+        self.monitor.lag['other_replica'] = 30
+        database, _ = self.get_read_database(self.factory.get('/store/products/'))
+        self.assertEqual(database, 'default')
+
+
+@override_settings(THROTTLING={}, REQUEST_METRICS={'N_PLUS_ONE_THRESHOLD': 3})
+class RequestMetricsTests(TestCase):
+    """ This class checks the request metrics and their endpoint. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('watcher', 'watcher@example.com', 'watcher')
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        for module in [middleware, views]:
+            patcher = mock.patch.object(module, 'registry', self.registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_histogram(self, name, route):
+        return self.registry.histograms.get((name, (('route', route),)))
+
+    def test_requests_are_recorded_by_route(self):
+        # Authenticated, so that the list is not coalesced and rendered in the view.
+        auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.admin)}'}
+        self.client.get('/store/products/', **auth)
+        self.client.get('/store/products/', **auth)
+        for name in ['http_request_duration_seconds', 'db_duration_seconds',
+                     'db_queries_per_request', 'http_response_size_bytes',
+                     'app_duration_seconds', 'render_duration_seconds']:
+            self.assertEqual(self.get_histogram(name, 'products-list').count, 2, name)
+        self.assertGreater(self.get_histogram('db_queries_per_request', 'products-list').sum, 0)
+
+    def test_repeated_queries_are_reported(self):
+        def get_response(request):
+            for product_id in Product.objects.values_list('id', flat=True):
+                Product.objects.filter(pk=product_id).exists()
+            return HttpResponse()
+
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            RequestMetricsMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertIn('Possible N+1 on unmatched: the same query ran 5 times', logs.output[0])
+        self.assertEqual(self.registry.counters[('n_plus_one_total', (('route', 'unmatched'),))], 1)
+
+    def test_metrics_are_exposed_to_staff(self):
+        self.client.get('/store/products/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.admin)}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_count{route="products-list"} 1', text)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    """ This class checks that FastJSONRenderer renders like DRF's JSONRenderer. """
+
+    def test_output_matches_drf(self):
+        data = {
+            'price': Decimal('10.50'),
+            'placed_at': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            'day': date(2024, 5, 1),
+            'id': UUID('12345678-1234-5678-1234-567812345678'),
+            'label': gettext_lazy('Products'),
+            'text': 'line\u2028separator \u00e9',
+            'counts': {1: 2},
+            'huge': 2 ** 70,
+            'items': [None, True, 1],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+@override_settings(THROTTLING={}, COMPRESSION={'MIN_SIZE': 1024})
+class CompressionTests(TestCase):
+    """ This class checks the compression of API responses. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=30, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get('/store/products/?page_size=30')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertGreaterEqual(len(plain.content), 1024)
+
+        compressed = self.client.get('/store/products/?page_size=30', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(compressed['ETag'], 'W/' + plain['ETag'])
+
+    @skipUnless(brotli is not None, 'brotli is not installed.')
+    def test_brotli_is_preferred(self):
+        plain = self.client.get('/store/products/?page_size=30')
+        compressed = self.client.get('/store/products/?page_size=30',
+                                     HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(compressed.content), plain.content)
+        refused = self.client.get('/store/products/?page_size=30',
+                                  HTTP_ACCEPT_ENCODING='gzip;q=0.5, br;q=0')
+        self.assertEqual(refused['Content-Encoding'], 'gzip')
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/store/products/?page_size=1', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(response.content), 1024)
+        self.assertNotIn('Content-Encoding', response)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """ This class checks that concurrent calls with the same key are coalesced. """
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def lead(self, key, outcome):
+        """ Starts a call of key in a thread and returns the thread once the call runs. """
+        def function():
+            self.calls.append(key)
+            self.started.set()
+            self.release.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        def run():
+            try:
+                self.flights.do(key, function)
+            except Exception:
+                pass
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.started.wait(5)
+        return thread
+
+    def follow(self, key, timeout=5):
+        """ Calls key from another thread while the leading call runs, and returns the outcome. """
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = self.flights.do(key, lambda: self.calls.append(key) or 'own', timeout)
+            except Exception as error:
+                outcome['error'] = error
+        thread = threading.Thread(target=run)
+        thread.start()
+        # Let the follower reach the flight before the leader finishes.
+        time.sleep(0.1)
+        self.release.set()
+        thread.join(5)
+        return outcome
+
+    def test_concurrent_calls_share_the_result(self):
+        leader = self.lead('products', 'shared')
+        self.assertEqual(self.follow('products'), {'result': ('shared', True)})
+        leader.join(5)
+        self.assertEqual(self.calls, ['products'])
+        self.assertEqual(self.flights.flights, {})
+
+    def test_errors_are_shared(self):
+        error = ValueError('failed')
+        leader = self.lead('products', error)
+        self.assertIs(self.follow('products')['error'], error)
+        leader.join(5)
+
+    def test_other_keys_and_timeouts_run_on_their_own(self):
+        leader = self.lead('products', 'shared')
+        self.assertEqual(self.follow('collections'), {'result': ('own', False)})
+        leader.join(5)
+
+        self.started.clear()
+        self.release.clear()
+        leader = self.lead('products', 'shared')
+        self.assertEqual(self.follow('products', timeout=0.01), {'result': ('own', False)})
+        leader.join(5)
+
+
+@override_settings(THROTTLING={}, PROFILING={'INTERVAL': 0.001, 'RING_SIZE': 2})
+class ProfilingTests(TestCase):
+    """ This class checks which requests are profiled and the admin pages of their profiles. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('profiler', 'profiler@example.com', 'profiler')
+        cls.user = User.objects.create_user('visitor', 'visitor@example.com', 'visitor')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(user)}', 'HTTP_X_PROFILE': '1'}
+
+    def test_staff_requests_are_profiled(self):
+        response = self.client.get('/store/products/', **self.get_auth(self.admin))
+        captured = profiling.get_profile(int(response['X-Profile-Id']))
+        self.assertEqual((captured['method'], captured['path'], captured['status']),
+                         ('GET', '/store/products/', 200))
+        self.assertTrue(any('store_product' in query[2] for query in captured['queries']))
+
+        self.assertNotIn('X-Profile-Id', self.client.get('/store/products/', HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/store/products/', **self.get_auth(self.user)))
+        self.client.force_login(self.admin)
+        self.assertIn('X-Profile-Id', self.client.get('/store/collections/', HTTP_X_PROFILE='1'))
+
+    @override_settings(PROFILING={'SAMPLE_RATE': 1})
+    def test_sampled_requests_are_profiled(self):
+        self.assertIn('X-Profile-Id', self.client.get('/store/products/'))
+
+    def test_profile_pages(self):
+        ids = [int(self.client.get('/store/products/', **self.get_auth(self.admin))['X-Profile-Id'])
+               for _ in range(3)]
+        self.assertEqual([captured['id'] for captured in profiling.get_profiles()], [ids[2], ids[1]])
+
+        self.assertEqual(self.client.get('/admin/profiles/').status_code, 302)
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get('/admin/profiles/'), f'/admin/profiles/{ids[2]}/')
+        self.assertContains(self.client.get(f'/admin/profiles/{ids[2]}/'), 'store_product')
+        self.assertEqual(self.client.get(f'/admin/profiles/{ids[0]}/').status_code, 404)
+
+        stacks = profiling.get_profile(ids[2])['stacks']
+        collapsed = self.client.get(f'/admin/profiles/{ids[2]}/?format=collapsed')
+        self.assertEqual(collapsed.content.decode().splitlines(),
+                         [f'{stack} {samples}' for stack, samples in stacks.items()])
+
+    def test_flame_rects(self):
+        rects = profiling.get_flame_rects({'a:main;b:load': 3, 'a:main;c:render': 1})
+        self.assertEqual([(rect['name'], rect['depth'], rect['left'], rect['width']) for rect in rects],
+                         [('a:main', 0, 0, 100), ('b:load', 1, 0, 75), ('c:render', 1, 75, 25)])
+
+
+class FakeConnection:
+    """ A stand-in for a psycopg2 connection, as seen by ConnectionPool. """
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.broken = False
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = 1
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    @contextmanager
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection')
+        yield mock.Mock()
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """ This class checks the connection pool of the core.postgresql_pool backend. """
+
+    def setUp(self):
+        self.opened = []
+        self.failures = 0
+
+    def connect(self):
+        if self.failures:
+            self.failures -= 1
+            raise psycopg2.OperationalError('could not connect to server')
+        connection = FakeConnection(len(self.opened))
+        self.opened.append(connection)
+        return connection
+
+    def create_pool(self, **options):
+        return pool.ConnectionPool(self.connect, **options)
+
+    def test_most_recently_released_connection_is_reused(self):
+        connection_pool = self.create_pool()
+        first, second = connection_pool.acquire(), connection_pool.acquire()
+        connection_pool.release(first)
+        connection_pool.release(second)
+        self.assertIs(connection_pool.acquire(), second)
+        self.assertIs(connection_pool.acquire(), first)
+        self.assertEqual((len(self.opened), connection_pool.size), (2, 2))
+
+    def test_full_pool_times_out(self):
+        connection_pool = self.create_pool(max_size=1, timeout=0.05)
+        connection = connection_pool.acquire()
+        with self.assertRaises(pool.PoolTimeout):
+            connection_pool.acquire()
+        connection_pool.release(connection)
+        self.assertIs(connection_pool.acquire(), connection)
+
+    def test_idle_connections_expire(self):
+        connection_pool = self.create_pool(max_size=1, idle_timeout=10, timeout=0.05)
+        connection = connection_pool.acquire()
+        connection_pool.release(connection)
+        with mock.patch.object(pool, 'monotonic', return_value=time.monotonic() + 11):
+            replacement = connection_pool.acquire()
+        self.assertTrue(connection.closed)
+        self.assertIsNot(replacement, connection)
+        self.assertEqual(connection_pool.size, 1)
+
+    def test_unhealthy_connections_are_discarded(self):
+        connection_pool = self.create_pool(max_size=1, health_check_after=0, timeout=0.05)
+        connection = connection_pool.acquire()
+        connection_pool.release(connection)
+        connection.broken = True
+        replacement = connection_pool.acquire()
+        self.assertTrue(connection.closed)
+        self.assertIsNot(replacement, connection)
+        self.assertEqual(connection_pool.size, 1)
+
+    def test_failed_connect_frees_its_slot(self):
+        connection_pool = self.create_pool(max_size=1, timeout=0.05)
+        self.failures = 1
+        with self.assertRaises(psycopg2.OperationalError):
+            connection_pool.acquire()
+        self.assertEqual(connection_pool.size, 0)
+        connection_pool.acquire()
+        self.assertEqual(connection_pool.size, 1)
+
+    def test_release_only_keeps_reusable_connections(self):
+        connection_pool = self.create_pool(max_size=3)
+        closed, in_transaction, broken = [connection_pool.acquire() for _ in range(3)]
+        closed.closed = 1
+        connection_pool.release(closed)
+        self.assertEqual((connection_pool.size, connection_pool.idle), (2, []))
+
+        in_transaction.status = extensions.TRANSACTION_STATUS_INTRANS
+        connection_pool.release(in_transaction)
+        self.assertEqual(in_transaction.rollbacks, 1)
+        self.assertEqual([connection for connection, _ in connection_pool.idle], [in_transaction])
+
+        broken.status = extensions.TRANSACTION_STATUS_INERROR
+        broken.broken = True
+        connection_pool.release(broken)
+        self.assertTrue(broken.closed)
+        self.assertEqual(connection_pool.size, 1)
+        self.assertEqual([connection for connection, _ in connection_pool.idle], [in_transaction])
+
+
+class PreparingCursorTests(SimpleTestCase):
+    """ This class checks how the pooled backend turns hot SELECTs into prepared statements. """
+
+    def test_placeholders_are_numbered(self):
+        self.assertEqual(
+            PreparingCursor.to_positional(
+                "SELECT '100%%' FROM t WHERE a = %s AND b LIKE '%%x' AND c IN (%s, %s)"),
+            ("SELECT '100%' FROM t WHERE a = $1 AND b LIKE '%x' AND c IN ($2, $3)", 3))
+        self.assertEqual(PreparingCursor.to_positional('SELECT 1'), ('SELECT 1', 0))
+
+    def test_mismatched_statements_are_not_prepared_again(self):
+        # psycopg2 cursors need an open connection, so the bookkeeping of
+        # get_statement and prepare runs on stand-ins.
+        connection = SimpleNamespace(
+            prepare_threshold=2, prepared=OrderedDict(), executions=Counter(),
+            unpreparable=set(), autocommit=True,
+            get_transaction_status=lambda: extensions.TRANSACTION_STATUS_IDLE)
+        cursor = SimpleNamespace(connection=connection, name=None,
+                                 to_positional=PreparingCursor.to_positional)
+        cursor.prepare = lambda sql, params: PreparingCursor.prepare(cursor, sql, params)
+        sql = 'SELECT * FROM t WHERE a = %s AND b = %s'
+
+        for _ in range(2):
+            self.assertIsNone(PreparingCursor.get_statement(cursor, sql, [1]))
+        self.assertEqual(connection.unpreparable, {sql})
+        self.assertEqual(connection.executions, Counter())
+        self.assertIsNone(PreparingCursor.get_statement(cursor, sql, [1]))
+        self.assertEqual(connection.executions, Counter())
+
+        self.assertIsNone(PreparingCursor.get_statement(cursor, 'UPDATE t SET a = %s', [1]))
+        self.assertIsNone(PreparingCursor.get_statement(cursor, 'SELECT %s', {'a': 1}))
+        self.assertEqual(connection.executions, Counter())
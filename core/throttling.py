@@ -0,0 +1,136 @@
+"""
+This module contains the token bucket throttles of the API.
+
+Every client of a scope, the user when authenticated and the IP address
+otherwise, has a bucket of BURST tokens that refills at RATE tokens per
+second. A request takes a token, and is rejected with 429 Too Many
+Requests when the bucket is empty. Scopes are configured in
+settings.THROTTLING.
+
+The IP address is the one get_client_ip returns, which only reads
+X-Forwarded-For behind REST_FRAMEWORK['NUM_PROXIES'] proxies, so that a
+client cannot pick a new bucket per request.
+"""
+import threading
+from collections import OrderedDict
+from time import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+from .metrics import registry
+
+
+def take_token(bucket, rate, burst, now):
+    """
+    Refills a (tokens, updated_at) bucket and takes a token from it.
+
+    Returns the new bucket and the number of seconds to wait for a token,
+    which is 0 when the token was taken.
+    """
+    tokens, updated_at = bucket or (burst, now)
+    tokens = min(burst, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBucketStore:
+    """
+    Keeps the buckets in the memory of the process, so each process
+    throttles on its own. The least recently used buckets are dropped
+    beyond max_keys.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        with self.lock:
+            bucket, wait = take_token(self.buckets.get(key), rate, burst, time())
+            self.buckets[key] = bucket
+            self.buckets.move_to_end(key)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class CacheBucketStore:
+    """
+    Keeps the buckets in a Django cache, so that all the processes sharing
+    the cache share the buckets. The read and the write of a bucket are
+    not atomic, so concurrent requests of one client may both take the
+    last token: the limit is approximate.
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, burst):
+        key = f'throttle:{key}'
+        bucket, wait = take_token(self.cache.get(key), rate, burst, time())
+        # A bucket left alone this long is full again anyway.
+        self.cache.set(key, bucket, timeout=int(burst / rate) + 1)
+        return wait
+
+
+def get_client_ip(request):
+    """
+    Returns the IP address of the client of a request: REMOTE_ADDR, or the
+    address the nearest of REST_FRAMEWORK['NUM_PROXIES'] proxies added to
+    X-Forwarded-For.
+    """
+    return BaseThrottle().get_ident(request)
+
+
+def get_config():
+    config = {'STORE': 'local', 'CACHE': 'default', 'SCOPES': {}}
+    config.update(getattr(settings, 'THROTTLING', {}))
+    return config
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+def get_store():
+    """ Returns the bucket store configured in settings.THROTTLING['STORE']. """
+    config = get_config()
+    key = (config['STORE'], config['CACHE'])
+    with stores_lock:
+        if key not in stores:
+            if config['STORE'] == 'cache':
+                stores[key] = CacheBucketStore(config['CACHE'])
+            else:
+                stores[key] = LocalBucketStore()
+        return stores[key]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles the requests of a view with the token bucket of its
+    throttle_scope. Views whose scope is not configured are not throttled.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_seconds = 0
+        scope = getattr(view, 'throttle_scope', None)
+        limits = get_config()['SCOPES'].get(scope)
+        if limits is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            client = f'user:{request.user.pk}'
+        else:
+            client = f'ip:{get_client_ip(request)}'
+        self.wait_seconds = get_store().take(
+            f'{scope}:{client}', limits['RATE'], limits['BURST'])
+        if self.wait_seconds:
+            registry.increment('throttled_requests_total', scope=scope)
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
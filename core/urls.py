@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+# URLConf
+urlpatterns = [
+    path('metrics/', views.metrics, name='metrics'),
+]
@@ -1,3 +1,79 @@
+import json
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from . import profiling
+from .metrics import registry
 
-# Create your views here.
+
+class PrometheusRenderer(BaseRenderer):
+    """ Renders text in the Prometheus exposition format. """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            # Error responses, such as permission denied.
+            data = json.dumps(data)
+        return data.encode(self.charset)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    """
+    Returns the request metrics of this process in the Prometheus text format.
+    """
+    return Response(registry.render())
+
+
+@staff_member_required
+def profiles(request):
+    """
+    Lists the request profiles in the ring buffer, newest first.
+    """
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': profiling.get_profiles(),
+        'header': profiling.HEADER,
+    }
+    return render(request, 'admin/core/profiles.html', context)
+
+
+@staff_member_required
+def profile(request, profile_id):
+    """
+    Shows the icicle graph, hottest stacks and SQL timeline of a profile.
+    ?format=collapsed returns the stacks in the collapsed format of
+    flamegraph.pl and speedscope.
+    """
+    captured = profiling.get_profile(profile_id)
+    if captured is None:
+        raise Http404('This profile was overwritten or has expired.')
+    stacks = captured['stacks']
+    if request.GET.get('format') == 'collapsed':
+        lines = [f'{stack} {samples}\n' for stack, samples in stacks.items()]
+        return HttpResponse(''.join(lines), content_type='text/plain; charset=utf-8')
+
+    rects = profiling.get_flame_rects(stacks)
+    context = {
+        **admin.site.each_context(request),
+        'title': f'Profile {profile_id}: {captured["method"]} {captured["path"]}',
+        'profile': captured,
+        'rects': rects,
+        'height': (max((rect['depth'] for rect in rects), default=0) + 1) * profiling.RECT_HEIGHT,
+        'hottest': [
+            (samples, stack.rsplit(';', 1)[-1], stack)
+            for stack, samples in sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:20]
+        ],
+        'query_time': round(sum(query[1] for query in captured['queries']), 3),
+    }
+    return render(request, 'admin/core/profile.html', context)
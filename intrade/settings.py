@@ -50,11 +50,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -91,13 +95,49 @@ WSGI_APPLICATION = 'intrade.wsgi.application'
 # In production, the database is configured using environment variables.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Pools connections per process and prepares hot SELECTs on the server.
+        'ENGINE': 'core.postgresql_pool',
         'NAME': 'intrade_database',
         'HOST': 'intrade-database.cm7n0i9g4wwz.us-east-1.rds.amazonaws.com',
         'PORT': '5432',
         'USER': 'intrade_dev',
         'PASSWORD': 'Olaseni1996',
-    }
+        'OPTIONS': {
+            'POOL': {
+                'MAX_SIZE': 10,
+                'IDLE_TIMEOUT': 300,
+                'HEALTH_CHECK_AFTER': 30,
+                'TIMEOUT': 10,
+            },
+            # Executions of a SELECT before it is prepared; None disables it.
+            'PREPARE_THRESHOLD': 5,
+            'MAX_PREPARED': 100,
+        },
+    },
+    # Read replicas are added as extra aliases and listed in READ_REPLICAS, e.g.
+    # 'replica': {..., 'HOST': '<replica host>', 'TEST': {'MIRROR': 'default'}},
+}
+
+DATABASE_ROUTERS = ['core.db_routers.PrimaryReplicaRouter']
+
+# Reads of the listed views go to a healthy replica, unless the client wrote
+# in the last PIN_SECONDS. Replicas more than MAX_LAG_SECONDS behind are skipped.
+READ_REPLICAS = {
+    'REPLICAS': [],
+    'VIEWS': [
+        'store.views.ProductViewSet',
+        'store.views.CollectionViewSet',
+        'store.views.ReviewViewSet',
+        'store.async_views.ProductListView',
+        'store.async_views.ProductDetailView',
+        'store.async_views.CollectionListView',
+        'store.async_views.CollectionDetailView',
+        'store.async_views.ReviewListView',
+        'store.async_views.ReviewDetailView',
+    ],
+    'PIN_SECONDS': 5,
+    'MAX_LAG_SECONDS': 10,
+    'LAG_CHECK_INTERVAL': 5,
 }
 
 
@@ -144,9 +184,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.throttling.TokenBucketThrottle',
+    ),
+    # Clients are identified by REMOTE_ADDR, since X-Forwarded-For can be
+    # set by the client. Behind proxies, set this to their number, so that
+    # the address added by the nearest proxy is used instead.
+    'NUM_PROXIES': 0,
+}
+
+# Token bucket throttles of the views with a throttle_scope. Each user, or IP
+# address when anonymous, may send BURST requests at once, refilled at RATE
+# requests per second. STORE 'local' keeps the buckets per process; 'cache'
+# shares them between processes through the CACHE alias.
+THROTTLING = {
+    'STORE': 'local',
+    'CACHE': 'default',
+    'SCOPES': {
+        'catalog': {'RATE': 20, 'BURST': 100},
+        'cart_create': {'RATE': 0.5, 'BURST': 20},
+    },
 }
 
 AUTH_USER_MODEL = 'core.User'
@@ -158,6 +227,86 @@ DJOSER = {
     }
 }
 
+# Responses of these content types and at least MIN_SIZE bytes are compressed
+# with brotli (when installed) or gzip, as negotiated through Accept-Encoding.
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'CONTENT_TYPES': ['application/json', 'text/plain'],
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+}
+
+# Storage of shopping carts, see store/carts.py. BACKEND 'orm' keeps them in
+# the database; 'cache' keeps each cart as one record in the CACHE alias,
+# which should be shared by all processes, for CART_TIMEOUT seconds after
+# its last change.
+CARTS = {
+    'BACKEND': 'orm',
+    'CACHE': 'default',
+    'CART_TIMEOUT': 7 * 24 * 3600,
+}
+
+# Writes sent with an Idempotency-Key header are only run once; retries with
+# the same key within KEY_TTL seconds get the stored response. Expired keys
+# are deleted by the purge_idempotency_keys command. A key claimed by a
+# request that stored no response after LOCK_TIMEOUT seconds can be taken
+# over by a retry, so it should exceed the longest request.
+IDEMPOTENCY = {
+    'KEY_TTL': 24 * 3600,
+    'LOCK_TIMEOUT': 120,
+}
+
+# Products read by the carts and the checkout are kept per process in an LRU
+# cache of at most MAX_BYTES, for at most TTL seconds. Product changes are
+# broadcast through a version key in the CACHE alias, which should be shared
+# by all processes.
+PRODUCT_CACHE = {
+    'MAX_BYTES': 1024 * 1024,
+    'TTL': 60,
+    'CACHE': 'default',
+}
+
+# Static catalog pages rendered by the build_catalog_snapshot command into
+# ROOT, PAGE_SIZE product or collection IDs per page.
+CATALOG_SNAPSHOT = {
+    'ROOT': BASE_DIR / 'catalog',
+    'PAGE_SIZE': 100,
+}
+
+# Stock is a ledger of StockMovement rows folded into Product.inventory by
+# the snapshot_inventory command. Snapshots stop at the movements recorded
+# SNAPSHOT_LAG seconds ago, so that no transaction still inserting older
+# movements can be skipped.
+INVENTORY = {
+    'SNAPSHOT_LAG': 60,
+}
+
+# Product list facets (?facets=collection,price). Prices are counted in
+# buckets split at PRICE_BUCKETS, and counts are cached per filtered query.
+FACETS = {
+    'PRICE_BUCKETS': [25, 50, 100, 250],
+    'CACHE_TIMEOUT': 300,
+}
+
+# Per-request metrics, exposed to staff users at /metrics/.
+REQUEST_METRICS = {
+    # Requests that run the same SQL statement this many times are logged as a possible N+1.
+    'N_PLUS_ONE_THRESHOLD': 10,
+}
+
+# Sampling profiler, see core/profiling.py. Staff users profile a request by
+# sending the X-Profile header; SAMPLE_RATE is the fraction of all requests
+# profiled without it. Stacks are sampled every INTERVAL seconds, and the
+# last RING_SIZE profiles are kept in the CACHE alias for TIMEOUT seconds.
+PROFILING = {
+    'SAMPLE_RATE': 0,
+    'INTERVAL': 0.005,
+    'RING_SIZE': 50,
+    'MAX_QUERIES': 500,
+    'CACHE': 'default',
+    'TIMEOUT': 24 * 3600,
+}
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1)
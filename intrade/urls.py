@@ -17,14 +17,19 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 import debug_toolbar
+from core import views as core_views
 
 admin.site.site_header = 'Storefront Admin'
 admin.site.index_title = 'Admin'
 
 urlpatterns = [
+    # Before the admin, whose catch-all view would answer these paths.
+    path('admin/profiles/', core_views.profiles, name='profiles'),
+    path('admin/profiles/<int:profile_id>/', core_views.profile, name='profile'),
     path('admin/', admin.site.urls),
     path('store/', include('store.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
     path('__debug__/', include(debug_toolbar.urls)),
+    path('', include('core.urls')),
 ]
\ No newline at end of file
@@ -1,9 +1,55 @@
+from django import forms
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.db.models.aggregates import Count, Sum
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
-from . import models
+from . import bulk, inventory, models
+
+
+class BulkActionMixin:
+    """
+    Runs admin actions through store.bulk, in batches, and in the
+    background for large selections.
+    """
+
+    def get_action_value(self, request, name):
+        """ Returns the cleaned value of an action form field, or None if it is missing. """
+        try:
+            value = self.action_form.base_fields[name].clean(request.POST.get(name))
+        except ValidationError:
+            value = None
+        if value is None:
+            self.message_user(
+                request, f'Please provide a {name} for this action.', messages.ERROR)
+        return value
+
+    def run_bulk(self, request, description, queryset, operation):
+        job = bulk.run(description, queryset, operation)
+        if job is None:
+            self.message_user(
+                request, f'{description}: done.', messages.SUCCESS)
+            return
+        url = reverse('admin:store_bulkjob_change', args=[job.id])
+        self.message_user(
+            request,
+            format_html(
+                '{}: {} rows are being updated in the background. <a href="{}">Follow the progress</a>.',
+                description, job.total, url),
+            messages.INFO)
+
+
+class ProductActionForm(ActionForm):
+    collection = forms.ModelChoiceField(
+        models.Collection.objects.all(), required=False)
+    promotion = forms.ModelChoiceField(
+        models.Promotion.objects.all(), required=False)
+    percentage = forms.DecimalField(
+        max_digits=5, decimal_places=2, required=False)
+    quantity = forms.IntegerField(min_value=1, required=False)
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -12,21 +58,23 @@ class InventoryFilter(admin.SimpleListFilter):
 
     def lookups(self, request, model_admin):
         return [
-            ('<10', 'Low')
+            ('low', 'Low')
         ]
 
     def queryset(self, request, queryset: QuerySet):
-        if self.value() == '<10':
-            return queryset.filter(inventory__lt=10)
+        if self.value() == 'low':
+            return queryset.filter(is_low_stock=True)
 
 
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(BulkActionMixin, admin.ModelAdmin):
+    action_form = ProductActionForm
     autocomplete_fields = ['collection']
     prepopulated_fields = {
         'slug': ['title']
     }
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'receive_stock', 'change_collection',
+               'apply_promotion', 'adjust_price']
     list_display = ['title', 'unit_price',
                     'inventory_status', 'collection_title']
     list_editable = ['unit_price']
@@ -35,29 +83,75 @@ class ProductAdmin(admin.ModelAdmin):
     list_select_related = ['collection']
     search_fields = ['title']
 
+    def get_readonly_fields(self, request, obj=None):
+        # The stock of an existing product only changes through the ledger.
+        if obj is not None:
+            return ['inventory']
+        return []
+
     def collection_title(self, product):
         return product.collection.title
 
-    @admin.display(ordering='inventory')
+    @admin.display(ordering='is_low_stock')
     def inventory_status(self, product):
-        if product.inventory < 10:
+        if product.is_low_stock:
             return 'Low'
         return 'OK'
 
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        product_ids = list(queryset.values_list('id', flat=True))
+        inventory.set_stock({product_id: 0 for product_id in product_ids})
+        updated_count = len(product_ids)
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
             messages.ERROR
         )
 
+    @admin.action(description='Receive the chosen quantity')
+    def receive_stock(self, request, queryset):
+        quantity = self.get_action_value(request, 'quantity')
+        if quantity is not None:
+            product_ids = list(queryset.values_list('id', flat=True))
+            inventory.record_movements(models.StockMovement.KIND_RECEIPT, {
+                product_id: quantity for product_id in product_ids
+            })
+            self.message_user(
+                request,
+                f'{len(product_ids)} products were successfully updated.',
+                messages.SUCCESS
+            )
+
+    @admin.action(description='Move to the chosen collection')
+    def change_collection(self, request, queryset):
+        collection = self.get_action_value(request, 'collection')
+        if collection is not None:
+            self.run_bulk(
+                request, f'Move products to {collection}', queryset,
+                bulk.change_collection(collection.id))
+
+    @admin.action(description='Apply the chosen promotion')
+    def apply_promotion(self, request, queryset):
+        promotion = self.get_action_value(request, 'promotion')
+        if promotion is not None:
+            self.run_bulk(
+                request, f'Apply promotion {promotion.description}', queryset,
+                bulk.apply_promotion(promotion.id))
+
+    @admin.action(description='Adjust price by percentage')
+    def adjust_price(self, request, queryset):
+        percentage = self.get_action_value(request, 'percentage')
+        if percentage is not None:
+            self.run_bulk(
+                request, f'Adjust prices by {percentage}%', queryset,
+                bulk.adjust_price(percentage))
+
 
 @admin.register(models.Collection)
 class CollectionAdmin(admin.ModelAdmin):
     autocomplete_fields = ['featured_product']
-    list_display = ['title', 'products_count']
+    list_display = ['title', 'products_count', 'low_stock_threshold']
     search_fields = ['title']
 
     @admin.display(ordering='products_count')
@@ -110,7 +204,59 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(BulkActionMixin, admin.ModelAdmin):
+    actions = ['mark_complete', 'mark_failed']
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline]
-    list_display = ['id', 'placed_at', 'customer']
+    list_display = ['id', 'placed_at', 'customer',
+                    'payment_status', 'items_count', 'total']
+    list_filter = ['payment_status']
+    list_select_related = ['customer__user']
+
+    @admin.display(ordering='items_count')
+    def items_count(self, order):
+        return order.items_count
+
+    @admin.display(ordering='total')
+    def total(self, order):
+        return order.total
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            items_count=Count('items'),
+            total=Sum(ExpressionWrapper(
+                F('items__quantity') * F('items__unit_price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)))
+        )
+
+    @admin.action(description='Mark selected orders as complete')
+    def mark_complete(self, request, queryset):
+        self.run_bulk(
+            request, 'Mark orders as complete', queryset,
+            bulk.set_payment_status(models.Order.PAYMENT_STATUS_COMPLETE))
+
+    @admin.action(description='Mark selected orders as failed')
+    def mark_failed(self, request, queryset):
+        self.run_bulk(
+            request, 'Mark orders as failed', queryset,
+            bulk.set_payment_status(models.Order.PAYMENT_STATUS_FAILED))
+
+
+@admin.register(models.BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ['description', 'status', 'progress', 'created_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['description', 'status', 'total', 'processed',
+                       'error', 'created_at', 'heartbeat_at', 'finished_at']
+
+    def get_queryset(self, request):
+        # Jobs whose process was restarted are shown as failed.
+        bulk.fail_stale_jobs()
+        return super().get_queryset(request)
+
+    @admin.display(description='progress')
+    def progress(self, job):
+        return f'{job.processed}/{job.total}'
+
+    def has_add_permission(self, request):
+        return False
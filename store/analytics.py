@@ -0,0 +1,113 @@
+"""
+This module maintains the sales rollups used by the analytics endpoint.
+
+Rollups are updated incrementally when an order's payment status moves
+into or out of complete, and whole days can be rebuilt from the order
+history when the rollups need to be repaired.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+from . import archive
+from .models import ArchivedOrder, Order, OrderItem, Product, SalesRollup
+
+
+def line_revenue():
+    """ Returns the expression for the revenue of an order item. """
+    return ExpressionWrapper(
+        F('quantity') * F('unit_price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def apply_order(order: Order, sign: int = 1):
+    """
+    Adds (sign=1) or removes (sign=-1) the items of an order to the rollups
+    of the day the order was placed.
+    """
+    day = timezone.localdate(order.placed_at)
+    lines = OrderItem.objects \
+        .filter(order_id=order.id) \
+        .values('product_id', 'product__collection_id') \
+        .annotate(units=Sum('quantity'), revenue=Sum(line_revenue()))
+
+    for line in lines:
+        rollup, _ = SalesRollup.objects.get_or_create(
+            day=day,
+            collection_id=line['product__collection_id'],
+            product_id=line['product_id'])
+        SalesRollup.objects.filter(pk=rollup.pk).update(
+            units=F('units') + sign * line['units'],
+            revenue=F('revenue') + sign * line['revenue'],
+            order_count=F('order_count') + sign)
+
+
+def rebuild_day(day):
+    """
+    Recomputes the rollups of a single day from the completed orders
+    placed on that day, live or archived. Returns the number of rollup
+    rows written.
+    """
+    # A range on placed_at, unlike placed_at__date, is read from an index.
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    lines = OrderItem.objects \
+        .filter(
+            order__placed_at__gte=start,
+            order__placed_at__lt=start + timedelta(days=1),
+            order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+        .values('product_id', 'product__collection_id') \
+        .annotate(
+            units=Sum('quantity'),
+            revenue=Sum(line_revenue()),
+            order_count=Count('order_id', distinct=True)) \
+        .order_by()
+    lines = {line['product_id']: line for line in lines}
+    add_archived_lines(lines, start, start + timedelta(days=1))
+
+    rollups = [
+        SalesRollup(
+            day=day,
+            collection_id=line['product__collection_id'],
+            product_id=line['product_id'],
+            units=line['units'],
+            revenue=line['revenue'],
+            order_count=line['order_count']
+        ) for line in lines.values()
+    ]
+    with transaction.atomic():
+        SalesRollup.objects.filter(day=day).delete()
+        SalesRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def add_archived_lines(lines, start, end):
+    """
+    Adds the items of the completed orders placed between start and end
+    that were archived to the rollup lines, which are keyed by product ID.
+    Products deleted since their order was archived are left out.
+    """
+    totals = {}
+    archived = ArchivedOrder.objects \
+        .filter(placed_at__gte=start, placed_at__lt=end,
+                payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+        .values_list('items', flat=True)
+    for data in archived:
+        items = archive.decode_items(data)
+        for product_id in {item.product_id for item in items}:
+            totals.setdefault(product_id, [0, Decimal(0), 0])[2] += 1
+        for item in items:
+            totals[item.product_id][0] += item.quantity
+            totals[item.product_id][1] += item.quantity * item.unit_price
+
+    collections = dict(Product.objects.filter(pk__in=totals).values_list('id', 'collection_id'))
+    for product_id, (units, revenue, order_count) in totals.items():
+        if product_id not in collections:
+            continue
+        line = lines.setdefault(product_id, {
+            'product_id': product_id, 'product__collection_id': collections[product_id],
+            'units': 0, 'revenue': Decimal(0), 'order_count': 0})
+        line['units'] += units
+        line['revenue'] += revenue
+        line['order_count'] += order_count
@@ -0,0 +1,82 @@
+"""
+This module moves old completed orders into the ArchivedOrder table.
+
+An archived order is one row holding the order and its items, which are
+kept as a zlib compressed JSON array rather than as OrderItem rows, so
+the Order and OrderItem tables and their indexes only hold the orders
+that are still read and written. Archived orders are served by the
+customer history like live orders, and counted by the sales rollups.
+"""
+import json
+import zlib
+from decimal import Decimal
+
+from django.db import transaction
+from .models import ArchivedOrder, Order, OrderItem, Product
+
+
+def encode_items(items):
+    """
+    Returns the compressed form of the items of an order: an array of
+    [id, product_id, title, unit_price, quantity] per item. The title is
+    kept so that the item can be shown after the product is deleted.
+    """
+    rows = [[item.id, item.product_id, item.product.title, str(item.unit_price), item.quantity]
+            for item in items]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def decode_items(data):
+    """
+    Returns the items of an archived order as unsaved OrderItem objects
+    with an unsaved product holding its ID and title.
+    """
+    return [
+        OrderItem(
+            id=item_id,
+            product=Product(id=product_id, title=title, unit_price=Decimal(unit_price)),
+            unit_price=Decimal(unit_price),
+            quantity=quantity)
+        for item_id, product_id, title, unit_price, quantity
+        in json.loads(zlib.decompress(bytes(data)))
+    ]
+
+
+def decode_product_ids(data):
+    """ Returns the product IDs of the items of an archived order, without building objects. """
+    return [item[1] for item in json.loads(zlib.decompress(bytes(data)))]
+
+
+def archive_batch(before, batch_size):
+    """
+    Archives up to batch_size completed orders placed before a date, in one
+    transaction, and returns the number of orders archived.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects
+                      .filter(payment_status=Order.PAYMENT_STATUS_COMPLETE, placed_at__lt=before)
+                      .select_for_update(skip_locked=True)
+                      .order_by('id')[:batch_size])
+        if not orders:
+            return 0
+
+        items = {}
+        for item in OrderItem.objects \
+                .filter(order__in=orders) \
+                .select_related('product') \
+                .only('id', 'order_id', 'product_id', 'product__title', 'unit_price', 'quantity') \
+                .order_by('id'):
+            items.setdefault(item.order_id, []).append(item)
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.id,
+                customer_id=order.customer_id,
+                placed_at=order.placed_at,
+                payment_status=order.payment_status,
+                items=encode_items(items.get(order.id, [])))
+            for order in orders
+        ])
+        OrderItem.objects.filter(order__in=orders).delete()
+        Order.objects.filter(pk__in=[order.id for order in orders]).delete()
+        return len(orders)
@@ -0,0 +1,194 @@
+"""
+This module defines async read-only views for the store app.
+
+They serve the same representations as the list and retrieve actions of
+the viewsets in store/views.py, but use the async ORM so that, under
+ASGI, a request waiting on the database does not hold a worker thread.
+Writes still go through the viewsets.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models.aggregates import Count
+from django.http import HttpResponse
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from core.renderers import FastJSONRenderer
+from core.throttling import TokenBucketThrottle
+from . import carts, inventory
+from .conditional import add_validators, aget_validators, evaluate
+from .filters import ProductFilter
+from .models import Collection, Product, Review
+from .pagination import AsyncPagination, ReviewPagination, get_counted
+from .serializers import CartSerializer, CollectionSerializer, ProductSerializer, ReviewSerializer
+
+
+class AsyncReadView(View):
+    """
+    Base class of the async views.
+
+    Subclasses define get_queryset and serializer_class. Filter backends
+    are the same DRF backends the viewsets use; they only build the
+    queryset, so they are safe to call from async code. Responses of
+    conditional views carry the same validators as the viewsets', see
+    store/conditional.py, and views with a throttle_scope take from the
+    same token buckets.
+    """
+    http_method_names = ['get', 'head', 'options']
+    filter_backends = []
+    serializer_class = None
+    conditional = True
+    throttle_scope = None
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def filter_queryset(self, request, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs['context'] = {'request': self.api_request}
+        return self.serializer_class(*args, **kwargs)
+
+    def render(self, data, status=200):
+        return HttpResponse(
+            FastJSONRenderer().render(data),
+            content_type='application/json',
+            status=status)
+
+    def check_throttles(self):
+        """ Raises Throttled when the client's bucket of throttle_scope is empty. """
+        throttle = TokenBucketThrottle()
+        if not throttle.allow_request(self.api_request, self):
+            raise Throttled(throttle.wait())
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.api_request = Request(request, authenticators=[
+            authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            if self.throttle_scope is not None:
+                # Authenticating the client may query the database.
+                await sync_to_async(self.check_throttles)()
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            # Same shape and headers as rest_framework.views.exception_handler.
+            data = error.detail
+            if not isinstance(data, (list, dict)):
+                data = {'detail': data}
+            response = self.render(data, error.status_code)
+            if getattr(error, 'wait', None):
+                response['Retry-After'] = '%d' % error.wait
+            return response
+
+    async def conditional_response(self, request, queryset, respond, estimate=True):
+        """ Returns 304 Not Modified when the client's copy is current, and await respond() otherwise. """
+        if not self.conditional:
+            return await respond()
+        self.validators = await aget_validators(queryset, estimate)
+        etag, last_modified, response = evaluate(
+            request, FastJSONRenderer.media_type, self.validators)
+        if response is None:
+            response = await respond()
+        return add_validators(response, etag, last_modified)
+
+
+class AsyncListView(AsyncReadView):
+    """ Lists the objects of get_queryset, paginated when pagination_class is set. """
+    pagination_class = None
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.api_request, self.get_queryset())
+        return await self.conditional_response(
+            request, queryset, lambda: self.list(request, queryset))
+
+    async def list(self, request, queryset):
+        if self.pagination_class is None:
+            objects = [obj async for obj in queryset]
+            return self.render(self.get_serializer(objects, many=True).data)
+
+        objects, page = await self.pagination_class().apaginate_queryset(
+            queryset, request, get_counted(getattr(self, 'validators', None)))
+        page['results'] = self.get_serializer(objects, many=True).data
+        return self.render(page)
+
+
+class AsyncDetailView(AsyncReadView):
+    """ Retrieves the object of get_queryset with the primary key of the URL. """
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        return await self.conditional_response(
+            request, queryset.filter(pk=kwargs['pk']),
+            lambda: self.retrieve(queryset, kwargs['pk']), estimate=False)
+
+    async def retrieve(self, queryset, pk):
+        try:
+            obj = await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            return self.render({'detail': 'Not found.'}, 404)
+        return self.render(self.get_serializer(obj).data)
+
+
+class ProductListView(AsyncListView):
+    serializer_class = ProductSerializer
+    throttle_scope = 'catalog'
+    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filterset_class = ProductFilter
+    pagination_class = AsyncPagination
+    search_fields = ['title', 'description']
+    ordering_fields = ['unit_price', 'last_update']
+
+    def get_queryset(self):
+        return inventory.with_stock(Product.objects.all())
+
+
+class ProductDetailView(AsyncDetailView):
+    serializer_class = ProductSerializer
+    throttle_scope = 'catalog'
+
+    def get_queryset(self):
+        return inventory.with_stock(Product.objects.all())
+
+
+class CollectionListView(AsyncListView):
+    serializer_class = CollectionSerializer
+
+    def get_queryset(self):
+        return Collection.objects.annotate(products_count=Count('products'))
+
+
+class CollectionDetailView(AsyncDetailView):
+    serializer_class = CollectionSerializer
+
+    def get_queryset(self):
+        return Collection.objects.annotate(products_count=Count('products'))
+
+
+class ReviewListView(AsyncListView):
+    serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
+
+    def get_queryset(self):
+        return Review.objects.filter(product_id=self.kwargs['product_pk'])
+
+
+class ReviewDetailView(AsyncDetailView):
+    serializer_class = ReviewSerializer
+
+    def get_queryset(self):
+        return Review.objects.filter(product_id=self.kwargs['product_pk'])
+
+
+class CartDetailView(AsyncReadView):
+    """ Retrieves a cart from the backend of store/carts.py. """
+    serializer_class = CartSerializer
+
+    async def get(self, request, *args, **kwargs):
+        cart = await sync_to_async(carts.get_store().get)(kwargs['pk'])
+        if cart is None:
+            return self.render({'detail': 'Not found.'}, 404)
+        return self.render(self.get_serializer(cart).data)
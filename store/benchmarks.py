@@ -0,0 +1,247 @@
+"""
+This module contains the load generator used by the benchmark_store command.
+
+A benchmark runs a weighted mix of user sessions (browse, search, cart,
+checkout) against a target, which is either the Django test client in
+this process or a running server reached over HTTP, and records the
+latency and query count of every request by endpoint.
+"""
+import json
+import random
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.db import connections
+from django.test import Client
+from core.middleware import QueryProfile
+from .models import Customer, Product
+
+SCENARIOS = ['browse', 'search', 'cart', 'checkout']
+
+
+def percentile(values, fraction):
+    """ Returns the nearest-rank percentile of a sorted list. """
+    if not values:
+        return 0
+    index = min(int(fraction * len(values)), len(values) - 1)
+    return values[index]
+
+
+class Recorder:
+    """
+    This class collects the samples of a benchmark run.
+
+    Attributes:
+        samples (dict): The (latency, queries) samples keyed by endpoint.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def record(self, label, latency, queries):
+        with self.lock:
+            self.samples[label].append((latency, queries))
+
+    def summary(self, duration):
+        """ Returns the latency percentiles, in milliseconds, and query counts by endpoint. """
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = sorted(latency * 1000 for latency, _ in samples)
+            queries = [count for _, count in samples if count is not None]
+            endpoints[label] = {
+                'requests': len(samples),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'requests': total,
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(total / duration, 2) if duration else 0,
+            'endpoints': endpoints,
+        }
+
+
+class TestClientTarget:
+    """
+    Sends requests through the Django test client, in process, and counts
+    the SQL queries each request runs.
+    """
+
+    def __init__(self):
+        # REMOTE_ADDR is outside INTERNAL_IPS so the debug toolbar stays off.
+        self.client = Client(HTTP_HOST='localhost', REMOTE_ADDR='10.0.0.1')
+
+    def request(self, method, path, data, headers, client_ip=None):
+        profile = QueryProfile()
+        extra = {f'HTTP_{name.upper().replace("-", "_")}': value
+                 for name, value in headers.items()}
+        if client_ip:
+            # Each session is a different client for the throttles.
+            extra['REMOTE_ADDR'] = client_ip
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.client.generic(
+                method, path,
+                data=json.dumps(data) if data is not None else '',
+                content_type='application/json',
+                **extra)
+        body = response.content
+        return response.status_code, json.loads(body) if body else None, profile.count
+
+
+class HttpTarget:
+    """
+    Sends requests to a running server, such as runserver, gunicorn or
+    an ASGI server. Query counts are not available over HTTP, and all
+    sessions come from the address of this process, so the server should
+    run without throttle scopes.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data, headers, client_ip=None):
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=body, method=method,
+            headers={'Content-Type': 'application/json', **headers})
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        return status, json.loads(content) if content else None, None
+
+
+class Session:
+    """
+    This class represents one simulated user session.
+
+    Attributes:
+        target: The target the requests are sent to.
+        recorder (Recorder): The recorder of the benchmark.
+        catalog (dict): The product IDs, search terms and token to use.
+        rng (Random): The random generator of the session.
+        client_ip (str): The address the requests of the session come from.
+    """
+
+    def __init__(self, target, recorder, catalog, rng, prefix='/store', client_ip=None):
+        self.target = target
+        self.recorder = recorder
+        self.catalog = catalog
+        self.rng = rng
+        self.prefix = prefix
+        self.client_ip = client_ip
+
+    def call(self, label, method, path, data=None, auth=False):
+        headers = {}
+        if auth:
+            headers['Authorization'] = f'JWT {self.catalog["token"]}'
+        start = perf_counter()
+        status, body, queries = self.target.request(
+            method, self.prefix + path, data, headers, self.client_ip)
+        self.recorder.record(label, perf_counter() - start, queries)
+        if status >= 400:
+            self.recorder.record(f'{label} (error {status})', 0, None)
+        return body
+
+    def product_id(self):
+        return self.rng.choice(self.catalog['product_ids'])
+
+    def browse(self):
+        self.call('products-list', 'GET', f'/products/?page={self.rng.randint(1, 5)}')
+        self.call('products-detail', 'GET', f'/products/{self.product_id()}/')
+        self.call('collections-list', 'GET', '/collections/')
+
+    def search(self):
+        term = self.rng.choice(self.catalog['terms'])
+        self.call('products-search', 'GET', f'/products/?search={term}')
+
+    def cart(self):
+        cart = self.call('carts-list', 'POST', '/carts/', {})
+        for _ in range(self.rng.randint(1, 3)):
+            self.call('cart-items-list', 'POST', f'/carts/{cart["id"]}/items/',
+                      {'product_id': self.product_id(), 'quantity': 1})
+        self.call('carts-detail', 'GET', f'/carts/{cart["id"]}/')
+        return cart
+
+    def checkout(self):
+        cart = self.cart()
+        self.call('orders-list', 'POST', '/orders/', {'cart_id': cart['id']}, auth=True)
+
+
+def load_catalog():
+    """ Reads the product IDs, search terms and a customer token used by the sessions. """
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    product_ids = list(Product.objects.values_list('id', flat=True)[:5000])
+    titles = Product.objects.values_list('title', flat=True)[:500]
+    terms = sorted({title.split()[0].lower() for title in titles if title})
+    customer = Customer.objects.select_related('user').first()
+    return {
+        'product_ids': product_ids,
+        'terms': terms or ['a'],
+        'token': str(AccessToken.for_user(customer.user)) if customer else None,
+    }
+
+
+def run(target_factory, mix, sessions, concurrency=1, seed=0, prefix='/store'):
+    """
+    Runs a benchmark and returns its summary.
+
+    Args:
+        target_factory (callable): Returns a target for each worker.
+        mix (dict): The relative weight of each scenario.
+        sessions (int): The total number of sessions to run.
+        concurrency (int): The number of sessions run in parallel.
+        seed (int): The random seed.
+        prefix (str): The URL prefix of the store API.
+    """
+    catalog = load_catalog()
+    recorder = Recorder()
+    scenarios = list(mix)
+    weights = [mix[name] for name in scenarios]
+    local = threading.local()
+
+    def run_session(index):
+        if not hasattr(local, 'target'):
+            local.target = target_factory()
+        rng = random.Random(seed * 1_000_003 + index)
+        scenario = rng.choices(scenarios, weights)[0]
+        client_ip = f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'
+        session = Session(local.target, recorder, catalog, rng, prefix, client_ip)
+        getattr(session, scenario)()
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        list(executor.map(run_session, range(sessions)))
+    summary = recorder.summary(perf_counter() - start)
+    summary['mix'] = mix
+    summary['concurrency'] = concurrency
+    return summary
+
+
+def compare(summary, baseline, threshold):
+    """
+    Returns the endpoints whose p95 latency regressed by more than the
+    threshold (a fraction, 0.2 for 20%) compared to the baseline.
+    """
+    regressions = []
+    for label, current in summary['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(label)
+        if not previous or not previous['p95_ms']:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(
+                f'{label}: p95 {current["p95_ms"]} ms vs {previous["p95_ms"]} ms baseline')
+    return regressions
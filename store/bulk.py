@@ -0,0 +1,156 @@
+"""
+This module runs bulk admin actions in batches.
+
+Small selections are processed inline. Large selections are processed by
+a background thread that records its progress in a BulkJob, so the admin
+request returns immediately and no single statement locks the whole
+selection.
+
+The thread dies with its process, for instance on a deploy. Every batch
+records a heartbeat, and running jobs without one for STALE_AFTER seconds
+are failed by fail_stale_jobs, so that they do not stay running forever.
+"""
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+from . import analytics, inventory, product_cache
+from .models import BulkJob, Collection, Order, Product
+
+BATCH_SIZE = 500
+BACKGROUND_THRESHOLD = 2000
+# Seconds without a heartbeat after which a running job is assumed dead.
+STALE_AFTER = 600
+
+
+def batches(ids, size=BATCH_SIZE):
+    """ Splits a list of primary keys into batches. """
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def run(description, queryset, operation):
+    """
+    Applies an operation to the rows of a queryset, batch by batch.
+
+    Args:
+        description (str): The description of the action.
+        queryset (QuerySet): The selected rows.
+        operation (callable): Called with each list of primary keys.
+
+    Returns:
+        The BulkJob when the selection is processed in the background,
+        or None when it was processed inline.
+    """
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    if len(ids) <= BACKGROUND_THRESHOLD:
+        for batch in batches(ids):
+            operation(batch)
+        return None
+
+    fail_stale_jobs()
+    job = BulkJob.objects.create(description=description, total=len(ids))
+    thread = threading.Thread(
+        target=run_job, args=(job.id, ids, operation), daemon=True)
+    thread.start()
+    return job
+
+
+def run_job(job_id, ids, operation):
+    """
+    Processes the batches of a background job and records its progress.
+    It stops when the job is no longer running, because fail_stale_jobs
+    failed it after a batch that took longer than STALE_AFTER seconds.
+    """
+    jobs = BulkJob.objects.filter(pk=job_id, status=BulkJob.STATUS_RUNNING)
+    try:
+        for batch in batches(ids):
+            operation(batch)
+            if not jobs.update(processed=F('processed') + len(batch),
+                               heartbeat_at=timezone.now()):
+                return
+        jobs.update(status=BulkJob.STATUS_DONE, finished_at=timezone.now())
+    except Exception as error:
+        jobs.update(status=BulkJob.STATUS_FAILED, error=str(error),
+                    finished_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def fail_stale_jobs():
+    """
+    Fails the running jobs without a heartbeat for STALE_AFTER seconds,
+    whose thread died with its process. Returns the number of failed jobs.
+    """
+    now = timezone.now()
+    return BulkJob.objects \
+        .filter(status=BulkJob.STATUS_RUNNING,
+                heartbeat_at__lt=now - timedelta(seconds=STALE_AFTER)) \
+        .update(status=BulkJob.STATUS_FAILED, finished_at=now,
+                error='The job stopped reporting progress, most likely because its '
+                      'process was restarted. Only the processed rows were updated.')
+
+
+def change_collection(collection_id):
+    """ Returns an operation that moves products to a collection. """
+    def operation(ids):
+        with transaction.atomic():
+            # The previous and new collections change their product counts.
+            collection_ids = set(Product.objects.filter(pk__in=ids)
+                                 .values_list('collection_id', flat=True))
+            collection_ids.add(collection_id)
+            Product.objects.filter(pk__in=ids).update(
+                collection_id=collection_id, last_update=timezone.now())
+            Collection.objects.filter(pk__in=collection_ids).update(
+                last_update=timezone.now())
+            inventory.refresh_low_stock(Product.objects.filter(pk__in=ids))
+    return operation
+
+
+def apply_promotion(promotion_id):
+    """ Returns an operation that adds a promotion to products. """
+    def operation(ids):
+        Through = Product.promotions.through
+        Through.objects.bulk_create(
+            [Through(product_id=product_id, promotion_id=promotion_id)
+             for product_id in ids],
+            ignore_conflicts=True)
+    return operation
+
+
+def adjust_price(percentage: Decimal):
+    """ Returns an operation that changes the unit price of products by a percentage. """
+    factor = 1 + percentage / 100
+
+    def operation(ids):
+        Product.objects.filter(pk__in=ids).update(
+            unit_price=Greatest(Round(F('unit_price') * factor, 2), Decimal(1)),
+            last_update=timezone.now())
+        product_cache.invalidate()
+    return operation
+
+
+def set_payment_status(payment_status):
+    """
+    Returns an operation that sets the payment status of orders and keeps
+    the sales rollups of the orders entering or leaving complete in sync.
+    """
+    complete = Order.PAYMENT_STATUS_COMPLETE
+
+    def operation(ids):
+        with transaction.atomic():
+            orders = Order.objects.select_for_update().filter(pk__in=ids)
+            if payment_status == complete:
+                changed, sign = orders.exclude(payment_status=complete), 1
+            else:
+                changed, sign = orders.filter(payment_status=complete), -1
+            changed = list(changed)
+
+            orders.update(payment_status=payment_status)
+            for order in changed:
+                analytics.apply_order(order, sign)
+    return operation
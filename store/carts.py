@@ -0,0 +1,320 @@
+"""
+This module contains the storage backends of shopping carts.
+
+Carts are mostly anonymous, short lived and rewritten on every change,
+so they do not need to live in the relational database. The cart views and the
+checkout go through the backend configured in settings.CARTS:
+
+- 'orm' keeps carts in the Cart and CartItem tables.
+- 'cache' keeps each cart as a single record in a Django cache, such as
+  Redis or memcached in production, or the local memory or file based
+  caches in development and tests. Carts expire CART_TIMEOUT seconds
+  after their last change.
+
+Orders are only written to the database at checkout, by
+CreateOrderSerializer, which reads the cart from the backend.
+
+A cart is either anonymous or owned by a customer, who has at most one.
+After logging in, a client merges its anonymous cart into the customer's
+cart, so that the items follow the customer across devices.
+"""
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone as dt_timezone
+from time import time
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from . import product_cache
+from .models import Cart, CartItem, Product
+
+
+@dataclass
+class CartLine:
+    """ An item of a cart, with the attributes of CartItem. """
+    id: int
+    product_id: int
+    quantity: int
+    product: Product = None
+
+
+@dataclass
+class StoredCart:
+    """
+    A cart and its items, as returned by the backends. Items are CartItem
+    or CartLine objects with their product loaded from the product cache.
+    """
+    id: UUID
+    created_at: datetime
+    items: list = field(default_factory=list)
+
+
+class ORMCartStore:
+    """ Keeps carts in the Cart and CartItem tables. """
+
+    def create(self):
+        cart = Cart.objects.create()
+        return StoredCart(cart.id, cart.created_at)
+
+    def get(self, cart_id):
+        """ Returns the cart with its items and their products, or None. """
+        cart = Cart.objects.filter(pk=cart_id).first()
+        if cart is None:
+            return None
+        items = list(CartItem.objects.filter(cart_id=cart_id))
+        products = product_cache.get_products([item.product_id for item in items])
+        for item in items:
+            item.product = products.get(item.product_id)
+        items = [item for item in items if item.product is not None]
+        return StoredCart(cart.id, cart.created_at, items)
+
+    def delete(self, cart_id):
+        """ Deletes a cart and returns whether it existed. """
+        deleted, _ = Cart.objects.filter(pk=cart_id).delete()
+        return deleted > 0
+
+    def add_item(self, cart_id, product_id, quantity):
+        """
+        Adds quantity of a product to a cart, on top of the quantity already
+        in the cart. Returns the item, or None when the cart does not exist.
+        """
+        if not Cart.objects.filter(pk=cart_id).exists():
+            return None
+        try:
+            item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+            item.quantity += quantity
+            item.save()
+        except CartItem.DoesNotExist:
+            item = CartItem.objects.create(
+                cart_id=cart_id, product_id=product_id, quantity=quantity)
+        return item
+
+    def update_item(self, cart_id, item_id, quantity):
+        """ Sets the quantity of an item. Returns the item, or None when it does not exist. """
+        item = CartItem.objects.filter(cart_id=cart_id, pk=item_id).first()
+        if item is not None:
+            item.quantity = quantity
+            item.save()
+        return item
+
+    def remove_item(self, cart_id, item_id):
+        """ Removes an item from a cart and returns whether it existed. """
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, pk=item_id).delete()
+        return deleted > 0
+
+    def get_customer_cart(self, customer_id):
+        """ Returns the ID of the customer's cart, which is created if needed. """
+        cart, _ = Cart.objects.get_or_create(customer_id=customer_id)
+        return cart.id
+
+    def merge(self, cart_id, customer_id):
+        """
+        Merges an anonymous cart into the customer's cart and returns the ID
+        of the customer's cart, or None when the cart does not exist or
+        belongs to another customer.
+
+        When the customer has no cart yet, the anonymous cart becomes theirs.
+        Otherwise its items are copied by one INSERT ... ON CONFLICT that adds
+        the quantities of the products already in the customer's cart, and
+        the anonymous cart is deleted.
+        """
+        db = router.db_for_write(CartItem)
+        with transaction.atomic(using=db):
+            source = Cart.objects.using(db).select_for_update().filter(pk=cart_id).first()
+            if source is None or source.customer_id not in (None, customer_id):
+                return None
+            if source.customer_id == customer_id:
+                return source.id
+
+            target = Cart.objects.using(db).select_for_update() \
+                .filter(customer_id=customer_id).first()
+            if target is None:
+                source.customer_id = customer_id
+                source.save(update_fields=['customer'])
+                return source.id
+
+            table = CartItem._meta.db_table
+            with connections[db].cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (cart_id, product_id, quantity) '
+                    f'SELECT %s, product_id, quantity FROM {table} WHERE cart_id = %s '
+                    f'ON CONFLICT (cart_id, product_id) '
+                    f'DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity',
+                    [Cart._meta.pk.get_db_prep_value(target.id, connections[db]),
+                     Cart._meta.pk.get_db_prep_value(source.id, connections[db])])
+            source.delete()
+            return target.id
+
+
+class CacheCartStore:
+    """
+    Keeps each cart in a Django cache as one compact record:
+    (created_at, next_item_id, ((item_id, product_id, quantity), ...), customer_id).
+    The cart of a customer is found through a second key holding its ID.
+
+    A change reads and rewrites the whole record without a lock, so of two
+    concurrent changes to the same cart, one may be lost. Carts are edited
+    by one client at a time, which makes this acceptable.
+    """
+
+    def __init__(self, alias='default', timeout=None):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get_key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def get_customer_key(self, customer_id):
+        return f'customer-cart:{customer_id}'
+
+    def read(self, cart_id):
+        return self.cache.get(self.get_key(cart_id))
+
+    def write(self, cart_id, created_at, next_id, lines, customer_id=None):
+        values = {self.get_key(cart_id): (created_at, next_id, tuple(lines), customer_id)}
+        if customer_id is not None:
+            # The customer's key expires with the cart.
+            values[self.get_customer_key(customer_id)] = cart_id
+        self.cache.set_many(values, self.timeout)
+
+    def create(self):
+        cart_id = uuid4()
+        created_at = time()
+        self.write(cart_id, created_at, 1, ())
+        return StoredCart(cart_id, datetime.fromtimestamp(created_at, dt_timezone.utc))
+
+    def get(self, cart_id):
+        """
+        Returns the cart with its items and their products, or None. Items
+        whose product was deleted are left out.
+        """
+        record = self.read(cart_id)
+        if record is None:
+            return None
+        created_at, _, lines, _ = record
+        products = product_cache.get_products([product_id for _, product_id, _ in lines])
+        items = [
+            CartLine(item_id, product_id, quantity, products[product_id])
+            for item_id, product_id, quantity in lines if product_id in products
+        ]
+        return StoredCart(cart_id, datetime.fromtimestamp(created_at, dt_timezone.utc), items)
+
+    def delete(self, cart_id):
+        """ Deletes a cart and returns whether it existed. """
+        return self.cache.delete(self.get_key(cart_id))
+
+    def add_item(self, cart_id, product_id, quantity):
+        """
+        Adds quantity of a product to a cart, on top of the quantity already
+        in the cart. Returns the item, or None when the cart does not exist.
+        """
+        record = self.read(cart_id)
+        if record is None:
+            return None
+        created_at, next_id, lines, customer_id = record
+        for item_id, line_product_id, line_quantity in lines:
+            if line_product_id == product_id:
+                item = CartLine(item_id, product_id, line_quantity + quantity)
+                break
+        else:
+            item = CartLine(next_id, product_id, quantity)
+            next_id += 1
+        lines = [line for line in lines if line[0] != item.id]
+        lines.append((item.id, item.product_id, item.quantity))
+        self.write(cart_id, created_at, next_id, lines, customer_id)
+        return item
+
+    def update_item(self, cart_id, item_id, quantity):
+        """ Sets the quantity of an item. Returns the item, or None when it does not exist. """
+        record = self.read(cart_id)
+        if record is None:
+            return None
+        created_at, next_id, lines, customer_id = record
+        for index, (line_id, product_id, _) in enumerate(lines):
+            if line_id == item_id:
+                lines = list(lines)
+                lines[index] = (item_id, product_id, quantity)
+                self.write(cart_id, created_at, next_id, lines, customer_id)
+                return CartLine(item_id, product_id, quantity)
+        return None
+
+    def remove_item(self, cart_id, item_id):
+        """ Removes an item from a cart and returns whether it existed. """
+        record = self.read(cart_id)
+        if record is None:
+            return False
+        created_at, next_id, lines, customer_id = record
+        remaining = [line for line in lines if line[0] != item_id]
+        if len(remaining) == len(lines):
+            return False
+        self.write(cart_id, created_at, next_id, remaining, customer_id)
+        return True
+
+    def get_customer_cart(self, customer_id):
+        """ Returns the ID of the customer's cart, which is created if needed. """
+        cart_id = self.cache.get(self.get_customer_key(customer_id))
+        if cart_id is None or self.read(cart_id) is None:
+            cart_id = uuid4()
+            self.write(cart_id, time(), 1, (), customer_id)
+        return cart_id
+
+    def merge(self, cart_id, customer_id):
+        """
+        Merges an anonymous cart into the customer's cart and returns the ID
+        of the customer's cart, or None when the cart does not exist or
+        belongs to another customer.
+
+        When the customer has no cart yet, the anonymous cart becomes theirs.
+        Otherwise the quantities of both carts are added up per product in
+        the customer's record, and the anonymous cart is deleted.
+        """
+        record = self.read(cart_id)
+        if record is None or record[3] not in (None, customer_id):
+            return None
+        if record[3] == customer_id:
+            return cart_id
+
+        target_id = self.cache.get(self.get_customer_key(customer_id))
+        target = target_id and self.read(target_id)
+        if not target:
+            self.write(cart_id, record[0], record[1], record[2], customer_id)
+            return cart_id
+
+        created_at, next_id, lines, _ = target
+        quantities = {product_id: [item_id, quantity] for item_id, product_id, quantity in lines}
+        for _, product_id, quantity in record[2]:
+            if product_id in quantities:
+                quantities[product_id][1] += quantity
+            else:
+                quantities[product_id] = [next_id, quantity]
+                next_id += 1
+        lines = [(item_id, product_id, quantity)
+                 for product_id, (item_id, quantity) in quantities.items()]
+        self.write(target_id, created_at, next_id, lines, customer_id)
+        self.delete(cart_id)
+        return target_id
+
+
+def get_config():
+    config = {'BACKEND': 'orm', 'CACHE': 'default', 'CART_TIMEOUT': 7 * 24 * 3600}
+    config.update(getattr(settings, 'CARTS', {}))
+    return config
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+def get_store():
+    """ Returns the cart backend configured in settings.CARTS['BACKEND']. """
+    config = get_config()
+    key = (config['BACKEND'], config['CACHE'], config['CART_TIMEOUT'])
+    with stores_lock:
+        if key not in stores:
+            if config['BACKEND'] == 'cache':
+                stores[key] = CacheCartStore(config['CACHE'], config['CART_TIMEOUT'])
+            else:
+                stores[key] = ORMCartStore()
+        return stores[key]
@@ -0,0 +1,145 @@
+"""
+This module renders the catalog to static JSON files that a CDN can serve.
+
+Products and collections are split into pages by ID: page n holds the
+objects with IDs from n * PAGE_SIZE to (n + 1) * PAGE_SIZE - 1, rendered
+in the shape of the list endpoints as {"results": [...]}. Since an object
+never moves to another page, a change only touches the page of the
+object, and a run only renders the pages whose object count, latest
+last_update or, for products, latest stock movement differ from the
+previous run.
+
+The pages are listed in manifest.json with the SHA-256 of their content,
+so clients can diff two manifests and download only the changed pages.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Count, F, Max
+from django.utils import timezone
+from core.renderers import FastJSONRenderer
+from . import inventory
+from .models import Collection, Product
+from .serializers import CollectionSerializer, ProductSerializer
+
+MANIFEST = 'manifest.json'
+KINDS = ['products', 'collections']
+
+
+def get_config():
+    config = {'ROOT': settings.BASE_DIR / 'catalog', 'PAGE_SIZE': 100}
+    config.update(getattr(settings, 'CATALOG_SNAPSHOT', {}))
+    return config
+
+
+def get_source(kind):
+    """ Returns the queryset and serializer class of a kind of page. """
+    if kind == 'products':
+        return inventory.with_stock(Product.objects.all()), ProductSerializer
+    return Collection.objects.annotate(products_count=Count('products')), CollectionSerializer
+
+
+def get_page_stats(kind, page_size):
+    """
+    Returns the object count, latest last_update and latest stock movement
+    ID of every non-empty page of a kind, keyed by page number. Stock
+    changes only append movements, which leave the first two unchanged.
+    """
+    queryset, _ = get_source(kind)
+    aggregates = {'count': Count('id'), 'last_update': Max('last_update')}
+    if kind == 'products':
+        aggregates['last_movement'] = Max(inventory.last_movement())
+    rows = queryset.model.objects \
+        .annotate(page=F('id') / page_size) \
+        .values('page') \
+        .annotate(**aggregates) \
+        .order_by('page')
+    return {
+        row['page']: (row['count'], row['last_update'].isoformat(), row.get('last_movement'))
+        for row in rows
+    }
+
+
+def get_path(kind, page):
+    return f'{kind}/{page}.json'
+
+
+def write_file(path, content):
+    """ Replaces a file at once, so that it is never served half written. """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_bytes(content)
+    os.replace(temporary, path)
+
+
+def render_page(kind, page, page_size, root):
+    """ Renders a page to its file and returns the SHA-256 of its content. """
+    queryset, serializer_class = get_source(kind)
+    objects = queryset \
+        .filter(id__gte=page * page_size, id__lt=(page + 1) * page_size) \
+        .order_by('id')
+    content = FastJSONRenderer().render(
+        {'results': serializer_class(objects, many=True).data})
+    write_file(Path(root) / get_path(kind, page), content)
+    return hashlib.sha256(content).hexdigest()
+
+
+def read_manifest(root):
+    try:
+        return json.loads((Path(root) / MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def build(root, page_size, render_pages, full=False):
+    """
+    Renders the pages that changed since the manifest in root and writes
+    the new manifest. Returns the numbers of rendered, unchanged and
+    removed pages.
+
+    Args:
+        root (Path): The directory of the snapshot.
+        page_size (int): The number of object IDs per page.
+        render_pages (callable): Called with a list of (kind, page) to
+            render, returns their SHA-256 in the same order.
+        full (bool): Whether to render every page.
+    """
+    previous = read_manifest(root)
+    if previous is None or previous.get('page_size') != page_size:
+        full = True
+    if previous is None:
+        previous = {kind: {'pages': []} for kind in KINDS}
+
+    manifest = {'page_size': page_size, 'generated_at': timezone.now().isoformat()}
+    stale, pages, removed = [], {}, []
+    for kind in KINDS:
+        known = {entry['page']: entry for entry in previous[kind]['pages']}
+        pages[kind] = []
+        for page, stats in get_page_stats(kind, page_size).items():
+            entry = known.pop(page, None)
+            if full or entry is None or \
+                    (entry['count'], entry['last_update'], entry.get('last_movement')) != stats:
+                entry = {'page': page, 'path': get_path(kind, page)}
+                stale.append((kind, page))
+            entry.update(zip(('count', 'last_update', 'last_movement'), stats))
+            pages[kind].append(entry)
+        removed.extend(entry['path'] for entry in known.values())
+
+    hashes = dict(zip(stale, render_pages(stale)))
+    for kind in KINDS:
+        for entry in pages[kind]:
+            if (kind, entry['page']) in hashes:
+                entry['sha256'] = hashes[(kind, entry['page'])]
+        manifest[kind] = {
+            'count': sum(entry['count'] for entry in pages[kind]),
+            'pages': pages[kind],
+        }
+    # The manifest is written after the pages it lists and before the
+    # pages it no longer lists are deleted.
+    write_file(Path(root) / MANIFEST, json.dumps(manifest, indent=2).encode())
+    for path in removed:
+        (Path(root) / path).unlink(missing_ok=True)
+    return len(stale), sum(len(pages[kind]) for kind in KINDS) - len(stale), len(removed)
@@ -0,0 +1,13 @@
+"""
+This module contains the system checks of the store app.
+"""
+from django.core.checks import register
+from core.checks import check_shared_cache
+from . import product_cache
+
+
+@register()
+def check_product_cache(app_configs, **kwargs):
+    return check_shared_cache(
+        'PRODUCT_CACHE', product_cache.get_config()['CACHE'], 'store.W001',
+        "Product changes only reach other processes after PRODUCT_CACHE['TTL'] seconds.")
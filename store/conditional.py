@@ -0,0 +1,134 @@
+"""
+This module adds conditional GET support (ETag and Last-Modified) to the
+catalog endpoints.
+
+The validators of a response are derived from MAX(last_update) and the
+row count of the queryset it is built from, which one aggregate query
+returns without loading or serializing the objects. Any insert, update
+or delete of a listed object changes one of the two, so a client whose
+validators still match is answered with 304 Not Modified. The stock of
+products is kept in the StockMovement ledger rather than on their rows,
+so the validators of products also include the ID of the latest movement
+of the listed products, which a second query reads from the ledger's
+primary key, see store/inventory.py. Deletions and stock changes only
+change the ETag, so clients should revalidate with If-None-Match rather
+than If-Modified-Since.
+
+Lists count their rows the way their paginator does: large lists on
+PostgreSQL use the planner's estimate, see store/pagination.py, and the
+paginator reuses the count of the validators. Deletions from a large list
+therefore only change its ETag once the table statistics are refreshed.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import inventory
+from .models import Product
+from .pagination import estimate_objects
+
+
+def get_aggregates(estimate):
+    """ Returns the aggregates to query, which include the count unless it was estimated. """
+    aggregates = {'last_modified': Max('last_update')}
+    if estimate is None:
+        aggregates['count'] = Count('pk')
+    return aggregates
+
+
+def add_estimate(validators, estimate):
+    if estimate is not None:
+        validators['count'] = estimate
+    validators['estimated'] = estimate is not None
+    return validators
+
+
+def get_validators(queryset, estimate=True):
+    """
+    Returns the aggregates of a queryset that its validators are derived
+    from, and whether the count is an estimate. The count is only
+    estimated when estimate is True. The validators of products also hold
+    the ID of their latest stock movement.
+    """
+    queryset = queryset.order_by()
+    rows = estimate_objects(queryset) if estimate else None
+    validators = add_estimate(queryset.aggregate(**get_aggregates(rows)), rows)
+    if queryset.model is Product:
+        validators['last_movement'] = inventory.latest_movements(queryset).first()
+    return validators
+
+
+async def aget_validators(queryset, estimate=True):
+    queryset = queryset.order_by()
+    rows = await sync_to_async(estimate_objects)(queryset) if estimate else None
+    validators = add_estimate(await queryset.aaggregate(**get_aggregates(rows)), rows)
+    if queryset.model is Product:
+        validators['last_movement'] = await inventory.latest_movements(queryset).afirst()
+    return validators
+
+
+def evaluate(request, media_type, validators):
+    """
+    Returns the ETag and Last-Modified of a response, and a 304 Not Modified
+    response when the request's If-None-Match or If-Modified-Since match
+    them, or None.
+
+    The query string and media type are part of the ETag, since pages,
+    filters and renderers of the same rows have different bodies.
+    """
+    last_modified = validators['last_modified']
+    source = f"{request.get_full_path()}:{media_type}:{validators['count']}:" \
+        f"{last_modified.isoformat() if last_modified else ''}:" \
+        f"{validators.get('last_movement') or ''}"
+    etag = quote_etag(hashlib.md5(source.encode()).hexdigest())
+    # HTTP dates have a resolution of one second.
+    last_modified = last_modified and int(last_modified.timestamp())
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    return etag, last_modified, not_modified
+
+
+def add_validators(response, etag, last_modified):
+    """ Sets the ETag and Last-Modified headers of a successful response. """
+    if response.status_code in (200, 304):
+        response.headers['ETag'] = etag
+        if last_modified:
+            response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answers the list and retrieve actions of a viewset with 304 Not Modified
+    when the client's copy is still current.
+
+    The queryset of the viewset must have a last_update field.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        self.validators = get_validators(queryset)
+        etag, last_modified, response = evaluate(
+            request, request.accepted_media_type, self.validators)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            validators = get_validators(
+                self.filter_queryset(self.get_queryset())
+                .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}),
+                estimate=False)
+        except (TypeError, ValueError, ValidationError):
+            # A malformed lookup value, which get_object answers with 404.
+            return super().retrieve(request, *args, **kwargs)
+        etag, last_modified, response = evaluate(
+            request, request.accepted_media_type, validators)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
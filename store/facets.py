@@ -0,0 +1,112 @@
+"""
+This module adds facet counts to the product list.
+
+?facets=collection,price adds to the page the number of filtered
+products per collection and per price bucket. Both facets come from a
+single query grouped by collection, with one FILTER (WHERE ...) count per
+price bucket, and are cached per filtered query. Price bucket boundaries
+are configured in settings.FACETS.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+from .fieldsets import parse_names
+
+FACETS = ['collection', 'price']
+
+
+def get_config():
+    config = {'PRICE_BUCKETS': [25, 50, 100, 250], 'CACHE_TIMEOUT': 300}
+    config.update(getattr(settings, 'FACETS', {}))
+    return config
+
+
+def get_price_buckets(boundaries):
+    """
+    Returns the (min, max) bounds of the price buckets that the boundaries
+    split prices into. A bucket holds the prices from its min included to
+    its max excluded; the first has no min and the last no max.
+    """
+    bounds = [None] + sorted(boundaries) + [None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def get_price_filter(lower, upper):
+    condition = Q()
+    if lower is not None:
+        condition &= Q(unit_price__gte=Decimal(str(lower)))
+    if upper is not None:
+        condition &= Q(unit_price__lt=Decimal(str(upper)))
+    return condition
+
+
+def count_facets(queryset, names, version=None):
+    """
+    Returns the counts of the facets of a product queryset.
+
+    The result is cached under the SQL of the facet query, so every filter
+    combination has its own entry, and version, which should change when
+    the filtered products do.
+    """
+    config = get_config()
+    buckets = get_price_buckets(config['PRICE_BUCKETS'])
+    counts = {'count': Count('pk')}
+    for index, (lower, upper) in enumerate(buckets):
+        counts[f'price_{index}'] = Count('pk', filter=get_price_filter(lower, upper))
+    rows = queryset \
+        .order_by() \
+        .values('collection_id', 'collection__title') \
+        .annotate(**counts) \
+        .order_by('collection__title')
+
+    sql, params = rows.query.sql_with_params()
+    signature = hashlib.md5(repr((rows.db, sql, params, version)).encode()).hexdigest()
+    rows = cache.get_or_set(f'facets:{signature}', lambda: list(rows), config['CACHE_TIMEOUT'])
+
+    facets = {}
+    if 'collection' in names:
+        facets['collection'] = [
+            {'id': row['collection_id'], 'title': row['collection__title'], 'count': row['count']}
+            for row in rows
+        ]
+    if 'price' in names:
+        facets['price'] = [
+            {'min': lower, 'max': upper,
+             'count': sum(row[f'price_{index}'] for row in rows)}
+            for index, (lower, upper) in enumerate(buckets)
+        ]
+    return facets
+
+
+class FacetMixin:
+    """
+    Adds the facets requested with ?facets= to the paginated list response
+    of a product viewset, computed over the filtered queryset of the page.
+
+    When the viewset also uses ConditionalGetMixin, the cached counts are
+    versioned with the validators of the filtered queryset, so they are
+    never older than the page they are served with.
+    """
+
+    def get_facet_names(self):
+        names = parse_names(self.request.query_params.get('facets', ''))
+        unknown = set(names) - set(FACETS)
+        if unknown:
+            raise ValidationError({'facets': [
+                f'Unknown facets: {", ".join(sorted(unknown))}. '
+                f'Choose from: {", ".join(FACETS)}.']})
+        return names
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        names = self.get_facet_names()
+        if names:
+            validators = getattr(self, 'validators', None)
+            version = validators and (validators['count'], validators['last_modified'])
+            response.data['facets'] = count_facets(
+                self.filter_queryset(self.get_queryset()), names, version)
+        return response
@@ -0,0 +1,102 @@
+"""
+This module adds sparse fieldsets to the API.
+
+?fields=id,title,unit_price returns only the listed fields of each object
+and ?exclude=description returns all but the listed ones. The selection
+is applied twice: the serializer drops the other fields, so their
+SerializerMethodFields and nested serializers never run, and the view
+loads only the columns that the remaining fields read with QuerySet.only().
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+
+def parse_names(value):
+    """ Splits a comma separated query parameter into field names. """
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Serializes only the fields selected by the fields and exclude arguments.
+
+    Fields whose source is not a model field, such as SerializerMethodFields,
+    are listed in Meta.field_dependencies with the model fields they read.
+    """
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and not exclude:
+            return
+        available = set(self.fields)
+        unknown = (set(fields or ()) | set(exclude or ())) - available
+        if unknown:
+            raise ValidationError({'fields': [
+                f'Unknown fields: {", ".join(sorted(unknown))}. '
+                f'Choose from: {", ".join(self.fields)}.']})
+
+        selected = set(fields if fields is not None else available)
+        selected -= set(exclude or ())
+        for name in available - selected:
+            self.fields.pop(name)
+
+    def get_columns(self):
+        """
+        Returns the names of the model fields the selected fields read,
+        or None when a field's dependencies are unknown.
+        """
+        dependencies = getattr(self.Meta, 'field_dependencies', {})
+        opts = self.Meta.model._meta
+        columns = set()
+        for name, field in self.fields.items():
+            if name in dependencies:
+                columns.update(dependencies[name])
+                continue
+            try:
+                model_field = opts.get_field(field.source.split('.')[0])
+            except FieldDoesNotExist:
+                return None
+            # Reverse and many-to-many relations are loaded by their own queries.
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+        return columns
+
+
+class SparseFieldsetMixin:
+    """
+    Passes the ?fields= and ?exclude= selection of safe requests to the
+    serializer and restricts the queryset to the columns it reads.
+
+    The serializer class must include SparseFieldsSerializerMixin. Views
+    whose get_queryset prefetches related objects check wants_field first.
+    """
+
+    def get_sparse_fields(self):
+        """ Returns the serializer arguments selecting the fields of the response. """
+        if self.request.method not in ('GET', 'HEAD'):
+            return {}
+        params = self.request.query_params
+        sparse = {}
+        if 'fields' in params:
+            sparse['fields'] = parse_names(params['fields'])
+        if 'exclude' in params:
+            sparse['exclude'] = parse_names(params['exclude'])
+        return sparse
+
+    def wants_field(self, name):
+        """ Returns whether the response includes a field. """
+        sparse = self.get_sparse_fields()
+        return name in sparse.get('fields', [name]) and name not in sparse.get('exclude', [])
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        sparse = self.get_sparse_fields()
+        if sparse:
+            columns = self.get_serializer_class()(**sparse).get_columns()
+            if columns is not None:
+                queryset = queryset.only(*columns)
+        return queryset
@@ -0,0 +1,166 @@
+"""
+This module makes write requests idempotent with the Idempotency-Key header.
+
+A client that may retry a request sends a unique Idempotency-Key with it.
+The first request with a key claims it by inserting an IdempotencyKey row,
+runs, and stores its response in the row. Retries with the same key are
+answered with the stored response, and the write is not run again.
+Because the claim is an INSERT on a unique (scope, key), only one of
+several concurrent duplicates runs; the others get 409 Conflict until its
+response is stored. A claim whose request has not stored a response
+IDEMPOTENCY['LOCK_TIMEOUT'] seconds after it was made is assumed to be
+left over by a worker that died, and the next retry takes it over.
+
+Keys expire IDEMPOTENCY['KEY_TTL'] seconds after the first request, and
+expired rows are deleted by the purge_idempotency_keys command.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from core.throttling import get_client_ip
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+class KeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still in progress.'
+    default_code = 'idempotency_key_in_use'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class Replay(Exception):
+    """ Raised with the stored response of a retried request. """
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def get_config():
+    config = {'KEY_TTL': 24 * 3600, 'LOCK_TIMEOUT': 120}
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+def get_fingerprint(request):
+    """ Returns the hash of the method, path and body of a request. """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f'{request.method} {request.get_full_path()}\n'.encode())
+    fingerprint.update(request.body)
+    return fingerprint.hexdigest()
+
+
+def claim(scope, key, fingerprint):
+    """
+    Claims a key for a request and returns its IdempotencyKey.
+
+    Raises Replay with the stored response when the key was already used
+    for the same request, KeyInUse when that request is still running and
+    KeyReused when the key was used for another request.
+    """
+    config = get_config()
+    now = timezone.now()
+    IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                scope=scope, key=key, fingerprint=fingerprint, locked_at=now,
+                expires_at=now + timedelta(seconds=config['KEY_TTL']))
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+
+    if record is None:
+        # Released by a failed request an instant ago.
+        raise KeyInUse()
+    if record.fingerprint != fingerprint:
+        raise KeyReused()
+    if record.status_code is None:
+        if record.locked_at > now - timedelta(seconds=config['LOCK_TIMEOUT']):
+            raise KeyInUse()
+        # Only one of several concurrent retries takes the stale claim over.
+        taken = IdempotencyKey.objects \
+            .filter(pk=record.pk, status_code__isnull=True, locked_at=record.locked_at) \
+            .update(locked_at=now)
+        if not taken:
+            raise KeyInUse()
+        record.locked_at = now
+        return record
+    response = HttpResponse(
+        bytes(record.body), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    raise Replay(response)
+
+
+class IdempotencyMixin:
+    """
+    Makes the idempotent_actions of a viewset idempotent for requests with
+    an Idempotency-Key header. Requests without the header run as usual.
+
+    Keys are scoped to the user, so that one user's key never replays
+    another user's response, and those of anonymous requests to the client
+    address, see get_idempotency_scope. Responses with a server error are
+    not stored, so the request can be retried with the same key.
+    """
+    idempotent_actions = ['create']
+
+    def initial(self, request, *args, **kwargs):
+        self.idempotency_key = None
+        super().initial(request, *args, **kwargs)
+        key = request.headers.get(HEADER)
+        if key is None or self.action not in self.idempotent_actions:
+            return
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({HEADER: ['Ensure this header has no more than 255 characters.']})
+        self.idempotency_key = claim(
+            self.get_idempotency_scope(request), key, get_fingerprint(request))
+
+    def get_idempotency_scope(self, request):
+        """ Returns the scope of the Idempotency-Key of a request. """
+        if request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{get_client_ip(request)}'
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            self.release_idempotency_key()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record = getattr(self, 'idempotency_key', None)
+        if record is None:
+            return response
+        if response.status_code >= 500:
+            self.release_idempotency_key()
+            return response
+
+        response.render()
+        record.status_code = response.status_code
+        record.content_type = response.get('Content-Type', '')
+        record.body = response.content
+        record.save(update_fields=['status_code', 'content_type', 'body'])
+        return response
+
+    def release_idempotency_key(self):
+        """ Deletes the claim of a request that failed, so that it can be retried. """
+        record = getattr(self, 'idempotency_key', None)
+        if record is not None:
+            record.delete()
+            self.idempotency_key = None
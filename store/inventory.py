@@ -0,0 +1,234 @@
+"""
+This module contains the inventory updates of the store app.
+
+Stock is kept in an append-only ledger of StockMovement rows. The stock of
+a product is its snapshot, Product.inventory, plus the movements recorded
+after Product.inventory_movement_id. Sales and adjustments only insert
+movements, so concurrent checkouts of a product never wait on its row;
+take_snapshots periodically folds the settled movements into the products.
+
+Every change to the stock should go through record_movements, so that the
+low stock flag stays in sync and inventory_low is sent exactly once when a
+product crosses its collection's low stock threshold.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from . import product_cache
+from .models import Product, StockMovement
+from .signals import inventory_low
+
+
+def get_config():
+    config = {'SNAPSHOT_LAG': 60}
+    config.update(getattr(settings, 'INVENTORY', {}))
+    return config
+
+
+def movements_after_snapshot(upto=None):
+    """
+    Returns the movements of the product of the outer query that are not in
+    its snapshot yet, up to the movement with ID upto when given.
+    """
+    movements = StockMovement.objects.filter(
+        product=OuterRef('pk'), id__gt=OuterRef('inventory_movement_id'))
+    if upto is not None:
+        movements = movements.filter(id__lte=upto)
+    return movements.order_by().values('product')
+
+
+def current_stock():
+    """ Returns the expression of the current stock of the products of a queryset. """
+    deltas = movements_after_snapshot().annotate(total=Sum('quantity')).values('total')
+    return F('inventory') + Coalesce(Subquery(deltas), 0)
+
+
+def last_movement():
+    """
+    Returns the expression of the ID of the latest movement of the product
+    of the outer query, or None. Every change to its stock raises it.
+    """
+    movements = StockMovement.objects.filter(product=OuterRef('pk'))
+    return Subquery(movements.order_by('-id').values('id')[:1])
+
+
+def latest_movements(queryset):
+    """
+    Returns the IDs of the movements of the products of a queryset, latest
+    first, so that the first is read by walking the ledger's primary key.
+    """
+    return StockMovement.objects \
+        .filter(product__in=queryset.order_by().values('pk')) \
+        .order_by('-id') \
+        .values_list('id', flat=True)
+
+
+def with_stock(queryset):
+    """
+    Annotates the products of a queryset with their current stock as stock,
+    which the product serializers return as their inventory.
+    """
+    return queryset.annotate(stock=current_stock())
+
+
+def get_stock(product_ids):
+    """ Returns the current stock of products, keyed by product ID. """
+    return dict(with_stock(Product.objects.filter(pk__in=product_ids))
+                .values_list('id', 'stock'))
+
+
+def record_movements(kind, quantities):
+    """
+    Appends a movement of the given kind to the ledger per product.
+
+    Args:
+        kind (str): One of the StockMovement.KIND_* values.
+        quantities (dict): The stock delta keyed by product ID.
+    """
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=product_id, kind=kind, quantity=quantity)
+        for product_id, quantity in sorted(quantities.items()) if quantity
+    ])
+    refresh_low_stock(Product.objects.filter(pk__in=quantities))
+
+
+def set_stock(quantities):
+    """
+    Records the adjustments that bring the stock of products to the given
+    quantities, keyed by product ID.
+    """
+    stock = get_stock(quantities)
+    record_movements(StockMovement.KIND_ADJUSTMENT, {
+        product_id: quantity - stock[product_id]
+        for product_id, quantity in quantities.items() if product_id in stock
+    })
+
+
+def refresh_low_stock(queryset):
+    """
+    Re-evaluates the low stock flag of the products in the queryset and sends
+    inventory_low for the products that just went below their threshold.
+    """
+    threshold = F('collection__low_stock_threshold')
+    queryset = queryset.annotate(stock=current_stock())
+    crossed = list(queryset
+                   .filter(is_low_stock=False, stock__lt=threshold)
+                   .values_list('id', flat=True))
+    restocked = list(queryset
+                     .filter(is_low_stock=True, stock__gte=threshold)
+                     .values_list('id', flat=True))
+
+    if restocked:
+        Product.objects.filter(pk__in=restocked).update(is_low_stock=False)
+    if crossed:
+        Product.objects.filter(pk__in=crossed).update(is_low_stock=True)
+        inventory_low.send_robust(Product, product_ids=crossed)
+    if restocked or crossed:
+        product_cache.invalidate()
+
+
+def get_settled_movement_id():
+    """
+    Returns the ID of the last movement recorded SNAPSHOT_LAG seconds ago
+    or earlier, or 0.
+
+    IDs are allocated before the transactions inserting the movements
+    commit, so a snapshot up to the newest ID could skip a movement whose
+    transaction commits later. Snapshots stop at settled movements instead,
+    whose transactions are assumed to have committed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_config()['SNAPSHOT_LAG'])
+    return StockMovement.objects \
+        .filter(created_at__lte=cutoff) \
+        .order_by('-id') \
+        .values_list('id', flat=True) \
+        .first() or 0
+
+
+def open_ledger(product_ids):
+    """
+    Records the inventory of products that predate the ledger as their
+    opening receipt, so that replaying the ledger gives their stock.
+
+    Products never snapshotted from the ledger (inventory_movement_id 0)
+    with a non-zero inventory get a receipt of their inventory, which is
+    reset to 0; their stock is unchanged. Call it in a transaction that
+    locks the products.
+    """
+    products = Product.objects \
+        .filter(pk__in=product_ids, inventory_movement_id=0) \
+        .exclude(inventory=0)
+    opening = dict(products.values_list('id', 'inventory'))
+    if opening:
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=product_id, kind=StockMovement.KIND_RECEIPT, quantity=quantity)
+            for product_id, quantity in sorted(opening.items())
+        ])
+        Product.objects.filter(pk__in=opening).update(inventory=0)
+
+
+def take_snapshot(product_ids, upto):
+    """ Folds the movements of products up to the movement with ID upto into their snapshots. """
+    movements = movements_after_snapshot(upto)
+    with transaction.atomic():
+        list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values('pk'))
+        open_ledger(product_ids)
+        Product.objects.filter(pk__in=product_ids).update(
+            inventory=F('inventory') + Coalesce(
+                Subquery(movements.annotate(total=Sum('quantity')).values('total')), 0),
+            inventory_movement_id=Coalesce(
+                Subquery(movements.annotate(last=Max('id')).values('last')),
+                F('inventory_movement_id')),
+            last_update=timezone.now())
+
+
+def take_snapshots(batch_size=1000):
+    """
+    Folds the settled movements into the snapshots of the products that
+    have some, and opens the ledger of the products that predate it.
+    Returns the number of products snapshotted.
+    """
+    upto = get_settled_movement_id()
+    product_ids = set(StockMovement.objects
+                      .filter(id__lte=upto, id__gt=F('product__inventory_movement_id'))
+                      .values_list('product_id', flat=True)
+                      .distinct())
+    product_ids.update(Product.objects
+                       .filter(inventory_movement_id=0)
+                       .exclude(inventory=0)
+                       .values_list('id', flat=True))
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        take_snapshot(product_ids[start:start + batch_size], upto)
+    return len(product_ids)
+
+
+def rebuild_stock(first_id, last_id, upto):
+    """
+    Recomputes the snapshots of the products with IDs from first_id to
+    last_id by replaying their whole ledger up to the movement with ID
+    upto. Returns the number of products rebuilt.
+    """
+    movements = StockMovement.objects \
+        .filter(product=OuterRef('pk'), id__lte=upto) \
+        .order_by() \
+        .values('product')
+    with transaction.atomic():
+        product_ids = list(Product.objects
+                           .select_for_update()
+                           .filter(pk__gte=first_id, pk__lte=last_id)
+                           .order_by('pk')
+                           .values_list('pk', flat=True))
+        open_ledger(product_ids)
+        Product.objects.filter(pk__in=product_ids).update(
+            inventory=Coalesce(
+                Subquery(movements.annotate(total=Sum('quantity')).values('total')), 0),
+            inventory_movement_id=Coalesce(
+                Subquery(movements.annotate(last=Max('id')).values('last')), 0),
+            last_update=timezone.now())
+        refresh_low_stock(Product.objects.filter(pk__in=product_ids))
+    return len(product_ids)
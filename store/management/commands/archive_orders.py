@@ -0,0 +1,51 @@
+"""
+This module defines the archive_orders management command.
+
+The command moves the completed orders older than a number of months out
+of the Order and OrderItem tables into compressed ArchivedOrder rows.
+"""
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store import archive
+
+
+def months_ago(day, months):
+    """ Returns the first day of the month that is months before the month of day. """
+    index = day.year * 12 + day.month - 1 - months
+    return day.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+class Command(BaseCommand):
+    """
+    Archives the completed orders placed before the month that started
+    --months months ago, so whole months are archived at once.
+
+    Orders are archived in batches of --batch-size, each in its own short
+    transaction, so the command can run while the store takes orders and
+    can be stopped and resumed at any point.
+    """
+    help = 'Moves old completed orders into compressed archive rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12,
+                            help='Number of past months of orders to keep live.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['months'] < 1:
+            raise CommandError('--months must be at least 1.')
+        cutoff = timezone.make_aware(datetime.combine(
+            months_ago(timezone.localdate(), options['months']), time.min))
+
+        archived = 0
+        while True:
+            count = archive.archive_batch(cutoff, options['batch_size'])
+            if not count:
+                break
+            archived += count
+            self.stdout.write(f'{archived} orders archived.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} orders placed before {cutoff:%Y-%m-%d} were successfully archived.'))
@@ -0,0 +1,100 @@
+"""
+This module defines the benchmark_rendering management command.
+
+The command times how long the API takes to turn its largest payloads
+into response bodies, with DRF's JSONRenderer and with FastJSONRenderer,
+and how much gzip and brotli shrink them.
+"""
+import gzip
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Prefetch
+from rest_framework.renderers import JSONRenderer
+from core.middleware import brotli
+from core.renderers import FastJSONRenderer, orjson
+from store import carts, inventory
+from store.models import Cart, Order, OrderItem, Product
+from store.serializers import CartSerializer, OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks rendering and compression of three payloads: a page of
+    --page-size products as served by /store/products/?page_size=N, the
+    cart with the most items and a page of orders with their items.
+
+    Serialization is done once per payload; only rendering and compression
+    are timed, --repeat times each, and the median is reported.
+    """
+    help = 'Measures JSON rendering and compression of the largest API payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Number of products and orders in the list payloads.')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Number of timed runs per payload.')
+
+    def handle(self, *args, **options):
+        payloads = self.build_payloads(options['page_size'])
+        if not payloads:
+            raise CommandError('There is nothing to render; run seed_store first.')
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                'orjson is not installed: FastJSONRenderer falls back to JSONRenderer.'))
+
+        config = getattr(settings, 'COMPRESSION', {})
+        gzip_level = config.get('GZIP_LEVEL', 6)
+        brotli_quality = config.get('BROTLI_QUALITY', 4)
+        compressors = {'gzip': lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)}
+        if brotli is not None:
+            compressors['br'] = lambda body: brotli.compress(body, quality=brotli_quality)
+
+        for name, data in payloads.items():
+            self.stdout.write(f'{name}:')
+            body = None
+            for renderer in (JSONRenderer(), FastJSONRenderer()):
+                duration, body = self.time(options['repeat'], renderer.render, data)
+                self.stdout.write(
+                    f'  {renderer.__class__.__name__:18} {duration * 1000:8.3f} ms  {len(body):9} bytes')
+            for encoding, compress in compressors.items():
+                duration, compressed = self.time(options['repeat'], compress, body)
+                self.stdout.write(
+                    f'  {encoding:18} {duration * 1000:8.3f} ms  {len(compressed):9} bytes '
+                    f'({len(compressed) / len(body):.0%})')
+
+    def build_payloads(self, page_size):
+        payloads = {}
+        products = inventory.with_stock(Product.objects.all())[:page_size]
+        if products:
+            payloads[f'{len(products)} products'] = {
+                'count': Product.objects.count(), 'next': None, 'previous': None,
+                'results': ProductSerializer(products, many=True).data}
+
+        # CartSerializer renders carts as returned by the cart backends.
+        cart = Cart.objects \
+            .annotate(items_count=Count('items')) \
+            .filter(items_count__gt=0) \
+            .order_by('-items_count') \
+            .first()
+        if cart is not None:
+            stored = carts.ORMCartStore().get(cart.id)
+            payloads[f'cart of {len(stored.items)} items'] = CartSerializer(stored).data
+
+        orders = Order.objects \
+            .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product'))) \
+            .order_by('-placed_at')[:page_size]
+        if orders:
+            payloads[f'{len(orders)} orders'] = OrderSerializer(orders, many=True).data
+        return payloads
+
+    @staticmethod
+    def time(repeat, function, argument):
+        durations = []
+        for _ in range(max(repeat, 1)):
+            start = perf_counter()
+            result = function(argument)
+            durations.append(perf_counter() - start)
+        return median(durations), result
@@ -0,0 +1,100 @@
+"""
+This module defines the benchmark_store management command.
+
+The command runs a traffic mix against the store API, prints latency
+percentiles, throughput and queries per request, and compares them with
+a stored baseline.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from store import benchmarks
+
+
+def parse_mix(value):
+    """ Parses a mix such as browse=60,search=20,cart=15,checkout=5. """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in benchmarks.SCENARIOS or not weight.isdigit():
+            raise CommandError(
+                f'Invalid mix entry "{part}". Scenarios are {", ".join(benchmarks.SCENARIOS)}.')
+        mix[name] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the store API.
+
+    Without --url, requests go through the Django test client against the
+    configured database, which should be seeded with seed_store first.
+    With --url, requests go to a running WSGI/ASGI server. The cart and
+    checkout scenarios write carts and orders.
+    """
+    help = 'Runs a traffic mix against the store API and compares it with a baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200,
+                            help='Number of user sessions to run.')
+        parser.add_argument('--mix', default='browse=60,search=20,cart=15,checkout=5',
+                            help='Relative weight of each scenario.')
+        parser.add_argument('--url',
+                            help='Base URL of a running server, e.g. http://127.0.0.1:8000.')
+        parser.add_argument('--prefix', default='/store',
+                            help='URL prefix of the store API.')
+        parser.add_argument('--concurrency', default='1',
+                            help='Number of sessions run in parallel. A comma separated list '
+                                 'runs the benchmark once per level, e.g. 1,8,32.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline',
+                            help='Path of a baseline JSON file to compare with.')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write the results to --baseline instead of comparing.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 regression as a fraction of the baseline.')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        path = options['baseline']
+        if path and len(levels) > 1:
+            raise CommandError('--baseline needs a single --concurrency level.')
+
+        if options['url']:
+            def target_factory(): return benchmarks.HttpTarget(options['url'])
+        else:
+            target_factory = benchmarks.TestClientTarget
+
+        for level in levels:
+            summary = benchmarks.run(
+                target_factory, mix, options['sessions'],
+                concurrency=level, seed=options['seed'],
+                prefix=options['prefix'])
+            self.print_summary(summary)
+
+        if path and options['save_baseline']:
+            with open(path, 'w') as file:
+                json.dump(summary, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {path}.'))
+        elif path:
+            with open(path) as file:
+                baseline = json.load(file)
+            regressions = benchmarks.compare(summary, baseline, options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Latency regressed:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regression against the baseline.'))
+
+    def print_summary(self, summary):
+        self.stdout.write(
+            f'{summary["requests"]} requests in {summary["duration_s"]} s '
+            f'({summary["throughput_rps"]} requests/s, concurrency {summary["concurrency"]})')
+        self.stdout.write(
+            f'{"endpoint":<32}{"requests":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>10}')
+        for label, stats in summary['endpoints'].items():
+            queries = stats['queries_per_request']
+            self.stdout.write(
+                f'{label:<32}{stats["requests"]:>10}{stats["p50_ms"]:>10}'
+                f'{stats["p95_ms"]:>10}{stats["p99_ms"]:>10}'
+                f'{"-" if queries is None else queries:>10}')
@@ -0,0 +1,61 @@
+"""
+This module defines the build_catalog_snapshot management command.
+
+The command renders the product and collection pages of the catalog to
+static JSON files with a manifest, for a CDN to serve.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from store import catalog
+
+
+class Command(BaseCommand):
+    """
+    Renders the catalog pages that changed since the last run into --root.
+
+    Pages are rendered by a pool of --workers processes, each with its own
+    database connection, so that serialization is not limited to one
+    CPU. Run it periodically, for example every few minutes from cron, and
+    publish the directory to the CDN.
+    """
+    help = 'Renders the catalog to static JSON pages and a manifest.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', type=Path,
+                            help='Directory of the snapshot. Defaults to CATALOG_SNAPSHOT["ROOT"].')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of processes rendering pages.')
+        parser.add_argument('--full', action='store_true',
+                            help='Render every page, even the unchanged ones.')
+
+    def handle(self, *args, **options):
+        config = catalog.get_config()
+        root = options['root'] or Path(config['ROOT'])
+        page_size = config['PAGE_SIZE']
+        if page_size < 1:
+            raise CommandError('CATALOG_SNAPSHOT["PAGE_SIZE"] must be at least 1.')
+        self.workers = max(options['workers'], 1)
+        self.root = root
+
+        rendered, unchanged, removed = catalog.build(
+            root, page_size, self.render_pages, options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{rendered} pages were rendered, {unchanged} were unchanged '
+            f'and {removed} were removed in {root}.'))
+
+    def render_pages(self, pages):
+        if not pages:
+            return []
+        page_size = catalog.get_config()['PAGE_SIZE']
+        # Forked workers must not share the connections of this process.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as executor:
+            futures = [
+                executor.submit(catalog.render_page, kind, page, page_size, str(self.root))
+                for kind, page in pages
+            ]
+            return [future.result() for future in futures]
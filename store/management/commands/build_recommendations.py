@@ -0,0 +1,139 @@
+"""
+This module defines the build_recommendations management command.
+
+The command rebuilds the ProductRecommendation table from the order
+history, live and archived orders alike, so that the related products
+endpoint never has to aggregate OrderItem rows at request time.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Mod
+from store import archive
+from store.models import ArchivedOrder, OrderItem, Product, ProductRecommendation
+
+
+class Command(BaseCommand):
+    """
+    Builds item-item co-occurrence counts and keeps the top-K neighbours
+    of every product.
+
+    Order lines are streamed from the database ordered by order, so only
+    one basket is held in memory at a time. The pair counts are
+    partitioned into shards by product ID: each shard re-reads the order
+    lines but only counts the pairs anchored on its own products, which
+    bounds the memory used by the counters to roughly 1/shards of the
+    full co-occurrence matrix. Unless --shards is given, a first pass
+    counts the pairs of all baskets and picks the number of shards that
+    keeps each one under --max-pairs counts.
+    """
+    help = 'Builds the "customers also bought" recommendation table from the order history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10,
+                            help='Number of related products to keep per product.')
+        parser.add_argument('--shards', type=int,
+                            help='Number of product ID partitions to build one after the other. '
+                                 'By default, the fewest that respect --max-pairs.')
+        parser.add_argument('--max-pairs', type=int, default=1000000,
+                            help='Number of pair counts a shard may hold, about 100 bytes each.')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of order lines fetched from the database per round trip.')
+        parser.add_argument('--max-basket-size', type=int, default=50,
+                            help='Orders with more distinct products than this are skipped.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of recommendation rows inserted per query.')
+
+    def handle(self, *args, **options):
+        # Archived orders may hold products deleted since.
+        self.product_ids = set(Product.objects.values_list('id', flat=True))
+        shards = options['shards']
+        if shards is None:
+            pairs = self.count_pair_occurrences(options)
+            shards = math.ceil(pairs / max(options['max_pairs'], 1))
+            self.stdout.write(f'{pairs} co-purchases, counted in {max(shards, 1)} shards.')
+        shards = max(shards, 1)
+        total = 0
+        for shard in range(shards):
+            counts = self.count_pairs(shard, shards, options)
+            rows = self.top_neighbours(counts, options['top_k'])
+            self.replace_shard(shard, shards, rows, options['batch_size'])
+            total += len(rows)
+            self.stdout.write(
+                f'Shard {shard + 1}/{shards}: {len(counts)} products, {len(rows)} recommendations.')
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} recommendations were successfully built.'))
+
+    def iter_baskets(self, chunk_size):
+        """
+        Yields the distinct product IDs of each order, one order at a time:
+        the live orders, then the archived ones.
+        """
+        lines = OrderItem.objects \
+            .order_by('order_id') \
+            .values_list('order_id', 'product_id') \
+            .iterator(chunk_size=chunk_size)
+        for _, group in groupby(lines, key=itemgetter(0)):
+            yield sorted({product_id for _, product_id in group})
+
+        archived = ArchivedOrder.objects \
+            .order_by('id') \
+            .values_list('items', flat=True) \
+            .iterator(chunk_size=chunk_size)
+        for items in archived:
+            yield sorted(set(archive.decode_product_ids(items)) & self.product_ids)
+
+    def count_pair_occurrences(self, options):
+        """
+        Returns the number of ordered pairs of products bought together,
+        summed over the baskets, which bounds the number of pair counts.
+        """
+        max_basket_size = options['max_basket_size']
+        return sum(len(basket) * (len(basket) - 1)
+                   for basket in self.iter_baskets(options['chunk_size'])
+                   if len(basket) <= max_basket_size)
+
+    def count_pairs(self, shard, shards, options):
+        """ Counts how often each product of the shard was bought with every other product. """
+        counts = defaultdict(Counter)
+        max_basket_size = options['max_basket_size']
+        for basket in self.iter_baskets(options['chunk_size']):
+            if len(basket) < 2 or len(basket) > max_basket_size:
+                continue
+            for product_id in basket:
+                if product_id % shards != shard:
+                    continue
+                neighbours = counts[product_id]
+                for other_id in basket:
+                    if other_id != product_id:
+                        neighbours[other_id] += 1
+        return counts
+
+    def top_neighbours(self, counts, top_k):
+        """ Keeps the top_k most frequently co-purchased products of every product. """
+        rows = []
+        for product_id, neighbours in counts.items():
+            best = heapq.nlargest(
+                top_k, neighbours.items(), key=lambda item: (item[1], -item[0]))
+            rows.extend(
+                ProductRecommendation(
+                    product_id=product_id,
+                    related_product_id=other_id,
+                    score=score
+                ) for other_id, score in best
+            )
+        return rows
+
+    def replace_shard(self, shard, shards, rows, batch_size):
+        """ Atomically swaps the stored recommendations of the shard for the new ones. """
+        with transaction.atomic():
+            ProductRecommendation.objects \
+                .annotate(shard=Mod('product_id', shards)) \
+                .filter(shard=shard) \
+                .delete()
+            ProductRecommendation.objects.bulk_create(rows, batch_size=batch_size)
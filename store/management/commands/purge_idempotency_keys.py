@@ -0,0 +1,35 @@
+"""
+This module defines the purge_idempotency_keys management command.
+
+The command deletes the Idempotency-Key records whose time to live has
+passed, so that the table only holds the keys clients may still retry.
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """
+    Deletes expired IdempotencyKey rows in batches of --batch-size, so that
+    a large backlog does not hold locks on the table for long. Run it
+    periodically, for example hourly from cron.
+    """
+    help = 'Deletes expired Idempotency-Key records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            ids = list(IdempotencyKey.objects
+                       .filter(expires_at__lte=now)
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} expired idempotency keys were successfully deleted.'))
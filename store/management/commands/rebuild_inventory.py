@@ -0,0 +1,54 @@
+"""
+This module defines the rebuild_inventory management command.
+
+The command recomputes the inventory snapshots of the products by
+replaying the whole stock ledger, one product ID range per partition.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+from store import inventory
+from store.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the inventory of every product from the stock ledger.
+
+    Products are split into ranges of --batch-size IDs. Each range is an
+    independent partition that is locked and rewritten in its own
+    transaction, so the ranges can be replayed in parallel by a pool of
+    workers that each hold their own database connection.
+    """
+    help = 'Rebuilds the product inventory snapshots from the stock ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of product IDs per range.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of ranges rebuilt in parallel.')
+
+    def handle(self, *args, **options):
+        bounds = Product.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('There are no products to rebuild.')
+            return
+
+        self.upto = inventory.get_settled_movement_id()
+        size = max(options['batch_size'], 1)
+        ranges = [(first, min(first + size - 1, bounds['last']))
+                  for first in range(bounds['first'], bounds['last'] + 1, size)]
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            count = sum(executor.map(self.rebuild_range, ranges))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} products were successfully rebuilt.'))
+
+    def rebuild_range(self, bounds):
+        """ Rebuilds one range and releases the worker's database connection. """
+        try:
+            return inventory.rebuild_stock(*bounds, self.upto)
+        finally:
+            connection.close()
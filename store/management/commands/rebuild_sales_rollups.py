@@ -0,0 +1,53 @@
+"""
+This module defines the rebuild_sales_rollups management command.
+
+The command recomputes the SalesRollup rows of a date range from the
+completed orders, one day per partition.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from store import analytics
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the sales rollups of every day between --start and --end.
+
+    Each day is an independent partition that is deleted and rewritten in
+    its own transaction, so the days can be rebuilt in parallel by a pool
+    of workers that each hold their own database connection.
+    """
+    help = 'Rebuilds the sales rollups of a date range from the order history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, required=True,
+                            help='First day to rebuild (YYYY-MM-DD).')
+        parser.add_argument('--end', type=date.fromisoformat,
+                            help='Last day to rebuild (YYYY-MM-DD). Defaults to --start.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of days rebuilt in parallel.')
+
+    def handle(self, *args, **options):
+        start = options['start']
+        end = options['end'] or start
+        if end < start:
+            raise CommandError('--end must not be before --start.')
+
+        days = [start + timedelta(days=offset)
+                for offset in range((end - start).days + 1)]
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            for day, count in zip(days, executor.map(self.rebuild_day, days)):
+                self.stdout.write(f'{day}: {count} rollups.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(days)} days were successfully rebuilt.'))
+
+    def rebuild_day(self, day):
+        """ Rebuilds one day and releases the worker's database connection. """
+        try:
+            return analytics.rebuild_day(day)
+        finally:
+            connection.close()
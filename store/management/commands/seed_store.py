@@ -0,0 +1,123 @@
+"""
+This module defines the seed_store management command.
+
+The command fills the database with a synthetic catalog, customers and
+order history, so that benchmarks and query plans can be checked at a
+realistic scale.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from store.models import Collection, Customer, Order, OrderItem, Product
+
+WORDS = ['red', 'blue', 'green', 'classic', 'modern', 'organic', 'premium', 'compact',
+         'wireless', 'leather', 'cotton', 'steel', 'wooden', 'portable', 'smart', 'vintage']
+NOUNS = ['chair', 'lamp', 'jacket', 'speaker', 'bottle', 'backpack', 'watch', 'mug',
+         'keyboard', 'blanket', 'kettle', 'sneaker', 'notebook', 'headphones', 'desk', 'shirt']
+
+
+class Command(BaseCommand):
+    """
+    Seeds collections, products, users with customers and orders with items.
+
+    Rows are inserted with bulk_create in batches. Seeded users share the
+    password given by --password so that benchmarks can authenticate.
+    """
+    help = 'Seeds the database with a synthetic catalog, customers and orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=20)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--max-items', type=int, default=5,
+                            help='Maximum number of items per order.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Orders are spread over this many past days.')
+        parser.add_argument('--password', default='benchmark',
+                            help='Password of the seeded users.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed, so that runs are reproducible.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            collections = Collection.objects.bulk_create(
+                [Collection(title=f'Collection {index}')
+                 for index in range(options['collections'])],
+                batch_size=batch_size)
+
+            products = Product.objects.bulk_create(
+                [self.make_product(rng, index, collections)
+                 for index in range(options['products'])],
+                batch_size=batch_size)
+
+            customers = self.create_customers(options, batch_size)
+
+            orders = Order.objects.bulk_create(
+                [Order(customer=rng.choice(customers),
+                       payment_status=rng.choice(Order.PAYMENT_STATUS_CHOICES)[0])
+                 for _ in range(options['orders'])],
+                batch_size=batch_size)
+            # placed_at is auto_now_add, so it can only be backdated after the insert.
+            now = timezone.now()
+            for order in orders:
+                order.placed_at = now - timedelta(
+                    seconds=rng.randint(0, options['days'] * 86400))
+            Order.objects.bulk_update(orders, ['placed_at'], batch_size=batch_size)
+
+            items = []
+            for order in orders:
+                count = rng.randint(1, max(options['max_items'], 1))
+                for product in rng.sample(products, min(count, len(products))):
+                    items.append(OrderItem(
+                        order=order,
+                        product=product,
+                        quantity=rng.randint(1, 3),
+                        unit_price=product.unit_price))
+            OrderItem.objects.bulk_create(items, batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(collections)} collections, {len(products)} products, '
+            f'{len(customers)} customers, {len(orders)} orders and {len(items)} order items. '
+            'Run rebuild_sales_rollups and build_recommendations to refresh the derived tables.'))
+
+    def make_product(self, rng, index, collections):
+        title = f'{rng.choice(WORDS).title()} {rng.choice(NOUNS)} {index}'
+        inventory = rng.randint(0, 100)
+        collection = rng.choice(collections)
+        return Product(
+            title=title,
+            slug=slugify(title),
+            description=f'A {title.lower()} for everyday use.',
+            unit_price=Decimal(rng.randint(100, 99999)) / 100,
+            inventory=inventory,
+            is_low_stock=inventory < collection.low_stock_threshold,
+            collection=collection)
+
+    def create_customers(self, options, batch_size):
+        """ Creates the users and, since bulk_create skips signals, their customers. """
+        User = get_user_model()
+        password = make_password(options['password'])
+        start = User.objects.count()
+        users = User.objects.bulk_create(
+            [User(username=f'bench{index}',
+                  email=f'bench{index}@example.com',
+                  first_name=f'Bench{index}',
+                  last_name='User',
+                  password=password)
+             for index in range(start, start + options['customers'])],
+            batch_size=batch_size)
+        return Customer.objects.bulk_create(
+            [Customer(user=user, phone='000') for user in users],
+            batch_size=batch_size)
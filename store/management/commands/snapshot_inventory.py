@@ -0,0 +1,26 @@
+"""
+This module defines the snapshot_inventory management command.
+
+The command folds the settled movements of the stock ledger into the
+inventory snapshots of the products.
+"""
+from django.core.management.base import BaseCommand
+from store import inventory
+
+
+class Command(BaseCommand):
+    """
+    Snapshots the stock of the products with movements since their last
+    snapshot, in batches of --batch-size products per transaction. Run it
+    periodically, for example every few minutes from cron, so that reading
+    the stock only adds up a few recent movements.
+    """
+    help = 'Folds recent stock movements into the product inventory snapshots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = inventory.take_snapshots(max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(
+            f'{count} products were successfully snapshotted.'))
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.conf import settings
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 from uuid import uuid4
 
 
@@ -26,10 +27,14 @@ class Collection(models.Model):
         id (int): The primary key for the product collection.
         title (str): The title of the product collection.
         featured_product (Product): The featured product of the product collection.
+        low_stock_threshold (int): Products of the collection with less inventory are low on stock.
+        last_update (datetime): The date and time the collection or its list of products last changed.
     """
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    low_stock_threshold = models.PositiveIntegerField(default=10)
+    last_update = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return self.title
@@ -48,10 +53,14 @@ class Product(models.Model):
         slug (str): The slug of the product.
         description (str): The description of the product.
         unit_price (decimal): The unit price of the product.
-        inventory (int): The number of the product in inventory.
+        inventory (int): The number of the product in inventory at the last snapshot of the stock ledger.
+        inventory_movement_id (int): The last StockMovement counted in inventory, or 0.
         last_update (datetime): The date and time the product was last updated.
         collection (Collection): The product collection the product belongs to.
         promotions (Promotion): The promotions the product belongs to.
+        is_low_stock (bool): Whether the inventory is below the collection's low stock threshold.
+        review_count (int): The number of reviews of the product.
+        rating_sum (int): The sum of the ratings of the product's reviews.
     """
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -61,16 +70,69 @@ class Product(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(1)])
     inventory = models.IntegerField(validators=[MinValueValidator(0)])
+    inventory_movement_id = models.BigIntegerField(default=0, editable=False)
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(
         Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
+    is_low_stock = models.BooleanField(default=False, editable=False)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(
+                fields=['id'],
+                condition=models.Q(is_low_stock=True),
+                name='store_product_low_stock_idx'),
+            # The default ordering of the product list, unfiltered and by collection.
+            models.Index(fields=['title', 'id'], name='store_product_title_idx'),
+            models.Index(fields=['collection', 'title'], name='store_product_coll_title_idx'),
+            # The ?ordering= and price range filters of the product list.
+            models.Index(fields=['unit_price'], name='store_product_price_idx'),
+            models.Index(fields=['last_update'], name='store_product_updated_idx'),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    This class represents a change to the stock of a product. Movements
+    are only ever appended: the stock of a product is the snapshot kept in
+    Product.inventory plus the movements recorded after it.
+
+    Attributes:
+        id (int): The primary key for the movement, which orders the ledger.
+        product (Product): The product whose stock changed.
+        kind (str): What changed the stock.
+        quantity (int): The number of units added, or removed when negative.
+        created_at (datetime): The date and time the movement was recorded.
+    """
+    KIND_RECEIPT = 'R'
+    KIND_SALE = 'S'
+    KIND_ADJUSTMENT = 'A'
+    KIND_RESERVATION = 'V'
+    KIND_CHOICES = [
+        (KIND_RECEIPT, 'Receipt'),
+        (KIND_SALE, 'Sale'),
+        (KIND_ADJUSTMENT, 'Adjustment'),
+        (KIND_RESERVATION, 'Reservation')
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The movements of a product after its snapshot.
+            models.Index(fields=['product', 'id'], name='store_stock_product_idx'),
+        ]
 
 
 class Customer(models.Model):
@@ -152,6 +214,15 @@ class Order(models.Model):
         permissions = [
             ('cancel_order', 'Can cancel order')
         ]
+        indexes = [
+            # A customer's order history; covers every column of the order list.
+            models.Index(
+                fields=['customer', '-placed_at'],
+                include=['payment_status'],
+                name='store_order_customer_idx'),
+            # The admin payment status filter and the completed orders of a day.
+            models.Index(fields=['payment_status', 'placed_at'], name='store_order_status_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -171,6 +242,33 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
 
+class ArchivedOrder(models.Model):
+    """ This class represents a completed order moved out of the Order and
+    OrderItem tables by the archive_orders management command.
+
+    Attributes:
+        id (int): The primary key of the order before it was archived.
+        customer (Customer): The customer who placed the order.
+        placed_at (datetime): The date and time the order was placed.
+        payment_status (str): The payment status of the order.
+        items (bytes): The order items, compressed with store.archive.encode_items.
+        archived_at (datetime): The date and time the order was archived.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        Customer, on_delete=models.PROTECT, related_name='archived_orders')
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    items = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-placed_at'], name='store_archive_customer_idx'),
+            models.Index(fields=['placed_at'], name='store_archive_placed_idx'),
+        ]
+
+
 class Address(models.Model):
     """
     This class represents an address in the store.
@@ -194,12 +292,15 @@ class Cart(models.Model):
     Attributes:
         id (uuid): The primary key for the cart. We use a UUIDField to generate a unique ID for a cart.
         This will act as a kind of security so that random users cannot access other users' carts.
-        Since we are not tying the cart to a user, we will use a UUIDField instead of a AutoField.
+        Since anonymous carts are not tied to a user, we will use a UUIDField instead of a AutoField.
         
         created_at (datetime): The date and time the cart was created.
+        customer (Customer): The customer who owns the cart, or None for an anonymous cart.
     """
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    customer = models.OneToOneField(
+        Customer, null=True, blank=True, on_delete=models.CASCADE, related_name='cart')
 
 
 class CartItem(models.Model):
@@ -232,10 +333,148 @@ class Review(models.Model):
         product (Product): The product the review belongs to.
         name (str): The name of the reviewer.
         description (str): The description of the review.
+        rating (int): The rating of the product, from 1 to 5.
         date (datetime): The date the review was created.
+        last_update (datetime): The date and time the review was last updated.
     """
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField()
+    rating = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(5)])
     date = models.DateField(auto_now_add=True)
+    last_update = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Serves the review listing of a product, newest first.
+            models.Index(
+                fields=['product', 'date', 'id'],
+                name='store_review_product_date_idx'),
+        ]
+
+
+class ProductRecommendation(models.Model):
+    """
+    This class represents a precomputed "customers also bought" entry.
+
+    Rows are written by the build_recommendations management command
+    from the order history and are only ever read by the API.
+
+    Attributes:
+        id (int): The primary key for the recommendation.
+        product (Product): The product the recommendation is shown for.
+        related_product (Product): The product that was bought together with it.
+        score (int): The number of orders that contained both products.
+    """
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='recommendations')
+    related_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['product', '-score', 'related_product']
+        unique_together = [['product', 'related_product']]
+
+
+class SalesRollup(models.Model):
+    """
+    This class represents the sales of a product on a given day.
+
+    Rows are maintained incrementally when an order's payment completes
+    and can be rebuilt from the order history with the
+    rebuild_sales_rollups management command.
+
+    Attributes:
+        id (int): The primary key for the rollup.
+        day (date): The day the orders were placed.
+        collection (Collection): The collection the product belongs to.
+        product (Product): The product that was sold.
+        units (int): The number of units sold.
+        revenue (decimal): The revenue of the units sold.
+        order_count (int): The number of completed orders that included the product.
+    """
+    day = models.DateField()
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name='+')
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['day', 'collection', 'product']]
+
+
+class BulkJob(models.Model):
+    """
+    This class represents a bulk admin action run in batches.
+
+    Attributes:
+        id (int): The primary key for the job.
+        description (str): The description of the action.
+        status (str): The status of the job.
+        total (int): The number of selected rows.
+        processed (int): The number of rows processed so far.
+        error (str): The error that stopped the job, if any.
+        created_at (datetime): The date and time the job was started.
+        heartbeat_at (datetime): The date and time the job last reported progress.
+        finished_at (datetime): The date and time the job finished.
+    """
+    STATUS_RUNNING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    description = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    total = models.PositiveIntegerField()
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return self.description
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class IdempotencyKey(models.Model):
+    """
+    This class represents a write request made with an Idempotency-Key
+    header, and its response once it has one.
+
+    Attributes:
+        id (int): The primary key for the record.
+        scope (str): The client the key belongs to: a user, a cart, or the
+            address of an anonymous client.
+        key (str): The value of the Idempotency-Key header.
+        fingerprint (str): The hash of the method, path and body of the request.
+        status_code (int): The status of the response, or None while the request runs.
+        content_type (str): The content type of the response.
+        body (bytes): The rendered body of the response.
+        locked_at (datetime): The date and time the running request claimed the key.
+        expires_at (datetime): The date and time after which the key can be reused.
+    """
+    scope = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(blank=True)
+    locked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [['scope', 'key']]
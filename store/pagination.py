@@ -1,4 +1,306 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.core.exceptions import ValidationError
+from django.db.models import F, Field, Func, Q, Value
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Result sets the planner expects to be at least this large are not counted exactly.
+ESTIMATE_THRESHOLD = 10000
+# How long exact counts are reused for the same query, in seconds.
+COUNT_CACHE_TIMEOUT = 60
+
+
+def explain_rows(queryset):
+  """ Returns PostgreSQL's estimate of the number of rows of a queryset, without running it. """
+  sql, params = queryset.query.sql_with_params()
+  with connections[queryset.db].cursor() as cursor:
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+  if isinstance(plan, str):
+    plan = json.loads(plan)
+  return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_objects(queryset):
+  """
+  Returns PostgreSQL's estimate of the number of rows of a queryset when
+  the planner expects at least ESTIMATE_THRESHOLD rows, and None otherwise.
+  """
+  queryset = queryset.order_by()
+  if connections[queryset.db].vendor != 'postgresql':
+    return None
+  estimate = explain_rows(queryset)
+  return estimate if estimate >= ESTIMATE_THRESHOLD else None
+
+
+def count_objects(object_list):
+  """
+  Returns the number of objects of a list or queryset and whether it is
+  an estimate.
+
+  On PostgreSQL, querysets the planner expects to return at least
+  ESTIMATE_THRESHOLD rows are not counted: the planner's estimate, which
+  comes from the table statistics, is returned instead. Smaller querysets
+  are counted exactly, and the count is cached per query for
+  COUNT_CACHE_TIMEOUT seconds.
+  """
+  if not isinstance(object_list, QuerySet):
+    return len(object_list), False
+
+  queryset = object_list.order_by()
+  estimate = estimate_objects(queryset)
+  if estimate is not None:
+    return estimate, True
+
+  sql, params = queryset.query.sql_with_params()
+  signature = hashlib.md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+  return cache.get_or_set(f'count:{signature}', queryset.count, COUNT_CACHE_TIMEOUT), False
+
+
+def get_counted(validators):
+  """ Returns the count of conditional validators and whether it is an estimate, or None. """
+  if validators is None:
+    return None
+  return validators['count'], validators['estimated']
+
+
+class EstimatedCountPaginator(Paginator):
+  """
+  A paginator whose count comes from count_objects, unless a count and
+  whether it is an estimate are given as counted.
+
+  When the count is an estimate, pages past the estimated last page are
+  still served, so that an underestimate does not hide the last objects.
+  """
+
+  def __init__(self, object_list, per_page, *args, counted=None, **kwargs):
+    super().__init__(object_list, per_page, *args, **kwargs)
+    self.counted = counted
+
+  @cached_property
+  def count(self):
+    if self.counted is not None:
+      count, self.estimated = self.counted
+    else:
+      count, self.estimated = count_objects(self.object_list)
+    return count
+
+  def validate_number(self, number):
+    if not (self.count and self.estimated):
+      return super().validate_number(number)
+    try:
+      number = int(number)
+    except (TypeError, ValueError):
+      raise PageNotAnInteger('That page number is not an integer')
+    if number < 1:
+      raise EmptyPage('That page number is less than 1')
+    return number
+
+  def page(self, number):
+    # Unlike Paginator.page, the last page is not cut at the count, which
+    # may be an estimate or slightly stale.
+    number = self.validate_number(number)
+    bottom = (number - 1) * self.per_page
+    return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  """
+  Paginates by page number. Clients choose up to max_page_size objects
+  per page with ?page_size=.
+
+  The lists of ConditionalGetMixin have counted their queryset for its
+  validators already, so their count is reused instead of counted again.
+  """
+  page_size = 10
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.counted = get_counted(getattr(view, 'validators', None))
+    return super().paginate_queryset(queryset, request, view)
+
+  def django_paginator_class(self, object_list, per_page):
+    return EstimatedCountPaginator(object_list, per_page, counted=self.counted)
+
+
+class KeysetPagination(CursorPagination):
+  """
+  Paginates by primary key instead of by offset, so that deep pages
+  cost the same as the first one.
+  """
+  page_size = 10
+  ordering = 'id'
+
+
+class OrderedKeysetPagination(BasePagination):
+  """
+  Paginates by the values of several ordering fields, such as a date
+  and the primary key, so that every page is read from an index on
+  those fields regardless of its depth.
+
+  CursorPagination only seeks on the first ordering field and skips
+  rows sharing its value, which is slow when many rows share a date.
+  Pages only link forward, with the values of their last object.
+  """
+  page_size = 10
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+  cursor_query_param = 'cursor'
+  ordering = ('-id',)
+
+  def get_page_queryset(self, queryset, request):
+    """ Returns the queryset of the requested page, plus one object to detect the next page. """
+    self.request = request
+    self.page_size = self.get_page_size(request)
+    queryset = queryset.order_by(*self.ordering)
+    encoded = request.GET.get(self.cursor_query_param)
+    if encoded:
+      seek, row = self.get_seek_filter(queryset.model, encoded)
+      if row is not None:
+        queryset = queryset.alias(seek=row)
+      queryset = queryset.filter(seek)
+    return queryset[:self.page_size + 1]
+
+  def get_seek_filter(self, model, encoded):
+    """
+    Returns the filter of the objects after the cursor in the ordering,
+    and the row expression it compares when it is a row comparison.
+    """
+    try:
+      values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+      if len(values) != len(self.ordering):
+        raise ValueError
+      values = [model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, values)]
+    except (TypeError, ValueError, ValidationError):
+      raise NotFound('Invalid cursor.')
+
+    directions = {name.startswith('-') for name in self.ordering}
+    if len(directions) == 1:
+      # A row comparison, (a, b) < (x, y), is an index condition on PostgreSQL.
+      row = Func(*[F(name.lstrip('-')) for name in self.ordering],
+                 function='', output_field=Field())
+      cursor = Func(*[Value(value) for value in values], function='')
+      lookup = 'lt' if directions == {True} else 'gt'
+      return Q(**{f'seek__{lookup}': cursor}), row
+
+    # (a, b) after (x, y) is a after x, or a equal to x and b after y.
+    seek = Q()
+    for index, name in enumerate(self.ordering):
+      lookup = 'lt' if name.startswith('-') else 'gt'
+      condition = Q(**{f'{name.lstrip("-")}__{lookup}': values[index]})
+      for previous, value in zip(self.ordering[:index], values):
+        condition &= Q(**{previous.lstrip('-'): value})
+      seek |= condition
+    return seek, None
+
+  def build_page(self, objects):
+    """ Returns the objects of the page and the link to the next page. """
+    objects = list(objects)
+    next_link = None
+    if len(objects) > self.page_size:
+      objects = objects[:self.page_size]
+      last = objects[-1]
+      values = [getattr(last, name.lstrip('-')) for name in self.ordering]
+      encoded = base64.urlsafe_b64encode(
+        json.dumps(values, default=str).encode()).decode()
+      next_link = replace_query_param(
+        self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+    return objects, next_link
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.GET[self.page_size_query_param])
+    except (KeyError, ValueError):
+      return self.page_size
+    if page_size < 1:
+      return self.page_size
+    return min(page_size, self.max_page_size)
+
+  def paginate_queryset(self, queryset, request, view=None):
+    objects, self.next_link = self.build_page(self.get_page_queryset(queryset, request))
+    return objects
+
+  def get_paginated_response(self, data):
+    return Response({'next': self.next_link, 'results': data})
+
+  async def apaginate_queryset(self, queryset, request, counted=None):
+    """
+    Async counterpart of paginate_queryset for the views in store.async_views.
+    Pages are not counted, so counted is ignored.
+    """
+    queryset = self.get_page_queryset(queryset, request)
+    objects, next_link = self.build_page([obj async for obj in queryset])
+    return objects, {'next': next_link}
+
+
+class ReviewPagination(OrderedKeysetPagination):
+  """ Paginates the reviews of a product, newest first. """
+  ordering = ('-date', '-id')
+
+
+class AsyncPagination:
+  """
+  Async counterpart of DefaultPagination for the views in store.async_views.
+
+  It returns the same count/next/previous/results shape, but counts and
+  fetches the page with the async ORM.
+  """
+  page_size = DefaultPagination.page_size
+  page_query_param = 'page'
+  page_size_query_param = DefaultPagination.page_size_query_param
+  max_page_size = DefaultPagination.max_page_size
+
+  async def apaginate_queryset(self, queryset, request, counted=None):
+    """
+    Returns the page of objects and the pagination links for the request.
+    The queryset is only counted when counted is None.
+    """
+    if counted is None:
+      counted = await sync_to_async(count_objects)(queryset)
+    count, estimated = counted
+    page_size = self.get_page_size(request)
+    try:
+      number = int(request.GET.get(self.page_query_param, 1))
+    except ValueError:
+      raise NotFound('Invalid page.')
+    last = max((count - 1) // page_size + 1, 1)
+    if number < 1 or (number > last and not estimated):
+      raise NotFound('Invalid page.')
+
+    offset = (number - 1) * page_size
+    results = [obj async for obj in queryset[offset:offset + page_size]]
+    url = request.build_absolute_uri()
+    return results, {
+      'count': count,
+      'next': replace_query_param(url, self.page_query_param, number + 1) if number < last else None,
+      'previous': self.get_previous_link(url, number),
+    }
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.GET[self.page_size_query_param])
+    except (KeyError, ValueError):
+      return self.page_size
+    if page_size < 1:
+      return self.page_size
+    return min(page_size, self.max_page_size)
+
+  def get_previous_link(self, url, number):
+    if number == 1:
+      return None
+    if number == 2:
+      return remove_query_param(url, self.page_query_param)
+    return replace_query_param(url, self.page_query_param, number - 1)
@@ -0,0 +1,205 @@
+"""
+This module contains the in-process cache of the products read by the
+carts and the checkout.
+
+Every cart view and checkout reads the title, unit price and low stock
+flag of the same popular products. Each process keeps these as compact
+(id, title, unit_price, is_low_stock) records in a least recently used
+cache bounded by PRODUCT_CACHE['MAX_BYTES'], where records also expire
+TTL seconds after they were read from the database.
+
+Changes to products bump a version key in the CACHE alias once their
+transaction commits. Every lookup compares it with the version the
+process last saw and empties its cache when it changed, so a process
+never serves a product changed by another process after that change is
+committed. The CACHE alias should therefore be shared by all processes;
+with a per-process cache such as the local memory one, changes made by
+other processes are only seen after TTL seconds.
+
+Hits, misses and evictions are counted in the metrics registry.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from time import monotonic
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from core.metrics import registry
+from .models import Product
+
+VERSION_KEY = 'product-cache:version'
+FIELDS = ('id', 'title', 'unit_price', 'is_low_stock')
+# The approximate size of the OrderedDict slot and expiry of an entry.
+ENTRY_OVERHEAD = 160
+
+registry.describe('product_cache_hits_total', 'Product lookups answered by the in-process product cache.')
+registry.describe('product_cache_misses_total', 'Product lookups read from the database.')
+registry.describe('product_cache_evictions_total', 'Products dropped from the product cache, by reason.')
+
+
+def get_config():
+    config = {'MAX_BYTES': 1024 * 1024, 'TTL': 60, 'CACHE': 'default'}
+    config.update(getattr(settings, 'PRODUCT_CACHE', {}))
+    return config
+
+
+def get_size(record):
+    """ Returns the approximate number of bytes held by a record. """
+    return ENTRY_OVERHEAD + sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record)
+
+
+class ProductCache:
+    """
+    This class represents the product cache of a process.
+
+    Attributes:
+        entries (OrderedDict): (expires_at, size, record) keyed by product ID,
+            from the least to the most recently used.
+        size (int): The approximate number of bytes held by the entries.
+        version (str): The shared version the entries were read under.
+    """
+
+    def __init__(self, max_bytes, ttl, alias='default'):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_products(self, product_ids):
+        """
+        Returns the products with the given IDs that exist, keyed by ID, as
+        unsaved Product objects holding the fields of a record.
+        """
+        version = self.sync()
+        now = monotonic()
+        records = {}
+        expired = 0
+        with self.lock:
+            for product_id in set(product_ids):
+                entry = self.entries.get(product_id)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    self.discard(product_id)
+                    expired += 1
+                    continue
+                self.entries.move_to_end(product_id)
+                records[product_id] = entry[2]
+
+        hits = len(records)
+        missing = set(product_ids) - set(records)
+        if missing:
+            loaded = list(Product.objects.filter(pk__in=missing).values_list(*FIELDS))
+            self.put(loaded, now + self.ttl, version)
+            records.update((record[0], record) for record in loaded)
+
+        self.count(hits, len(missing), expired)
+        return {
+            product_id: Product(**dict(zip(FIELDS, record)))
+            for product_id, record in records.items()
+        }
+
+    def put(self, records, expires_at, version):
+        """ Adds records read under a version, unless the version changed since. """
+        evicted = 0
+        with self.lock:
+            if version != self.version:
+                return
+            for record in records:
+                self.discard(record[0])
+                size = get_size(record)
+                if size > self.max_bytes:
+                    continue
+                self.entries[record[0]] = (expires_at, size, record)
+                self.size += size
+            while self.size > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+                evicted += 1
+        if evicted:
+            registry.increment('product_cache_evictions_total', evicted, reason='size')
+
+    def discard(self, product_id):
+        """ Removes a product from the cache. The caller holds the lock. """
+        entry = self.entries.pop(product_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def count(self, hits, misses, expired):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        if hits:
+            registry.increment('product_cache_hits_total', hits)
+        if misses:
+            registry.increment('product_cache_misses_total', misses)
+        if expired:
+            registry.increment('product_cache_evictions_total', expired, reason='expired')
+
+    def sync(self):
+        """
+        Empties the cache when products changed since the last lookup, and
+        returns the current version.
+        """
+        version = caches[self.alias].get(VERSION_KEY)
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+        return version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """ Returns the entry count, size in bytes and hit rate of the cache. """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+caches_by_config = {}
+caches_lock = threading.Lock()
+
+
+def get_cache():
+    """ Returns the product cache configured in settings.PRODUCT_CACHE. """
+    config = get_config()
+    key = (config['MAX_BYTES'], config['TTL'], config['CACHE'])
+    with caches_lock:
+        if key not in caches_by_config:
+            caches_by_config[key] = ProductCache(*key)
+        return caches_by_config[key]
+
+
+def get_products(product_ids):
+    """ Returns the products with the given IDs, keyed by ID, through the product cache. """
+    return get_cache().get_products(product_ids)
+
+
+def invalidate():
+    """
+    Makes every process drop its cached products once the current
+    transaction commits. Call it after changing the title, unit price or
+    low stock flag of products with QuerySet.update, which sends no signal.
+    """
+    def bump():
+        caches[get_config()['CACHE']].set(VERSION_KEY, uuid4().hex, None)
+        get_cache().clear()
+    transaction.on_commit(bump)
@@ -6,11 +6,15 @@ model to JSON and they serve as the external API representation
 of the each model.
 """
 
+from datetime import timedelta
 from decimal import Decimal
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
+from . import archive, carts, inventory, product_cache
+from .fieldsets import SparseFieldsSerializerMixin
 from .signals import order_created
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review
+from .models import ArchivedOrder, Customer, Order, OrderItem, Product, Collection, ProductRecommendation, Review, StockMovement
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -29,7 +33,19 @@ class CollectionSerializer(serializers.ModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class StockField(serializers.IntegerField):
+    """
+    Serializes the current stock of a product: its stock annotation, see
+    inventory.with_stock, or else its stock read from the ledger.
+    """
+
+    def get_attribute(self, instance):
+        if hasattr(instance, 'stock'):
+            return instance.stock
+        return inventory.get_stock([instance.pk]).get(instance.pk, instance.inventory)
+
+
+class ProductSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     """
     This class serializes the Product model.
 
@@ -38,22 +54,62 @@ class ProductSerializer(serializers.ModelSerializer):
         title (str): The title of the product.
         description (str): The description of the product.
         slug (str): The slug of the product.
-        inventory (int): The number of the product in inventory.
+        inventory (int): The number of the product in stock.
         unit_price (decimal): The unit price of the product.
         price_with_tax (decimal): The unit price of the product with tax.
         collection (Collection): The collection the product belongs to.
+        review_count (int): The number of reviews of the product.
+        average_rating (decimal): The average rating of the reviews, or None without reviews.
     """
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory',
-                  'unit_price', 'price_with_tax', 'collection']
-
+                  'unit_price', 'price_with_tax', 'collection',
+                  'review_count', 'average_rating']
+        field_dependencies = {
+            'price_with_tax': ['unit_price'],
+            'average_rating': ['rating_sum', 'review_count'],
+        }
+
+    inventory = StockField(min_value=0)
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
+    average_rating = serializers.SerializerMethodField()
 
     def calculate_tax(self, product: Product):
         return product.unit_price * Decimal(1.1)
 
+    def get_average_rating(self, product: Product):
+        if not product.review_count:
+            return None
+        return round(Decimal(product.rating_sum) / product.review_count, 2)
+
+    def update(self, instance, validated_data):
+        # A new inventory is recorded as an adjustment in the stock ledger.
+        stock = validated_data.pop('inventory', None)
+        product = super().update(instance, validated_data)
+        if stock is not None:
+            inventory.set_stock({product.id: stock})
+            product.stock = stock
+        return product
+
+
+class LowStockProductSerializer(serializers.ModelSerializer):
+    """
+    This class serializes the Product model for the low stock report.
+
+    Attributes:
+        id (int): The primary key for the product.
+        title (str): The title of the product.
+        inventory (int): The number of the product in stock.
+        collection (Collection): The collection the product belongs to.
+    """
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'inventory', 'collection']
+
+    inventory = StockField(read_only=True)
+
 
 class ReviewSerializer(serializers.ModelSerializer):
     """
@@ -64,10 +120,11 @@ class ReviewSerializer(serializers.ModelSerializer):
         date (datetime): The date and time the review was created.
         name (str): The name of the reviewer.
         description (str): The description of the review.
+        rating (int): The rating of the product, from 1 to 5.
     """
     class Meta:
         model = Review
-        fields = ['id', 'date', 'name', 'description']
+        fields = ['id', 'date', 'name', 'description', 'rating']
 
     def create(self, validated_data):
         product_id = self.context['product_id']
@@ -89,9 +146,25 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'unit_price']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class ProductRecommendationSerializer(serializers.ModelSerializer):
+    """
+    This class serializes the ProductRecommendation model.
+
+    Attributes:
+        product (SimpleProductSerializer): The related product.
+        score (int): The number of orders that contained both products.
+    """
+    product = SimpleProductSerializer(source='related_product')
+
+    class Meta:
+        model = ProductRecommendation
+        fields = ['product', 'score']
+
+
+class CartItemSerializer(serializers.Serializer):
     """
-    This class serializes the CartItem model.
+    This class serializes the items of a cart, as stored by the cart
+    backends in store/carts.py.
 
     Attributes:
         id (int): The primary key for the cart item.
@@ -99,20 +172,19 @@ class CartItemSerializer(serializers.ModelSerializer):
         quantity (int): The quantity of the product in the cart item.
         total_price (decimal): The total price of the cart item.
     """
+    id = serializers.IntegerField(read_only=True)
     product = SimpleProductSerializer()
+    quantity = serializers.IntegerField()
     total_price = serializers.SerializerMethodField()
 
-    def get_total_price(self, cart_item: CartItem):
+    def get_total_price(self, cart_item):
         return cart_item.quantity * cart_item.product.unit_price
 
-    class Meta:
-        model = CartItem
-        fields = ['id', 'product', 'quantity', 'total_price']
-
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(serializers.Serializer):
     """
-    This class serializes the Cart model.
+    This class serializes a cart, as stored by the cart backends in
+    store/carts.py.
 
     Attributes:
         id (uuid): The primary key for the cart.
@@ -124,68 +196,56 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
-
-    class Meta:
-        model = Cart
-        fields = ['id', 'items', 'total_price']
+        return sum([item.quantity * item.product.unit_price for item in cart.items])
 
 
-class AddCartItemSerializer(serializers.ModelSerializer):
+class AddCartItemSerializer(serializers.Serializer):
     """
-    This class serializes the CartItem model for adding a new cart item.
+    This class validates and adds an item to a cart.
 
     Attributes:
+        id (int): The primary key for the cart item.
         product_id (int): The primary key for the product.
         quantity (int): The quantity of the product in the cart item.
     """
+    id = serializers.IntegerField(read_only=True)
     product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
 
     def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
+        if value not in product_cache.get_products([value]):
             raise serializers.ValidationError(
                 'No product with the given ID was found.')
         return value
 
     def save(self, **kwargs):
         """
-        This method creates a new cart item or updates an existing one.
+        This method adds the product to the cart, or adds to its quantity
+        when it is already in the cart.
         """
-        cart_id = self.context['cart_id']
-        product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
-
+        self.instance = carts.get_store().add_item(
+            self.context['cart_id'],
+            self.validated_data['product_id'],
+            self.validated_data['quantity'])
         return self.instance
 
-    class Meta:
-        model = CartItem
-        fields = ['id', 'product_id', 'quantity']
-
 
-class UpdateCartItemSerializer(serializers.ModelSerializer):
+class UpdateCartItemSerializer(serializers.Serializer):
     """
-    This class serializes the CartItem model for updating an existing cart item.
+    This class validates and sets the quantity of an existing cart item.
 
     Attributes:
         quantity (int): The quantity of the product in the cart item.
     """
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
 
-    class Meta:
-        model = CartItem
-        fields = ['quantity']
+    def save(self, **kwargs):
+        self.instance = carts.get_store().update_item(
+            self.context['cart_id'], self.instance.id, self.validated_data['quantity'])
+        return self.instance
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     """
     This class serializes the Customer model.
 
@@ -220,7 +280,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'unit_price', 'quantity']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     """
     This class serializes the Order model.
 
@@ -238,6 +298,28 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
 
 
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """
+    This class serializes the ArchivedOrder model like OrderSerializer, so
+    that archived orders look the same as live ones.
+
+    Attributes:
+        id (int): The primary key for the order.
+        customer (CustomerSerializer): The customer who placed the order.
+        placed_at (datetime): The date and time the order was placed.
+        payment_status (str): The payment status of the order.
+        items (OrderItemSerializer): The order items in the order.
+    """
+    items = serializers.SerializerMethodField()
+
+    def get_items(self, order: ArchivedOrder):
+        return OrderItemSerializer(archive.decode_items(order.items), many=True).data
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     """
     This class serializes the Order model for updating an existing order.
@@ -261,36 +343,80 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        cart = carts.get_store().get(cart_id)
+        if cart is None:
             raise serializers.ValidationError(
                 'No cart with the given ID was found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if not cart.items:
             raise serializers.ValidationError('The cart is empty.')
         return cart_id
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
+        store = carts.get_store()
+        cart_id = self.validated_data['cart_id']
+        cart = store.get(cart_id)
+        # The cart may have been checked out or expired since validation.
+        if cart is None or not cart.items:
+            raise serializers.ValidationError(
+                {'cart_id': ['No cart with the given ID was found.']})
 
+        with transaction.atomic():
             customer = Customer.objects.get(
                 user_id=self.context['user_id'])
             order = Order.objects.create(customer=customer)
 
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
             order_items = [
                 OrderItem(
                     order=order,
                     product=item.product,
                     unit_price=item.product.unit_price,
                     quantity=item.quantity
-                ) for item in cart_items
+                ) for item in cart.items
             ]
             OrderItem.objects.bulk_create(order_items)
+            inventory.record_movements(StockMovement.KIND_SALE, {
+                item.product_id: -item.quantity for item in order_items
+            })
 
-            Cart.objects.filter(pk=cart_id).delete()
+            # The cart may live outside the database, so it is only deleted
+            # once the order is committed.
+            transaction.on_commit(lambda: store.delete(cart_id))
 
             order_created.send_robust(self.__class__, order=order)
 
             return order
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    """
+    This class validates the query parameters of the sales analytics endpoint.
+
+    Attributes:
+        start (date): The first day of the report. Defaults to 30 days ago.
+        end (date): The last day of the report. Defaults to today.
+        group_by (str): A comma separated list of day, collection and product.
+    """
+    GROUP_BY_FIELDS = {
+        'day': 'day',
+        'collection': 'collection_id',
+        'product': 'product_id',
+    }
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    group_by = serializers.CharField(required=False, default='day')
+
+    def validate_group_by(self, value):
+        groups = [group.strip() for group in value.split(',') if group.strip()]
+        unknown = [group for group in groups if group not in self.GROUP_BY_FIELDS]
+        if not groups or unknown:
+            raise serializers.ValidationError(
+                f'group_by must be a comma separated list of {", ".join(self.GROUP_BY_FIELDS)}.')
+        return [self.GROUP_BY_FIELDS[group] for group in dict.fromkeys(groups)]
+
+    def validate(self, data):
+        data.setdefault('end', timezone.localdate())
+        data.setdefault('start', data['end'] - timedelta(days=30))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        return data
@@ -1,3 +1,4 @@
 from django.dispatch import Signal
 
-order_created = Signal()
\ No newline at end of file
+order_created = Signal()
+inventory_low = Signal()
@@ -1,10 +1,134 @@
 """Signal handlers for the store app."""
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db.models import F
 from django.dispatch import receiver
-from store.models import Customer
+from django.utils import timezone
+from store import analytics, inventory, product_cache
+from store.models import Collection, Customer, Order, Product, Review
+from store.signals import inventory_low
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
   if kwargs['created']:
-    Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+    Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(pre_save, sender=Order)
+def remember_payment_status(sender, instance, **kwargs):
+  """ Keeps the stored payment status so that post_save can detect transitions. """
+  instance._previous_payment_status = None
+  if instance.pk and not kwargs['raw']:
+    instance._previous_payment_status = Order.objects \
+      .filter(pk=instance.pk) \
+      .values_list('payment_status', flat=True) \
+      .first()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, **kwargs):
+  """ Adds completed orders to the sales rollups and removes orders that leave the complete status. """
+  if kwargs['raw']:
+    return
+  previous = instance._previous_payment_status
+  current = instance.payment_status
+  if previous != Order.PAYMENT_STATUS_COMPLETE and current == Order.PAYMENT_STATUS_COMPLETE:
+    analytics.apply_order(instance, 1)
+  elif previous == Order.PAYMENT_STATUS_COMPLETE and current != Order.PAYMENT_STATUS_COMPLETE:
+    analytics.apply_order(instance, -1)
+
+
+@receiver(pre_save, sender=Product)
+def update_low_stock_flag(sender, instance, **kwargs):
+  """ Keeps is_low_stock in sync with the stock when a product is saved. """
+  if kwargs['raw']:
+    return
+  stock = instance.inventory
+  if instance.pk:
+    # The stock of a saved product includes the movements after its snapshot.
+    stock = inventory.get_stock([instance.pk]).get(instance.pk, stock)
+  is_low_stock = stock < instance.collection.low_stock_threshold
+  instance._crossed_low_stock = is_low_stock and not instance.is_low_stock
+  instance.is_low_stock = is_low_stock
+  instance._previous_collection_id = None
+  if instance.pk:
+    instance._previous_collection_id = Product.objects \
+      .filter(pk=instance.pk) \
+      .values_list('collection_id', flat=True) \
+      .first()
+
+
+@receiver(post_save, sender=Product)
+def alert_low_stock(sender, instance, **kwargs):
+  if getattr(instance, '_crossed_low_stock', False):
+    inventory_low.send_robust(Product, product_ids=[instance.id])
+
+
+@receiver(post_save, sender=Collection)
+def refresh_collection_low_stock(sender, instance, **kwargs):
+  """ Re-evaluates the products of a collection whose low stock threshold may have changed. """
+  if not kwargs['created'] and not kwargs['raw']:
+    inventory.refresh_low_stock(Product.objects.filter(collection_id=instance.id))
+
+
+@receiver(post_save, sender=Product)
+def touch_collections_of_moved_product(sender, instance, **kwargs):
+  """ Updates the last_update of the collections whose product count changed, for their ETags. """
+  if kwargs['raw']:
+    return
+  previous = instance._previous_collection_id
+  if previous != instance.collection_id:
+    Collection.objects \
+      .filter(pk__in=[previous, instance.collection_id]) \
+      .update(last_update=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+  """ Makes every process drop the cached records of products. """
+  product_cache.invalidate()
+
+
+@receiver(post_delete, sender=Product)
+def touch_collection_of_deleted_product(sender, instance, **kwargs):
+  Collection.objects \
+    .filter(pk=instance.collection_id) \
+    .update(last_update=timezone.now())
+
+
+@receiver(pre_save, sender=Review)
+def remember_rating(sender, instance, **kwargs):
+  """ Keeps the stored rating so that post_save can update the product's rating sum. """
+  instance._previous_rating = None
+  if instance.pk and not kwargs['raw']:
+    instance._previous_rating = Review.objects \
+      .filter(pk=instance.pk) \
+      .values_list('rating', flat=True) \
+      .first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_product(sender, instance, **kwargs):
+  """ Keeps the review count and rating sum of the product in sync. """
+  if kwargs['raw']:
+    return
+  if kwargs['created'] or instance._previous_rating is None:
+    changes = {'review_count': F('review_count') + 1, 'rating_sum': F('rating_sum') + instance.rating}
+  elif instance._previous_rating != instance.rating:
+    changes = {'rating_sum': F('rating_sum') + instance.rating - instance._previous_rating}
+  else:
+    return
+  Product.objects \
+    .filter(pk=instance.product_id) \
+    .update(last_update=timezone.now(), **changes)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_product(sender, instance, **kwargs):
+  Product.objects \
+    .filter(pk=instance.product_id) \
+    .update(
+      review_count=F('review_count') - 1,
+      rating_sum=F('rating_sum') - instance.rating,
+      last_update=timezone.now())
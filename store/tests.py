@@ -1,3 +1,1244 @@
-from django.test import TestCase
+"""
+Tests of the store app.
 
-# Create your tests here.
+QueryPlanTests are query plan regression tests. They seed a catalog at a
+realistic scale, request the hot endpoints and ask PostgreSQL to EXPLAIN
+every query each request ran. A query that only needs a few rows of a
+large table must not read the whole table (Seq Scan) nor sort a large
+part of it (Sort), which is what happens when an index it relies on is
+dropped or a filter stops matching it.
+
+They only run on PostgreSQL, whose planner is the one that matters:
+DJANGO_SETTINGS_MODULE=<postgresql settings> python manage.py test store
+The other tests run on any database.
+"""
+import hashlib
+import json
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import AccessToken
+from core import throttling
+from core.models import User
+from .analytics import rebuild_day
+from .checks import check_product_cache
+from .pagination import ReviewPagination
+from . import bulk, carts, catalog, inventory, pagination, product_cache
+from .signals import inventory_low
+from .models import (
+    ArchivedOrder, BulkJob, Cart, Collection, Customer, IdempotencyKey, Order, OrderItem, Product,
+    ProductRecommendation, Promotion, Review, SalesRollup, StockMovement)
+
+# Tables seeded large enough for the planner to prefer an index over a scan.
+LARGE_TABLES = {
+    'core_user', 'store_customer', 'store_order', 'store_orderitem',
+    'store_product', 'store_review',
+}
+# Sorting more rows than this for a single page means an index is missing.
+MAX_SORTED_ROWS = 1000
+
+
+def walk(plan):
+    """ Yields the nodes of an EXPLAIN (FORMAT JSON) plan. """
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are only checked on PostgreSQL.')
+@override_settings(THROTTLING={})
+class QueryPlanTests(TestCase):
+    """
+    This class checks the query plans of the product, review and order
+    endpoints and of the sales rollup rebuild against a seeded database.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=20, products=20000, customers=500,
+                     orders=5000, seed=1, stdout=StringIO())
+        rng = random.Random(1)
+        now = timezone.now()
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        Review.objects.bulk_create(
+            [Review(product_id=rng.choice(product_ids), name='Reviewer',
+                    description='Review', rating=rng.randint(1, 5),
+                    date=(now - timedelta(days=rng.randint(0, 365))).date())
+             for _ in range(20000)],
+            batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.collection = Collection.objects.order_by('id').first()
+        cls.product = Product.objects.order_by('id').first()
+        cls.customer = Customer.objects.filter(order__isnull=False).select_related('user').first()
+        cls.admin = User.objects.create_superuser(
+            'planner', 'planner@example.com', 'planner')
+
+    def setUp(self):
+        # Cached counts would hide the queries that compute them.
+        cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def get_problems(self, plan):
+        """ Returns the descriptions of the nodes of a plan that do not scale. """
+        problems = []
+        for node in walk(plan):
+            if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in LARGE_TABLES:
+                problems.append(f'Seq Scan on {node["Relation Name"]}')
+            elif node['Node Type'] == 'Sort':
+                rows = max(child['Plan Rows'] for child in node['Plans'])
+                if rows > MAX_SORTED_ROWS:
+                    problems.append(f'Sort of {rows} rows by {", ".join(node["Sort Key"])}')
+        return problems
+
+    def assertQueriesUseIndexes(self, label, queries):
+        """
+        Fails with the offending plans when a query that reads part of a
+        table (WHERE or LIMIT) does not scale.
+        """
+        failures = []
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or (' WHERE ' not in sql and ' LIMIT ' not in sql):
+                continue
+            plan = self.explain(sql)
+            problems = self.get_problems(plan)
+            if problems:
+                failures.append(
+                    f'{"; ".join(problems)}\n{sql}\n{json.dumps(plan, indent=2)}')
+        if failures:
+            self.fail(f'{label} runs queries that do not use an index:\n\n' + '\n\n'.join(failures))
+
+    def assertPlansUseIndexes(self, path, user=None, **extra):
+        """ Requests path and checks the plans of the queries it ran. """
+        if user is not None:
+            extra['HTTP_AUTHORIZATION'] = f'JWT {AccessToken.for_user(user)}'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, **extra)
+        self.assertEqual(response.status_code, 200, path)
+        self.assertQueriesUseIndexes(path, context.captured_queries)
+
+    def test_product_list(self):
+        self.assertPlansUseIndexes('/store/products/')
+        self.assertPlansUseIndexes('/store/products/?page=50')
+        self.assertPlansUseIndexes(f'/store/products/?collection_id={self.collection.id}')
+        self.assertPlansUseIndexes('/store/products/?ordering=unit_price')
+        self.assertPlansUseIndexes('/store/products/?ordering=-last_update')
+        self.assertPlansUseIndexes('/store/products/?unit_price__lt=5&ordering=unit_price')
+
+    def test_product_detail(self):
+        self.assertPlansUseIndexes(f'/store/products/{self.product.id}/')
+        self.assertPlansUseIndexes(f'/store/products/{self.product.id}/related/')
+
+    def test_low_stock_products(self):
+        self.assertPlansUseIndexes('/store/products/low-stock/', user=self.admin)
+
+    def test_product_reviews(self):
+        self.assertPlansUseIndexes(f'/store/products/{self.product.id}/reviews/')
+        response = self.client.get(f'/store/products/{self.product.id}/reviews/?page_size=1')
+        if response.json()['next']:
+            self.assertPlansUseIndexes(response.json()['next'])
+
+    def test_customer_orders(self):
+        self.assertPlansUseIndexes('/store/orders/', user=self.customer.user)
+
+    def test_rebuild_sales_day(self):
+        day = timezone.localdate(Order.objects.order_by('id').first().placed_at)
+        with CaptureQueriesContext(connection) as context:
+            rebuild_day(day)
+        self.assertQueriesUseIndexes(f'rebuild_day({day})', context.captured_queries)
+
+
+@override_settings(THROTTLING={})
+class BenchmarkCommandTests(TestCase):
+    """ This class runs the benchmark commands against a small seeded database. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=20, customers=3,
+                     orders=10, seed=1, stdout=StringIO())
+
+    def test_benchmark_rendering(self):
+        store = carts.ORMCartStore()
+        cart = store.create()
+        for product in Product.objects.order_by('id')[:3]:
+            store.add_item(cart.id, product.id, 2)
+
+        output = StringIO()
+        call_command('benchmark_rendering', page_size=5, repeat=1, stdout=output)
+        self.assertIn('5 products:', output.getvalue())
+        self.assertIn('cart of 3 items:', output.getvalue())
+        self.assertIn('5 orders:', output.getvalue())
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'],
+                   THROTTLING={'SCOPES': {'cart_create': {'RATE': 0.001, 'BURST': 1}}})
+class BenchmarkStoreTests(TransactionTestCase):
+    """
+    This class runs the benchmark_store command, whose sessions run in a
+    thread pool and so only see committed data.
+    """
+
+    def setUp(self):
+        throttling.stores.clear()
+        call_command('seed_store', collections=2, products=20, customers=3,
+                     orders=10, seed=1, stdout=StringIO())
+
+    def test_sessions_are_separate_clients(self):
+        output = StringIO()
+        call_command('benchmark_store', sessions=4, mix='cart=1', stdout=output)
+        self.assertIn('carts-list', output.getvalue())
+        self.assertNotIn('error', output.getvalue())
+
+
+class ProductCacheCheckTests(SimpleTestCase):
+    """ This class checks the system check of the product cache alias. """
+
+    def test_local_memory_cache_is_reported(self):
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([message.id for message in check_product_cache(None)], ['store.W001'])
+
+    def test_shared_cache_is_accepted(self):
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': '/tmp/intrade-cache'}}):
+            self.assertEqual(check_product_cache(None), [])
+
+
+@override_settings(THROTTLING={})
+class ConditionalGetTests(TestCase):
+    """ This class checks the validators of the product endpoints. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=20, customers=3,
+                     orders=10, seed=1, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        product = Product.objects.order_by('id').first()
+        for path in ['/store/products/', f'/store/products/{product.id}/', '/store/async/products/']:
+            etag = self.client.get(path)['ETag']
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response['ETag'], etag, path)
+
+    def test_changes_update_etag(self):
+        etag = self.client.get('/store/products/')['ETag']
+        product = Product.objects.filter(orderitems__isnull=True).first()
+        product.title = 'Renamed'
+        product.save()
+        changed = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+        product.delete()
+        deleted = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=changed['ETag'])
+        self.assertEqual(deleted.status_code, 200)
+        self.assertNotEqual(deleted['ETag'], changed['ETag'])
+
+    def test_stock_changes_update_etag(self):
+        product = Product.objects.order_by('id').first()
+        detail = f'/store/products/{product.id}/'
+        paths = [detail, '/store/products/', '/store/async/products/', f'/store/async/products/{product.id}/']
+        etags = {path: self.client.get(path)['ETag'] for path in paths}
+        inventory.record_movements(StockMovement.KIND_SALE, {product.id: -3})
+        for path in paths:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+            self.assertEqual(response.status_code, 200, path)
+            self.assertNotEqual(response['ETag'], etags[path], path)
+        self.assertEqual(self.client.get(detail).json()['inventory'],
+                         inventory.get_stock([product.id])[product.id])
+
+    def test_lists_are_counted_once(self):
+        for path in ['/store/products/', '/store/async/products/']:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(path)
+            self.assertEqual(response.json()['count'], 20, path)
+            counts = [query for query in context.captured_queries if 'COUNT(' in query['sql']]
+            self.assertEqual(len(counts), 1, path)
+
+
+@override_settings(THROTTLING={})
+class IdempotencyTests(TestCase):
+    """ This class checks the Idempotency-Key handling of the cart endpoints. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.product = Product.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def add_item(self, cart_id, quantity=1, key='key-1'):
+        return self.client.post(
+            f'/store/carts/{cart_id}/items/',
+            {'product_id': self.product.id, 'quantity': quantity},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed(self):
+        first = self.client.post('/store/carts/', HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post('/store/carts/', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        cart_id = first.json()['id']
+        self.add_item(cart_id)
+        self.add_item(cart_id)
+        items = self.client.get(f'/store/carts/{cart_id}/').json()['items']
+        self.assertEqual([item['quantity'] for item in items], [1])
+
+    def test_running_claim_conflicts(self):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        self.add_item(cart_id)
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.add_item(cart_id).status_code, 409)
+
+    def test_stale_claim_is_taken_over(self):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        self.add_item(cart_id)
+        IdempotencyKey.objects.update(
+            status_code=None, locked_at=timezone.now() - timedelta(seconds=121))
+        response = self.add_item(cart_id)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_changed_request_is_rejected(self):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        self.add_item(cart_id, quantity=1)
+        self.assertEqual(self.add_item(cart_id, quantity=2).status_code, 422)
+
+    def test_anonymous_keys_are_scoped_to_the_cart(self):
+        first = self.client.post('/store/carts/').json()['id']
+        second = self.client.post('/store/carts/').json()['id']
+        self.assertEqual(self.add_item(first).status_code, 201)
+        self.assertEqual(self.add_item(second).status_code, 201)
+        self.assertEqual(
+            set(IdempotencyKey.objects.values_list('scope', flat=True)),
+            {f'cart:{first}', f'cart:{second}'})
+
+
+@override_settings(THROTTLING={})
+class StockTests(TestCase):
+    """ This class checks that the product endpoints return the current stock from the ledger. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('stocker', 'stocker@example.com', 'stocker')
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.order_by('id').first()
+        inventory.set_stock({self.product.id: 10})
+        inventory.record_movements(StockMovement.KIND_SALE, {self.product.id: -4})
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.admin)}'}
+
+    def get_inventory(self, path, **extra):
+        data = self.client.get(path, **extra).json()
+        for product in data.get('results', [data]):
+            if product['id'] == self.product.id:
+                return product['inventory']
+
+    def test_product_endpoints_return_current_stock(self):
+        self.assertEqual(inventory.get_stock([self.product.id]), {self.product.id: 6})
+        for path in ['/store/products/?page_size=100', f'/store/products/{self.product.id}/',
+                     '/store/async/products/?page_size=100', f'/store/async/products/{self.product.id}/']:
+            self.assertEqual(self.get_inventory(path), 6, path)
+
+    def test_low_stock_report_returns_current_stock(self):
+        threshold = self.product.collection.low_stock_threshold
+        inventory.set_stock({self.product.id: max(threshold - 1, 0)})
+        self.assertEqual(
+            self.get_inventory('/store/products/low-stock/', **self.auth),
+            max(threshold - 1, 0))
+
+    def test_update_returns_new_stock(self):
+        response = self.client.patch(
+            f'/store/products/{self.product.id}/', {'inventory': 20},
+            content_type='application/json', **self.auth)
+        self.assertEqual(response.json()['inventory'], 20)
+        self.assertEqual(self.get_inventory(f'/store/products/{self.product.id}/'), 20)
+
+    def settle(self):
+        """ Makes the movements recorded so far old enough to be snapshotted. """
+        StockMovement.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def test_snapshots_keep_the_stock(self):
+        stock = inventory.get_stock(Product.objects.values_list('id', flat=True))
+        self.settle()
+        last_id = StockMovement.objects.filter(product=self.product).order_by('-id').first().id
+        inventory.record_movements(StockMovement.KIND_SALE, {self.product.id: -1})
+        stock[self.product.id] -= 1
+
+        call_command('snapshot_inventory', batch_size=2, stdout=StringIO())
+        # The recent sale is not settled, so it stays out of the snapshot.
+        self.assertEqual(Product.objects.get(pk=self.product.id).inventory_movement_id, last_id)
+        self.assertEqual(inventory.get_stock(stock), stock)
+        self.assertEqual(self.get_inventory(f'/store/products/{self.product.id}/'), 5)
+
+        self.settle()
+        inventory.take_snapshots()
+        self.assertEqual(dict(Product.objects.values_list('id', 'inventory')), stock)
+        self.assertEqual(inventory.get_stock(stock), stock)
+
+    def test_rebuild_replays_the_ledger(self):
+        self.settle()
+        call_command('snapshot_inventory', stdout=StringIO())
+        stock = inventory.get_stock(Product.objects.values_list('id', flat=True))
+        Product.objects.update(inventory=0)
+        first, last = min(stock), max(stock)
+        self.assertEqual(inventory.rebuild_stock(first, last, inventory.get_settled_movement_id()), 5)
+        self.assertEqual(inventory.get_stock(stock), stock)
+
+    def test_admin_sorts_inventory_status_by_low_stock_flag(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/store/product/?o=-3')
+        self.assertEqual(response.status_code, 200)
+        flags = [product.is_low_stock for product in response.context['cl'].result_list]
+        self.assertEqual(flags, sorted(flags, reverse=True))
+        self.assertIn(True, flags)
+
+
+@mock.patch.object(bulk, 'BATCH_SIZE', 2)
+@mock.patch.object(bulk, 'BACKGROUND_THRESHOLD', 3)
+class BulkJobTests(TransactionTestCase):
+    """ This class runs bulk actions in the background, whose thread only sees committed data. """
+
+    def setUp(self):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        self.promotion = Promotion.objects.create(description='Sale', discount=10)
+        # Keep the job threads, so that the tests only read the database
+        # once the thread writing to it has finished.
+        self.threads = []
+        patcher = mock.patch.object(bulk, 'threading', mock.Mock(Thread=self.create_thread))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_thread(self, *args, **kwargs):
+        thread = threading.Thread(*args, **kwargs)
+        self.threads.append(thread)
+        return thread
+
+    def wait(self, job):
+        self.assertEqual(len(self.threads), 1)
+        self.threads[0].join(10)
+        self.assertFalse(self.threads[0].is_alive(), 'The job did not finish.')
+        job.refresh_from_db()
+        return job
+
+    def test_large_selection_runs_in_the_background(self):
+        job = bulk.run('Promote', Product.objects.all(), bulk.apply_promotion(self.promotion.id))
+        job = self.wait(job)
+        self.assertEqual((job.status, job.processed), (BulkJob.STATUS_DONE, 5))
+        self.assertEqual(self.promotion.product_set.count(), 5)
+
+    def test_stale_jobs_are_failed(self):
+        stale = BulkJob.objects.create(
+            description='Stale', total=10,
+            heartbeat_at=timezone.now() - timedelta(seconds=bulk.STALE_AFTER + 1))
+        running = BulkJob.objects.create(description='Running', total=10)
+        self.assertEqual(bulk.fail_stale_jobs(), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, BulkJob.STATUS_FAILED)
+        self.assertEqual(running.status, BulkJob.STATUS_RUNNING)
+
+    def test_failed_job_stops(self):
+        def operation(ids):
+            # Failed as stale while its first batch ran.
+            BulkJob.objects.update(status=BulkJob.STATUS_FAILED)
+            calls.append(ids)
+        calls = []
+        job = self.wait(bulk.run('Stale', Product.objects.all(), operation))
+        self.assertEqual((job.status, job.processed, len(calls)), (BulkJob.STATUS_FAILED, 0, 1))
+
+
+@override_settings(THROTTLING={})
+class RecommendationTests(TestCase):
+    """ This class runs the build_recommendations command and reads its recommendations. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=20, customers=5,
+                     orders=60, seed=1, stdout=StringIO())
+
+    def build(self, **options):
+        output = StringIO()
+        call_command('build_recommendations', stdout=output, **options)
+        return output.getvalue(), set(ProductRecommendation.objects.values_list(
+            'product_id', 'related_product_id', 'score'))
+
+    def test_archived_orders_are_counted(self):
+        _, live = self.build()
+        call_command('archive_orders', months=6, stdout=StringIO())
+        self.assertTrue(ArchivedOrder.objects.exists())
+        _, archived = self.build()
+        self.assertEqual(archived, live)
+
+    def test_shards_are_derived_from_max_pairs(self):
+        _, single = self.build(max_pairs=10 ** 9)
+        output, sharded = self.build(max_pairs=50)
+        self.assertIn('Shard 2/', output)
+        self.assertEqual(sharded, single)
+
+    def test_related_products(self):
+        self.build(top_k=3)
+        product_id = ProductRecommendation.objects.order_by('product_id').values_list('product_id', flat=True)[0]
+        baskets = defaultdict(set)
+        for order_id, other_id in OrderItem.objects.values_list('order_id', 'product_id'):
+            baskets[order_id].add(other_id)
+        expected = Counter(other_id for basket in baskets.values() if product_id in basket
+                           for other_id in basket if other_id != product_id)
+
+        results = self.client.get(f'/store/products/{product_id}/related/').json()
+        scores = [result['score'] for result in results]
+        self.assertEqual(len(results), min(3, len(expected)))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(scores[0], max(expected.values()))
+        for result in results:
+            self.assertEqual(result['score'], expected[result['product']['id']])
+
+
+@override_settings(THROTTLING={})
+class SalesAnalyticsTests(TestCase):
+    """ This class checks that the sales rollups follow the orders and feed the analytics endpoint. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=20, customers=5,
+                     orders=40, days=10, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('analyst', 'analyst@example.com', 'analyst')
+        cls.days = {timezone.localdate(placed_at)
+                    for placed_at in Order.objects.values_list('placed_at', flat=True)}
+
+    def rebuild(self):
+        for day in self.days:
+            rebuild_day(day)
+
+    def get_rollups(self):
+        return set(SalesRollup.objects
+                   .filter(order_count__gt=0)
+                   .values_list('day', 'product_id', 'units', 'revenue', 'order_count'))
+
+    def test_payment_changes_update_the_rollups(self):
+        self.rebuild()
+        pending = Order.objects.exclude(payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .filter(items__isnull=False).first()
+        pending.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        pending.save()
+        complete = Order.objects.filter(payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .exclude(pk=pending.pk).first()
+        complete.payment_status = Order.PAYMENT_STATUS_FAILED
+        complete.save()
+
+        incremental = self.get_rollups()
+        self.rebuild()
+        self.assertEqual(self.get_rollups(), incremental)
+
+    def test_report_matches_the_orders(self):
+        self.rebuild()
+        start, end = min(self.days), max(self.days)
+        response = self.client.get(
+            f'/store/analytics/sales/?start={start}&end={end}&group_by=collection',
+            HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.admin)}')
+        self.assertEqual(response.status_code, 200)
+        report = {row['collection_id']: row['units'] for row in response.json()['results']}
+        expected = dict(OrderItem.objects
+                        .filter(order__payment_status=Order.PAYMENT_STATUS_COMPLETE)
+                        .values_list('product__collection_id')
+                        .annotate(units=Sum('quantity'))
+                        .order_by())
+        self.assertEqual(report, expected)
+
+
+@override_settings(THROTTLING={})
+class LowStockTests(TestCase):
+    """ This class checks the low stock flag, its alerts and the low stock report. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=15, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('keeper', 'keeper@example.com', 'keeper')
+
+    def setUp(self):
+        cache.clear()
+        self.product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        inventory.set_stock({product_id: 50 for product_id in self.product_ids})
+        self.alerts = []
+        inventory_low.connect(self.record_alert)
+        self.addCleanup(inventory_low.disconnect, self.record_alert)
+
+    def record_alert(self, sender, product_ids, **kwargs):
+        self.alerts.append(product_ids)
+
+    def test_alert_is_sent_once_per_crossing(self):
+        product = Product.objects.get(pk=self.product_ids[0])
+        inventory.record_movements(StockMovement.KIND_SALE, {product.id: -45})
+        self.assertEqual(self.alerts, [[product.id]])
+        self.assertTrue(Product.objects.get(pk=product.id).is_low_stock)
+
+        inventory.record_movements(StockMovement.KIND_SALE, {product.id: -1})
+        product.refresh_from_db()
+        product.title = 'Renamed'
+        product.save()
+        self.assertEqual(self.alerts, [[product.id]])
+
+        inventory.record_movements(StockMovement.KIND_RECEIPT, {product.id: 20})
+        self.assertFalse(Product.objects.get(pk=product.id).is_low_stock)
+        inventory.record_movements(StockMovement.KIND_SALE, {product.id: -20})
+        self.assertEqual(self.alerts, [[product.id], [product.id]])
+
+    def test_threshold_change_alerts_the_crossed_products(self):
+        product = Product.objects.get(pk=self.product_ids[0])
+        collection = product.collection
+        collection.low_stock_threshold = 60
+        collection.save()
+        expected = list(Product.objects.filter(collection=collection).values_list('id', flat=True))
+        self.assertEqual(sorted(self.alerts[0]), sorted(expected))
+        self.assertEqual(Product.objects.filter(is_low_stock=True).count(), len(expected))
+
+    def test_report_pages_by_cursor(self):
+        low = self.product_ids[:12]
+        inventory.set_stock({product_id: 1 for product_id in low})
+        self.assertEqual(self.client.get('/store/products/low-stock/').status_code, 401)
+
+        auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.admin)}'}
+        path, pages, ids = '/store/products/low-stock/', 0, []
+        while path:
+            data = self.client.get(path, **auth).json()
+            ids.extend(product['id'] for product in data['results'])
+            self.assertTrue(all(product['inventory'] == 1 for product in data['results']))
+            path, pages = data['next'], pages + 1
+        self.assertEqual(ids, low)
+        self.assertEqual(pages, 2)
+
+
+@override_settings(THROTTLING={})
+class AsyncViewTests(TestCase):
+    """ This class checks that the async read views answer like their sync counterparts. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=20, customers=3,
+                     orders=10, seed=1, stdout=StringIO())
+        product = Product.objects.order_by('id').first()
+        for rating in [5, 3, 4]:
+            Review.objects.create(product=product, name='Reviewer',
+                                  description='Review', rating=rating)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertSameResponse(self, path):
+        sync = self.client.get(f'/store/{path}')
+        asynchronous = self.client.get(f'/store/async/{path}')
+        self.assertEqual(asynchronous.status_code, sync.status_code, path)
+        sync, asynchronous = sync.json(), asynchronous.json()
+        if isinstance(sync, dict) and 'results' in sync:
+            for data in [sync, asynchronous]:
+                # The links point to their own endpoint.
+                data.pop('next', None)
+                data.pop('previous', None)
+        self.assertEqual(asynchronous, sync, path)
+
+    def test_catalog_reads(self):
+        product = Product.objects.order_by('id').first()
+        collection = product.collection
+        review = product.reviews.order_by('id').first()
+        for path in [
+            'products/', 'products/?page=2', f'products/?collection_id={collection.id}',
+            'products/?ordering=-unit_price', 'products/?search=a',
+            f'products/{product.id}/', 'products/0/',
+            f'products/{product.id}/reviews/', f'products/{product.id}/reviews/{review.id}/',
+            'collections/', f'collections/{collection.id}/',
+        ]:
+            self.assertSameResponse(path)
+
+    def test_cart_reads(self):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        for product in Product.objects.order_by('id')[:3]:
+            self.client.post(f'/store/carts/{cart_id}/items/',
+                             {'product_id': product.id, 'quantity': 2},
+                             content_type='application/json')
+        self.assertSameResponse(f'carts/{cart_id}/')
+        self.assertSameResponse('carts/00000000-0000-0000-0000-000000000000/')
+
+
+@override_settings(THROTTLING={})
+class SparseFieldsetTests(TestCase):
+    """ This class checks the ?fields= and ?exclude= selections of the API. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=2,
+                     orders=5, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('shaper', 'shaper@example.com', 'shaper')
+
+    def setUp(self):
+        cache.clear()
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.admin)}'}
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, **self.auth)
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def test_fields_selects_the_fields_and_columns(self):
+        response, queries = self.get('/store/products/?fields=id,title')
+        self.assertEqual(response.status_code, 200)
+        for product in response.json()['results']:
+            self.assertEqual(set(product), {'id', 'title'})
+        selects = [sql for sql in queries if sql.startswith('SELECT "store_product"."id"')]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNotIn('"store_product"."description"', sql)
+
+    def test_exclude_drops_the_fields(self):
+        full = self.client.get('/store/products/', **self.auth).json()['results'][0]
+        response, _ = self.get('/store/products/?exclude=description,inventory')
+        product = response.json()['results'][0]
+        self.assertEqual(set(product), set(full) - {'description', 'inventory'})
+
+        response, queries = self.get('/store/orders/?exclude=items')
+        self.assertTrue(response.json())
+        self.assertNotIn('items', response.json()[0])
+        self.assertFalse([sql for sql in queries if 'store_orderitem' in sql])
+
+    def test_unknown_fields_are_rejected(self):
+        response, _ = self.get('/store/products/?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown fields: secret.', response.json()['fields'][0])
+
+
+@override_settings(THROTTLING={})
+class PaginationTests(TestCase):
+    """ This class checks the page size cap and the count strategy of the product lists. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=110, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_size_is_capped(self):
+        for path in ['/store/products/', '/store/async/products/']:
+            for query, expected in [('page_size=500', 100), ('page_size=5', 5),
+                                    ('page_size=0', 10), ('page_size=many', 10)]:
+                data = self.client.get(f'{path}?{query}').json()
+                self.assertEqual(len(data['results']), expected, (path, query))
+                self.assertEqual(data['count'], 110, (path, query))
+            self.assertEqual(self.client.get(f'{path}?page=12').status_code, 404, path)
+
+    def test_exact_counts_are_cached(self):
+        queryset = Product.objects.filter(collection__isnull=False)
+        self.assertEqual(pagination.count_objects(queryset), (110, False))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(pagination.count_objects(queryset), (110, False))
+        # PostgreSQL still asks the planner for its estimate first.
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_estimated_counts_serve_pages_past_the_estimate(self):
+        queryset = Product.objects.order_by('id')
+        estimated = pagination.EstimatedCountPaginator(queryset, 10, counted=(25, True))
+        self.assertEqual(estimated.num_pages, 3)
+        self.assertEqual(len(estimated.page(11)), 10)
+
+        exact = pagination.EstimatedCountPaginator(queryset, 10, counted=(25, False))
+        with self.assertRaises(EmptyPage):
+            exact.page(4)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Estimates come from the PostgreSQL planner.')
+    def test_large_lists_are_estimated(self):
+        with mock.patch.object(pagination, 'ESTIMATE_THRESHOLD', 1), \
+                CaptureQueriesContext(connection) as context:
+            count, estimated = pagination.count_objects(Product.objects.all())
+        self.assertTrue(estimated)
+        self.assertGreater(count, 0)
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+
+
+@override_settings(THROTTLING={})
+class ReviewTests(TestCase):
+    """ This class checks the rating counters of products and the keyset pages of reviews. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=3, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.product = Product.objects.order_by('id').first()
+        today = timezone.localdate()
+        for index in range(25):
+            review = Review.objects.create(product=cls.product, name='Reviewer',
+                                           description='Review', rating=index % 5 + 1)
+            # Several reviews per day, so that pages end inside a day.
+            Review.objects.filter(pk=review.pk).update(date=today - timedelta(days=index % 4))
+
+    def setUp(self):
+        cache.clear()
+
+    def get_product(self):
+        return self.client.get(f'/store/products/{self.product.id}/').json()
+
+    def test_rating_counters(self):
+        product = self.get_product()
+        self.assertEqual(product['review_count'], 25)
+        self.assertEqual(product['average_rating'], 3.0)
+
+        review = self.product.reviews.filter(rating=1).first()
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.get_product()['average_rating'], 3.16)
+        self.product.reviews.all().delete()
+        product = self.get_product()
+        self.assertEqual((product['review_count'], product['average_rating']), (0, None))
+
+    def test_pages_follow_the_date_and_id(self):
+        expected = list(self.product.reviews.order_by('-date', '-id').values_list('id', flat=True))
+        for prefix in ['/store/', '/store/async/']:
+            path, ids = f'{prefix}products/{self.product.id}/reviews/?page_size=7', []
+            while path:
+                data = self.client.get(path).json()
+                ids.extend(review['id'] for review in data['results'])
+                path = data['next']
+            self.assertEqual(ids, expected, prefix)
+        response = self.client.get(f'/store/products/{self.product.id}/reviews/?cursor=bad')
+        self.assertEqual(response.status_code, 404)
+
+    def test_mixed_directions_seek_field_by_field(self):
+        paginator = ReviewPagination()
+        paginator.ordering = ('date', '-id')
+        expected = list(self.product.reviews.order_by('date', '-id').values_list('id', flat=True))
+        request, ids = RequestFactory().get('/', {'page_size': 6}), []
+        while request:
+            page = paginator.paginate_queryset(self.product.reviews.all(), Request(request))
+            ids.extend(review.id for review in page)
+            request = paginator.next_link and RequestFactory().get(paginator.next_link)
+        self.assertEqual(ids, expected)
+
+
+@override_settings(THROTTLING={}, FACETS={'PRICE_BUCKETS': [25, 50]})
+class FacetTests(TestCase):
+    """ This class checks the facet counts of the product list. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=3, products=40, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def get_expected(self, products):
+        collections = Counter(products.values_list('collection_id', flat=True))
+        prices = list(products.values_list('unit_price', flat=True))
+        return {
+            'collection': sorted(
+                [{'id': collection.id, 'title': collection.title, 'count': collections[collection.id]}
+                 for collection in Collection.objects.filter(pk__in=collections)],
+                key=lambda facet: facet['title']),
+            'price': [
+                {'min': None, 'max': 25, 'count': sum(price < 25 for price in prices)},
+                {'min': 25, 'max': 50, 'count': sum(25 <= price < 50 for price in prices)},
+                {'min': 50, 'max': None, 'count': sum(price >= 50 for price in prices)},
+            ],
+        }
+
+    def test_facets_count_the_filtered_products(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/store/products/?unit_price__gt=20&facets=collection,price')
+        self.assertEqual(response.json()['facets'],
+                         self.get_expected(Product.objects.filter(unit_price__gt=20)))
+        facet_queries = [query for query in context.captured_queries if 'FILTER (WHERE' in query['sql']]
+        self.assertEqual(len(facet_queries), 1)
+
+        response = self.client.get('/store/products/?facets=price')
+        self.assertEqual(list(response.json()['facets']), ['price'])
+        self.assertNotIn('facets', self.client.get('/store/products/').json())
+
+    def test_changes_are_counted(self):
+        path = '/store/products/?facets=price'
+        self.client.get(path)
+        product = Product.objects.filter(unit_price__lt=50).order_by('unit_price').first()
+        product.unit_price = 60
+        product.save()
+        self.assertEqual(self.client.get(path).json()['facets']['price'],
+                         self.get_expected(Product.objects.all())['price'])
+
+    def test_unknown_facets_are_rejected(self):
+        response = self.client.get('/store/products/?facets=price,colour')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown facets: colour.', response.json()['facets'][0])
+
+
+CART_BACKENDS = ['orm', 'cache']
+
+
+@override_settings(THROTTLING={})
+class CartBackendTests(TestCase):
+    """ This class runs the cart endpoints and the checkout against every cart backend. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.products = list(Product.objects.order_by('id')[:2])
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'shopper')
+
+    def setUp(self):
+        cache.clear()
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.user)}'}
+
+    def add_item(self, cart_id, product, quantity):
+        return self.client.post(f'/store/carts/{cart_id}/items/',
+                                {'product_id': product.id, 'quantity': quantity},
+                                content_type='application/json')
+
+    def get_quantities(self, cart_id):
+        items = self.client.get(f'/store/carts/{cart_id}/').json()['items']
+        return {item['product']['id']: item['quantity'] for item in items}
+
+    def test_cart_endpoints(self):
+        first, second = self.products
+        for backend in CART_BACKENDS:
+            with self.subTest(backend), override_settings(CARTS={'BACKEND': backend}):
+                cart_id = self.client.post('/store/carts/').json()['id']
+                self.assertEqual(Cart.objects.filter(pk=cart_id).exists(), backend == 'orm')
+                self.assertEqual(self.add_item(cart_id, first, 2).status_code, 201)
+                self.add_item(cart_id, first, 3)
+                item_id = self.add_item(cart_id, second, 1).json()['id']
+                self.assertEqual(self.get_quantities(cart_id), {first.id: 5, second.id: 1})
+
+                path = f'/store/carts/{cart_id}/items/{item_id}/'
+                self.client.patch(path, {'quantity': 4}, content_type='application/json')
+                self.assertEqual(self.client.get(path).json()['quantity'], 4)
+                self.assertEqual(self.client.delete(path).status_code, 204)
+                self.assertEqual(self.client.get(path).status_code, 404)
+                self.assertEqual(self.get_quantities(cart_id), {first.id: 5})
+
+                self.assertEqual(self.client.delete(f'/store/carts/{cart_id}/').status_code, 204)
+                self.assertEqual(self.client.get(f'/store/carts/{cart_id}/').status_code, 404)
+                self.assertEqual(self.add_item(cart_id, first, 1).status_code, 404)
+
+    def test_checkout(self):
+        first, second = self.products
+        for backend in CART_BACKENDS:
+            with self.subTest(backend), override_settings(CARTS={'BACKEND': backend}):
+                cart_id = self.client.post('/store/carts/').json()['id']
+                self.add_item(cart_id, first, 2)
+                self.add_item(cart_id, second, 1)
+                stock = inventory.get_stock([first.id, second.id])
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post('/store/orders/', {'cart_id': cart_id},
+                                                content_type='application/json', **self.auth)
+                self.assertEqual(response.status_code, 200)
+                order = Order.objects.get(pk=response.json()['id'])
+                self.assertEqual(
+                    dict(order.items.values_list('product_id', 'quantity')),
+                    {first.id: 2, second.id: 1})
+                self.assertEqual(inventory.get_stock([first.id, second.id]),
+                                 {first.id: stock[first.id] - 2, second.id: stock[second.id] - 1})
+                self.assertEqual(self.client.get(f'/store/carts/{cart_id}/').status_code, 404)
+
+
+@override_settings(THROTTLING={})
+class CartMergeTests(TestCase):
+    """ This class checks the merge of anonymous carts into the customer's cart. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=5, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.products = list(Product.objects.order_by('id')[:3])
+        cls.user = User.objects.create_user('merger', 'merger@example.com', 'merger')
+        cls.other = User.objects.create_user('other', 'other@example.com', 'other')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(user)}'}
+
+    def create_cart(self, quantities):
+        cart_id = self.client.post('/store/carts/').json()['id']
+        for product, quantity in zip(self.products, quantities):
+            if quantity:
+                self.client.post(f'/store/carts/{cart_id}/items/',
+                                 {'product_id': product.id, 'quantity': quantity},
+                                 content_type='application/json')
+        return cart_id
+
+    def merge(self, cart_id, user):
+        return self.client.post(f'/store/carts/{cart_id}/merge/', **self.get_auth(user))
+
+    def get_quantities(self, data):
+        return {item['product']['id']: item['quantity'] for item in data['items']}
+
+    def test_quantities_are_added_up(self):
+        first, second, third = self.products
+        for backend in CART_BACKENDS:
+            with self.subTest(backend), override_settings(CARTS={'BACKEND': backend}):
+                customer_cart = self.client.get('/store/carts/mine/', **self.get_auth(self.user)).json()['id']
+                self.client.post(f'/store/carts/{customer_cart}/items/',
+                                 {'product_id': first.id, 'quantity': 1},
+                                 content_type='application/json')
+                anonymous = self.create_cart([2, 3, 0])
+
+                response = self.merge(anonymous, self.user)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['id'], customer_cart)
+                self.assertEqual(self.get_quantities(response.json()), {first.id: 3, second.id: 3})
+                self.assertEqual(self.client.get(f'/store/carts/{anonymous}/').status_code, 404)
+                mine = self.client.get('/store/carts/mine/', **self.get_auth(self.user)).json()
+                self.assertEqual(self.get_quantities(mine), {first.id: 3, second.id: 3})
+
+                # Items added after the merge go to the customer's cart as usual.
+                self.client.post(f'/store/carts/{customer_cart}/items/',
+                                 {'product_id': third.id, 'quantity': 1},
+                                 content_type='application/json')
+                self.assertEqual(len(self.get_quantities(
+                    self.client.get(f'/store/carts/{customer_cart}/').json())), 3)
+                self.client.delete(f'/store/carts/{customer_cart}/')
+
+    def test_first_cart_becomes_the_customers(self):
+        first, second, _ = self.products
+        for backend in CART_BACKENDS:
+            with self.subTest(backend), override_settings(CARTS={'BACKEND': backend}):
+                anonymous = self.create_cart([2, 1, 0])
+                response = self.merge(anonymous, self.user)
+                self.assertEqual(response.json()['id'], anonymous)
+                self.assertEqual(self.merge(anonymous, self.user).status_code, 200)
+                mine = self.client.get('/store/carts/mine/', **self.get_auth(self.user)).json()
+                self.assertEqual(mine['id'], anonymous)
+                self.assertEqual(self.get_quantities(mine), {first.id: 2, second.id: 1})
+
+                self.assertEqual(self.merge(anonymous, self.other).status_code, 404)
+                missing = '00000000-0000-0000-0000-000000000000'
+                self.assertEqual(self.merge(missing, self.user).status_code, 404)
+                self.assertEqual(self.client.post(f'/store/carts/{anonymous}/merge/').status_code, 401)
+                self.client.delete(f'/store/carts/{anonymous}/')
+
+
+@override_settings(THROTTLING={})
+class ArchiveTests(TestCase):
+    """ This class checks that archived orders are still served and counted like live ones. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=10, customers=3,
+                     orders=60, days=365, seed=1, stdout=StringIO())
+        cls.admin = User.objects.create_superuser('archivist', 'archivist@example.com', 'archivist')
+        cls.days = {timezone.localdate(placed_at)
+                    for placed_at in Order.objects.values_list('placed_at', flat=True)}
+
+    def get_histories(self):
+        auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.admin)}'}
+        return {customer_id: self.client.get(f'/store/customers/{customer_id}/history/', **auth).json()
+                for customer_id in Customer.objects.values_list('id', flat=True)}
+
+    def get_rollups(self):
+        for day in self.days:
+            rebuild_day(day)
+        return set(SalesRollup.objects
+                   .filter(order_count__gt=0)
+                   .values_list('day', 'product_id', 'units', 'revenue', 'order_count'))
+
+    def test_archived_orders_round_trip(self):
+        histories, rollups = self.get_histories(), self.get_rollups()
+        archivable = Order.objects.filter(
+            payment_status=Order.PAYMENT_STATUS_COMPLETE,
+            placed_at__lt=timezone.now() - timedelta(days=7 * 31))
+        expected = set(archivable.values_list('id', flat=True))
+        self.assertTrue(expected)
+
+        call_command('archive_orders', months=6, batch_size=7, stdout=StringIO())
+        archived = set(ArchivedOrder.objects.values_list('id', flat=True))
+        self.assertTrue(expected <= archived)
+        self.assertFalse(OrderItem.objects.filter(order_id__in=archived).exists())
+        self.assertFalse(Order.objects.filter(pk__in=archived).exists())
+
+        self.assertEqual(self.get_histories(), histories)
+        self.assertEqual(self.get_rollups(), rollups)
+
+
+class ProductCacheTests(TestCase):
+    """ This class checks the lookups, bounds and invalidation of the product cache. """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=2, products=10, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+        cls.product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+        self.cache = product_cache.ProductCache(max_bytes=10 ** 6, ttl=60)
+
+    def test_lookups_are_cached(self):
+        products = self.cache.get_products(self.product_ids[:3])
+        self.assertEqual({product_id: product.title for product_id, product in products.items()},
+                         dict(Product.objects.filter(pk__in=self.product_ids[:3])
+                              .values_list('id', 'title')))
+        with self.assertNumQueries(0):
+            self.cache.get_products(self.product_ids[:2])
+        with self.assertNumQueries(1):
+            self.cache.get_products(self.product_ids[2:4] + [0])
+        self.assertEqual(self.cache.stats()['hits'], 3)
+        self.assertEqual(self.cache.stats()['misses'], 5)
+
+    def test_size_and_age_are_bounded(self):
+        # Records of the same size, three of which fit in the cache.
+        Product.objects.update(title='Product', unit_price=10)
+        record = Product.objects.values_list(*product_cache.FIELDS).get(pk=self.product_ids[0])
+        bounded = product_cache.ProductCache(max_bytes=product_cache.get_size(record) * 3, ttl=60)
+        for product_id in self.product_ids[:3] + self.product_ids[:1] + self.product_ids[3:4]:
+            bounded.get_products([product_id])
+        self.assertEqual(set(bounded.entries), {self.product_ids[0], self.product_ids[2], self.product_ids[3]})
+        self.assertLessEqual(bounded.size, bounded.max_bytes)
+
+        with mock.patch.object(product_cache, 'monotonic', return_value=time.monotonic() + 61), \
+                self.assertNumQueries(1):
+            bounded.get_products(self.product_ids[:1])
+
+    def test_changes_invalidate_the_cache(self):
+        product = Product.objects.get(pk=self.product_ids[0])
+        self.cache.get_products([product.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            product.title = 'Renamed'
+            product.save()
+        self.assertEqual(self.cache.get_products([product.id])[product.id].title, 'Renamed')
+
+        self.cache.get_products([product.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=product.id).update(unit_price=1)
+            product_cache.invalidate()
+        self.assertEqual(self.cache.get_products([product.id])[product.id].unit_price, 1)
+
+
+@override_settings(CATALOG_SNAPSHOT={'PAGE_SIZE': 5})
+class CatalogSnapshotTests(TestCase):
+    """
+    This class builds catalog snapshots. Pages are rendered in this process,
+    since the worker processes of the command do not see the test database.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_store', collections=3, products=23, customers=1,
+                     orders=1, seed=1, stdout=StringIO())
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+
+    def build(self, page_size=5, full=False):
+        def render_pages(pages):
+            self.rendered = pages
+            return [catalog.render_page(kind, page, page_size, self.root) for kind, page in pages]
+        return catalog.build(self.root, page_size, render_pages, full)
+
+    def read_manifest(self):
+        return json.loads((self.root / catalog.MANIFEST).read_text())
+
+    def count_pages(self, model):
+        return len({object_id // 5 for object_id in model.objects.values_list('id', flat=True)})
+
+    def test_pages_match_the_manifest(self):
+        pages = self.count_pages(Product) + self.count_pages(Collection)
+        self.assertEqual(self.build(), (pages, 0, 0))
+        manifest = self.read_manifest()
+        self.assertEqual(manifest['products']['count'], 23)
+        self.assertEqual(manifest['collections']['count'], 3)
+        for kind, model in [('products', Product), ('collections', Collection)]:
+            ids = []
+            for entry in manifest[kind]['pages']:
+                content = (self.root / entry['path']).read_bytes()
+                self.assertEqual(hashlib.sha256(content).hexdigest(), entry['sha256'])
+                results = json.loads(content)['results']
+                self.assertEqual(len(results), entry['count'])
+                self.assertTrue(all(result['id'] // 5 == entry['page'] for result in results))
+                ids.extend(result['id'] for result in results)
+            self.assertEqual(ids, list(model.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_only_changed_pages_are_rendered(self):
+        pages = self.count_pages(Product) + self.count_pages(Collection)
+        self.build()
+        before = self.read_manifest()
+        self.assertEqual(self.build(), (0, pages, 0))
+
+        product = Product.objects.order_by('id').first()
+        product.title = 'Renamed'
+        product.save()
+        self.build()
+        self.assertEqual(self.rendered, [('products', product.id // 5)])
+        after = self.read_manifest()
+        changed = [entry for entry in after['products']['pages']
+                   if entry not in before['products']['pages']]
+        self.assertEqual([entry['page'] for entry in changed], [product.id // 5])
+
+        # Sales are only appended to the ledger, yet they change the page.
+        before = self.read_manifest()
+        inventory.record_movements(StockMovement.KIND_SALE, {product.id: -1})
+        self.build()
+        self.assertEqual(self.rendered, [('products', product.id // 5)])
+        results = json.loads((self.root / catalog.get_path('products', product.id // 5)).read_text())['results']
+        self.assertEqual({result['id']: result['inventory'] for result in results}[product.id],
+                         inventory.get_stock([product.id])[product.id])
+
+        # Pages of another size hold other objects, so they are all rendered again.
+        self.assertEqual(self.build(page_size=7)[1], 0)
+
+    def test_emptied_pages_are_removed(self):
+        last = Product.objects.order_by('-id').first()
+        extra = Product.objects.create(
+            id=(last.id // 5 + 2) * 5, title='Extra', slug='extra', unit_price=1,
+            inventory=1, collection=last.collection)
+        self.build()
+        page = extra.id // 5
+        path = self.root / catalog.get_path('products', page)
+        self.assertTrue(path.exists())
+
+        extra.delete()
+        self.assertEqual(self.build()[2], 1)
+        # The products_count of its collection changed.
+        self.assertEqual(self.rendered, [('collections', extra.collection_id // 5)])
+        self.assertFalse(path.exists())
+        self.assertNotIn(page, [entry['page'] for entry in self.read_manifest()['products']['pages']])
@@ -1,14 +1,16 @@
 from django.urls import path
 from django.urls.conf import include
 from rest_framework_nested import routers
-from . import views
+from . import async_views, views
 
 router = routers.DefaultRouter()
 router.register('products', views.ProductViewSet, basename='products')
 router.register('collections', views.CollectionViewSet)
-router.register('carts', views.CartViewSet)
+router.register('carts', views.CartViewSet, basename='cart')
 router.register('customers', views.CustomerViewSet)
 router.register('orders', views.OrderViewSet, basename='orders')
+router.register('analytics/sales', views.SalesAnalyticsViewSet,
+                basename='sales-analytics')
 
 products_router = routers.NestedDefaultRouter(
     router, 'products', lookup='product')
@@ -18,5 +20,25 @@ products_router.register('reviews', views.ReviewViewSet,
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
+# Async read-only counterparts of the list and retrieve actions, for ASGI deployments.
+async_urlpatterns = [
+    path('products/', async_views.ProductListView.as_view(),
+         name='async-products-list'),
+    path('products/<int:pk>/', async_views.ProductDetailView.as_view(),
+         name='async-products-detail'),
+    path('products/<int:product_pk>/reviews/', async_views.ReviewListView.as_view(),
+         name='async-product-reviews-list'),
+    path('products/<int:product_pk>/reviews/<int:pk>/', async_views.ReviewDetailView.as_view(),
+         name='async-product-reviews-detail'),
+    path('collections/', async_views.CollectionListView.as_view(),
+         name='async-collections-list'),
+    path('collections/<int:pk>/', async_views.CollectionDetailView.as_view(),
+         name='async-collections-detail'),
+    path('carts/<uuid:pk>/', async_views.CartDetailView.as_view(),
+         name='async-carts-detail'),
+]
+
 # URLConf
-urlpatterns = router.urls + products_router.urls + carts_router.urls
+urlpatterns = router.urls + products_router.urls + carts_router.urls + [
+    path('async/', include(async_urlpatterns)),
+]
@@ -5,29 +5,44 @@ Each view is mapped to a URL path and the path to the view
 is defined in the store/urls.py module.
 """
 
-from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from store.pagination import DefaultPagination
-from django.db.models.aggregates import Count
+from uuid import UUID
+
+from core.coalescing import CoalescingListMixin
+from store.permissions import IsAdminOrReadOnly, ViewCustomerHistoryPermission
+from store.conditional import ConditionalGetMixin
+from store.facets import FacetMixin
+from store.idempotency import IdempotencyMixin
+from store.fieldsets import SparseFieldsetMixin
+from store.pagination import DefaultPagination, KeysetPagination, ReviewPagination
+from django.db.models import Prefetch
+from django.db.models.aggregates import Count, Sum
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.decorators import action, permission_classes
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, UpdateModelMixin
-from rest_framework.permissions import AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import status
+from . import carts, inventory
 from .filters import ProductFilter
-from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
+from .models import ArchivedOrder, Collection, Customer, Order, OrderItem, Product, ProductRecommendation, Review, SalesRollup
+from .serializers import AddCartItemSerializer, ArchivedOrderSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, LowStockProductSerializer, OrderSerializer, ProductRecommendationSerializer, ProductSerializer, ReviewSerializer, SalesQuerySerializer, UpdateCartItemSerializer, UpdateOrderSerializer
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CoalescingListMixin, ConditionalGetMixin, FacetMixin, SparseFieldsetMixin, ModelViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
     for the Product model.
+
+    List and retrieve responses carry ETag and Last-Modified headers, and
+    revalidations of unchanged products are answered with 304 Not Modified.
+    ?fields= and ?exclude= select the fields of the response. Concurrent
+    identical anonymous list requests are answered by a single view run.
+    ?facets=collection,price adds the product counts per collection and
+    per price bucket to the list.
     """
-    queryset = Product.objects.all()
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = ProductFilter
@@ -35,6 +50,13 @@ class ProductViewSet(ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
+    throttle_scope = 'catalog'
+
+    def get_queryset(self):
+        queryset = Product.objects.all()
+        if self.wants_field('inventory'):
+            queryset = inventory.with_stock(queryset)
+        return queryset
 
     def get_serializer_context(self):
         """ Additional context provided to the serializer. """
@@ -51,8 +73,35 @@ class ProductViewSet(ModelViewSet):
 
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=True)
+    def related(self, request, pk):
+        """
+        Returns the products that are most often bought together with a product.
+
+        The list is read from the precomputed recommendation table, which is
+        rebuilt offline by the build_recommendations management command.
+        """
+        recommendations = ProductRecommendation.objects \
+            .filter(product_id=pk) \
+            .select_related('related_product') \
+            .order_by('-score', 'related_product_id')
+        serializer = ProductRecommendationSerializer(recommendations, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, url_path='low-stock', permission_classes=[IsAdminUser],
+            filter_backends=[], pagination_class=KeysetPagination)
+    def low_stock(self, request):
+        """
+        Returns the products whose inventory is below their collection's
+        low stock threshold, paginated by product ID.
+        """
+        products = inventory.with_stock(Product.objects.filter(is_low_stock=True))
+        page = self.paginate_queryset(products)
+        serializer = LowStockProductSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, ModelViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
     for the Collection model.
@@ -74,12 +123,15 @@ class CollectionViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ConditionalGetMixin, ModelViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
     for the Review model.
+
+    Reviews are listed newest first, a page at a time.
     """
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
 
     def get_queryset(self):
         """ Returns the reviews for a product. """
@@ -90,23 +142,79 @@ class ReviewViewSet(ModelViewSet):
         return {'product_id': self.kwargs['product_pk']}
 
 
-class CartViewSet(CreateModelMixin,
-                  RetrieveModelMixin,
-                  DestroyModelMixin,
-                  GenericViewSet):
+def get_cart_id(value):
+    """ Returns the cart ID of a URL, or raises NotFound when it is not a UUID. """
+    try:
+        return UUID(str(value))
+    except ValueError:
+        raise NotFound()
+
+
+class CartViewSet(IdempotencyMixin, GenericViewSet):
     """ This class defines the create, retrieve, and destroy actions
-    for the Cart model.
+    for carts, which are kept by the backend of store/carts.py, and the
+    cart of the logged-in customer. Creates and merges sent with an
+    Idempotency-Key header are only run once.
     """
-    queryset = Cart.objects.prefetch_related('items__product').all()
     serializer_class = CartSerializer
+    idempotent_actions = ['create', 'merge']
+    throttle_scope = 'cart_create'
+
+    def get_throttles(self):
+        """ Only cart creation is throttled, since it stores a cart per request. """
+        if self.action != 'create':
+            return []
+        return super().get_throttles()
+
+    def create(self, request):
+        cart = carts.get_store().create()
+        return Response(CartSerializer(cart).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk):
+        cart = carts.get_store().get(get_cart_id(pk))
+        if cart is None:
+            raise NotFound()
+        return Response(CartSerializer(cart).data)
+
+    def destroy(self, request, pk):
+        if not carts.get_store().delete(get_cart_id(pk)):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_customer_id(self):
+        return Customer.objects.only('id').get(user_id=self.request.user.id).id
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def mine(self, request):
+        """
+        Returns the cart of the logged-in customer, which is created if needed.
+        """
+        store = carts.get_store()
+        cart = store.get(store.get_customer_cart(self.get_customer_id()))
+        return Response(CartSerializer(cart).data)
 
+    @action(detail=True, methods=['POST'], permission_classes=[IsAuthenticated])
+    def merge(self, request, pk):
+        """
+        Merges an anonymous cart into the cart of the logged-in customer,
+        adding up the quantities of the products in both, and returns the
+        customer's cart. Clients call it after logging in.
+        """
+        store = carts.get_store()
+        cart_id = store.merge(get_cart_id(pk), self.get_customer_id())
+        if cart_id is None:
+            raise NotFound()
+        return Response(CartSerializer(store.get(cart_id)).data)
 
-class CartItemViewSet(ModelViewSet):
+
+class CartItemViewSet(IdempotencyMixin, GenericViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
-    for the CartItem model.
+    for the items of a cart, which are kept by the backend of store/carts.py.
+    Writes sent with an Idempotency-Key header are only run once.
     """
     http_method_names = ['get', 'post', 'patch', 'delete']
+    idempotent_actions = ['create', 'partial_update', 'destroy']
 
     def get_serializer_class(self):
         """
@@ -120,16 +228,62 @@ class CartItemViewSet(ModelViewSet):
 
     def get_serializer_context(self):
         """ Additional context provided to the serializer. """
-        return {'cart_id': self.kwargs['cart_pk']}
+        return {'cart_id': get_cart_id(self.kwargs['cart_pk'])}
+
+    def get_idempotency_scope(self, request):
+        """ Anonymous keys are scoped to the cart, which only its owner knows. """
+        if request.user.is_authenticated:
+            return super().get_idempotency_scope(request)
+        return f"cart:{get_cart_id(self.kwargs['cart_pk'])}"
+
+    def get_cart(self):
+        cart = carts.get_store().get(get_cart_id(self.kwargs['cart_pk']))
+        if cart is None:
+            raise NotFound()
+        return cart
+
+    def get_item(self):
+        """ Returns the item of the URL, with its product. """
+        try:
+            item_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        for item in self.get_cart().items:
+            if item.id == item_id:
+                return item
+        raise NotFound()
+
+    def list(self, request, cart_pk):
+        return Response(CartItemSerializer(self.get_cart().items, many=True).data)
+
+    def retrieve(self, request, cart_pk, pk):
+        return Response(CartItemSerializer(self.get_item()).data)
+
+    def create(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.save() is None:
+            raise NotFound()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def get_queryset(self):
-        """ Returns the cart items for a cart. """
-        return CartItem.objects \
-            .filter(cart_id=self.kwargs['cart_pk']) \
-            .select_related('product')
+    def partial_update(self, request, cart_pk, pk):
+        serializer = self.get_serializer(self.get_item(), data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.save() is None:
+            raise NotFound()
+        return Response(serializer.data)
 
+    def destroy(self, request, cart_pk, pk):
+        try:
+            item_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        if not carts.get_store().remove_item(get_cart_id(cart_pk), item_id):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CustomerViewSet(ModelViewSet):
+
+class CustomerViewSet(SparseFieldsetMixin, ModelViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
     for the Customer model.
@@ -141,9 +295,18 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
         """
-        Returns the order history for a customer.
+        Returns the order history for a customer, newest first, including
+        the orders moved to the archive by the archive_orders command.
         """
-        return Response('ok')
+        customer = get_object_or_404(Customer, pk=pk)
+        orders = list(Order.objects
+                      .filter(customer=customer)
+                      .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product'))))
+        archived = list(ArchivedOrder.objects.filter(customer=customer))
+        history = list(zip(orders, OrderSerializer(orders, many=True).data)) + \
+            list(zip(archived, ArchivedOrderSerializer(archived, many=True).data))
+        history.sort(key=lambda pair: pair[0].placed_at, reverse=True)
+        return Response([data for _, data in history])
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
@@ -162,10 +325,11 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(IdempotencyMixin, SparseFieldsetMixin, ModelViewSet):
     """
     This class defines the create, retrieve, update, and destroy actions
-    for the Order model.
+    for the Order model. Orders created with an Idempotency-Key header are
+    only created once.
     """
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
 
@@ -200,10 +364,52 @@ class OrderViewSet(ModelViewSet):
     def get_queryset(self):
         """ Returns the orders for a customer. """
         user = self.request.user
+        orders = Order.objects.all()
+        if self.wants_field('items'):
+            orders = orders.prefetch_related(Prefetch(
+                'items', queryset=OrderItem.objects.select_related('product')))
 
         if user.is_staff:
-            return Order.objects.all()
+            return orders
 
         customer_id = Customer.objects.only(
             'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return orders.filter(customer_id=customer_id)
+
+
+class SalesAnalyticsViewSet(GenericViewSet):
+    """
+    This class defines the list action for the sales analytics report.
+
+    The report only reads the SalesRollup table, so it never scans
+    the orders themselves.
+    """
+    pagination_class = DefaultPagination
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        """
+        Returns the units, revenue and order count of a date range
+        grouped by day, collection and/or product.
+
+        The order count is counted once per product, so an order with
+        several products of a collection counts several times when
+        grouping by collection or day.
+        """
+        params = SalesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        groups = params.validated_data['group_by']
+
+        rollups = SalesRollup.objects \
+            .filter(
+                day__gte=params.validated_data['start'],
+                day__lte=params.validated_data['end']) \
+            .values(*groups) \
+            .annotate(
+                units=Sum('units'),
+                revenue=Sum('revenue'),
+                order_count=Sum('order_count')) \
+            .order_by(*groups)
+
+        page = self.paginate_queryset(rollups)
+        return self.get_paginated_response(page)